@@ -1,9 +1,34 @@
+import importlib
+import json
 import os
-import pandas as pd
-import plotly.express as px
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+import uuid
+from concurrent.futures import wait as wait_for_futures
+from functools import partial
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response, Response
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
-import numpy as np
+from dataset_cache import DatasetCache, file_digest, remember_digest, share_digests
+from chunked_upload import OffsetMismatch, UnknownUpload, UploadError, UploadStore, UploadTooLarge
+from ingest import (DEFAULT_BATCH_ROWS, DEFAULT_MAX_CATEGORY_RATIO, DEFAULT_SCHEMA_SAMPLE_ROWS, column_compactor,
+                    compact_frame, frame_schema, infer_schema, iter_excel_batches, list_sheets, log_progress,
+                    read_excel_streaming)
+from chart_cache import ChartCache, chart_key
+from charts import (DEFAULT_HISTOGRAM_BINS, DEFAULT_MAX_POINTS, SERIES_CHART_TYPES, ChartError, build_stats_chart,
+                    chart_spec, figure_html, figure_json, plotly_js_url, render_chart, render_chart_json, series_points,
+                    spec_columns, validate_spec)
+from column_stats import StatsIndexer, read_stats_index, stats_path
+from compression import choose_encoding, compress_chunks
+from instrumentation import MetricsRegistry, finish_request, note, stage, start_request
+from lazy_imports import lazy_import
+from jobs import FINISHED_STATES, JobQueue, QueueFull, batch_chart_job, batch_columns, chart_job, render_charts
+from columnar import (ColumnarConverter, columnar_available, columnar_column_names, columnar_empty_frame, columnar_mask,
+                      columnar_path, read_columnar, write_columnar_batches)
+from query import NO_MATCHING_ROWS, QueryError, coerce_value, predicate_mask, unknown_column
+from shared_cache import SharedCache, SqliteIndex
+from storage import QuotaExceeded, StorageManager, Sweeper
+
+pd = lazy_import('pandas')
 
 UPLOAD_FOLDER = 'uploads'
 STATIC_FOLDER = 'static' 
@@ -14,12 +39,535 @@ app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['STATIC_FOLDER'] = STATIC_FOLDER 
 app.config['CHARTS_FOLDER'] = CHARTS_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024  # Larger requests (and chunked uploads) are refused with 413 while streaming
+app.config['STORAGE_MAX_BYTES'] = 10 * 1024 * 1024 * 1024  # Uploads plus their Arrow files and statistics, across all sessions
+app.config['SESSION_STORAGE_MAX_BYTES'] = 1024 * 1024 * 1024  # Per session; its least recently used uploads go first
+app.config['STORAGE_TTL'] = 7 * 24 * 60 * 60  # Seconds an upload may go unused before it is deleted
+app.config['PARTIAL_UPLOAD_TTL'] = 24 * 60 * 60  # Seconds an unfinished chunked upload is kept without new chunks
+app.config['STORAGE_SWEEP_INTERVAL'] = 10 * 60  # Seconds between background sweeps; None to disable
+app.config['DATASET_CACHE_MAX_BYTES'] = 512 * 1024 * 1024  # Memory budget for parsed workbooks
+app.config['COLUMNAR_STORE'] = True  # Convert uploads to memory-mappable Arrow files (needs pyarrow)
+app.config['COLUMNAR_WORKERS'] = 2
+app.config['INGEST_BATCH_ROWS'] = DEFAULT_BATCH_ROWS  # Rows per chunk when streaming a workbook
+app.config['INGEST_MAX_ROWS'] = None  # Stop reading a sheet after this many data rows
+app.config['COMPACT_DATASETS'] = True  # Store parsed sheets with categorical text and downcast numbers
+app.config['CATEGORY_MAX_RATIO'] = DEFAULT_MAX_CATEGORY_RATIO  # Distinct values per row below which text becomes categorical
+app.config['SCHEMA_SAMPLE_ROWS'] = DEFAULT_SCHEMA_SAMPLE_ROWS  # Rows sampled to type columns for the results page
+app.config['SCHEMA_CACHE_ENTRIES'] = 1024
+app.config['STATS_INDEX'] = True  # Index per-column statistics of converted sheets (needs the columnar store)
+app.config['QUERY_CACHE_MAX_BYTES'] = 64 * 1024 * 1024  # Memoized filter results (one byte per row per condition)
+app.config['HISTOGRAM_BINS'] = DEFAULT_HISTOGRAM_BINS  # Default when the form doesn't ask for a bin count
+app.config['CHART_MAX_POINTS'] = DEFAULT_MAX_POINTS  # Scatter/line charts are downsampled to at most this many points
+app.config['CHART_CACHE_MAX_BYTES'] = 64 * 1024 * 1024  # Rendered chart HTML kept in memory
+app.config['CHART_CACHE_TTL'] = 60 * 60  # Seconds a rendered chart stays valid
+app.config['CHART_CACHE_ON_DISK'] = False  # Also keep rendered charts under CHARTS_FOLDER
+app.config['SHARED_CACHE_PATH'] = os.environ.get('XLAB_SHARED_CACHE_PATH')  # SQLite index shared by this host's worker processes, e.g. /dev/shm/xlab-cache.sqlite
+app.config['SHARED_WAIT_TIMEOUT'] = 120  # Seconds to wait for another worker's parse of a sheet before parsing it here
+app.config['CHART_JOB_WORKERS'] = 2  # Processes rendering charts requested with mode=async
+app.config['CHART_JOB_MAX_PENDING'] = 32  # Queued + running chart jobs before new ones are refused
+app.config['CHART_JOB_TIMEOUT'] = 120  # Seconds a chart job may run before it is stopped
+app.config['CHART_JOB_START_METHOD'] = 'spawn'  # Don't fork a process that is running converter threads
+app.config['CHART_BATCH_MAX_CHARTS'] = 50  # Charts one /generate_charts request may ask for
+app.config['CHART_BATCH_PARALLEL_MIN'] = 8  # Smaller batches render in the request thread rather than the job processes
+app.config['PREFETCH_ON_UPLOAD'] = True  # Start the full parse in the background as soon as a file is uploaded
+app.config['PROFILE_REQUESTS'] = False  # cProfile every request and dump stats to PROFILE_FOLDER
+app.config['PROFILE_FOLDER'] = 'profiles'
+app.config['PREWARM'] = os.environ.get('XLAB_PREWARM') == '1'  # Import pandas/plotly and render a chart at start-up; see prewarm()
 app.secret_key = 'super secret key'  # Needed for flash messages and session
 
+# Parsed workbooks shared by every request in this process, so a chart request
+# doesn't re-run the openpyxl parse of a file we've already read
+dataset_cache = DatasetCache(app.config['DATASET_CACHE_MAX_BYTES'])
+# With several worker processes, parsed sheets are shared through their
+# memory-mapped Arrow files and rendered charts through a host-wide index
+shared_cache = (SharedCache(SqliteIndex(app.config['SHARED_CACHE_PATH']), digest_ttl=app.config['STORAGE_TTL'])
+                if app.config['SHARED_CACHE_PATH'] else None)
+if shared_cache is not None:
+    share_digests(shared_cache)
+columnar_converter = ColumnarConverter(max_workers=app.config['COLUMNAR_WORKERS'])
+stats_indexer = StatsIndexer()
+# Sheet lists per upload, and column lists and statistics per sheet for the
+# results page; each entry counts as one unit of the budget
+schema_cache = DatasetCache(app.config['SCHEMA_CACHE_ENTRIES'], sizeof=lambda schema: 1)
+# Row masks of filter conditions, per dataset, shared by every chart that filters on them
+query_cache = DatasetCache(app.config['QUERY_CACHE_MAX_BYTES'], sizeof=lambda mask: mask.nbytes)
+ingest_progress = {}  # (file_path, sheet) -> (rows_read, total_rows) of the latest parse
+compaction_reports = {}  # (file_path, sheet) -> compact_frame report of the latest parse
+upload_store = UploadStore(app.config['UPLOAD_FOLDER'], max_size=app.config['MAX_CONTENT_LENGTH'])
+
+def forget_upload(file_path):
+    # An evicted upload's cached frames, schemas, masks and reports would never be hit again
+    for cache in (dataset_cache, schema_cache, query_cache):
+        cache.pop_where(lambda key: key[0] == file_path)
+    for reports in (ingest_progress, compaction_reports):
+        for key in [key for key in list(reports) if key[0] == file_path]:
+            reports.pop(key, None)
+
+storage = StorageManager(app.config['UPLOAD_FOLDER'],
+                         max_bytes=app.config['STORAGE_MAX_BYTES'],
+                         session_max_bytes=app.config['SESSION_STORAGE_MAX_BYTES'],
+                         ttl_seconds=app.config['STORAGE_TTL'],
+                         on_evict=forget_upload)
+chart_jobs = JobQueue(max_workers=app.config['CHART_JOB_WORKERS'],
+                      max_pending=app.config['CHART_JOB_MAX_PENDING'],
+                      timeout=app.config['CHART_JOB_TIMEOUT'],
+                      start_method=app.config['CHART_JOB_START_METHOD'])
+chart_cache = ChartCache(app.config['CHART_CACHE_MAX_BYTES'], app.config['CHART_CACHE_TTL'],
+                         disk_dir=app.config['CHARTS_FOLDER'] if app.config['CHART_CACHE_ON_DISK'] else None,
+                         shared=shared_cache)
+metrics = MetricsRegistry()
+metrics.add_collector('dataset_cache', dataset_cache.stats)
+metrics.add_collector('schema_cache', schema_cache.stats)
+metrics.add_collector('query_cache', query_cache.stats)
+metrics.add_collector('chart_cache', chart_cache.stats)
+metrics.add_collector('chart_jobs', chart_jobs.stats)
+metrics.add_collector('storage', storage.stats)
+storage_sweeper = Sweeper(app.config['STORAGE_SWEEP_INTERVAL'] or 0, [
+    storage.sweep,
+    chart_cache.sweep,
+    lambda: upload_store.remove_stale(app.config['PARTIAL_UPLOAD_TTL']),
+])
+if shared_cache is not None:
+    storage_sweeper.tasks.append(shared_cache.purge)
+
+@app.before_request
+def start_request_timing():
+    start_request(profile=app.config['PROFILE_REQUESTS'])
+
+@app.after_request
+def finish_request_timing(response):
+    # Stage timings go out as a Server-Timing header and into /metrics
+    return finish_request(response, metrics, request.endpoint, profile_dir=app.config['PROFILE_FOLDER'])
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    message = f'The file is larger than the upload limit of {app.config["MAX_CONTENT_LENGTH"] / (1024 * 1024):.0f} MB.'
+    if request.path.startswith('/uploads'):
+        return jsonify({'error': message}), 413
+    flash(message)
+    return redirect(url_for('upload_file'))
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def columnar_enabled():
+    return app.config['COLUMNAR_STORE'] and columnar_available()
+
+def load_dataset(file_path, columns=None, sheet=None, filters=None):
+    # Keyed by path and content hash (memoized on mtime), so a re-upload that
+    # overwrites the same filename never serves the previous file's frame.
+    # Once the upload has been converted, read just `columns` from the
+    # memory-mapped Arrow file, caching each column on its own so charts
+    # asking for different column sets share one copy of each; before that,
+    # fall back to one cached parse of the workbook (which may carry more
+    # columns than asked for). Each sheet is parsed, converted and evicted on
+    # its own, only once it is asked for. `filters` keep only the rows
+    # matching every condition.
+    digest = file_digest(file_path)
+    df = None
+    if columnar_enabled():
+        store_path = columnar_path(file_path, digest, sheet)
+        # Waiting on an in-flight conversion is cheaper than parsing a second time
+        with stage('wait_conversion'):
+            converted = columnar_converter.wait(store_path)
+        if not converted and not claim_conversion(store_path):
+            # ...and so is waiting for another worker process's
+            with stage('wait_shared'):
+                converted = shared_cache.wait_for(store_path, store_path, app.config['SHARED_WAIT_TIMEOUT'])
+        if converted:
+            df = load_columns(file_path, digest, sheet, store_path, columns)
+
+    if df is None:
+        key = (file_path, digest, sheet, None)
+        note('dataset_cache', 'hit' if key in dataset_cache else 'miss')
+        def parse():
+            with stage('parse'):
+                try:
+                    return parse_workbook(file_path, sheet)
+                except Exception:
+                    release_conversion(file_path, digest, sheet)
+                    raise
+        df = dataset_cache.get_or_load(key, parse)
+        schedule_columnar_conversion(file_path, digest, sheet, df)
+    if filters:
+        mask = filter_mask(file_path, digest, sheet, filters)
+        with stage('filter'):
+            df = df[mask]
+    return record_shape(df)
+
+def load_columns(file_path, digest, sheet, store_path, columns=None):
+    available = columnar_column_names(store_path)
+    if columns is not None:
+        names = set(available)
+        available = [column for column in dict.fromkeys(columns) if column in names]
+    if not available:
+        return read_columnar(store_path, [])
+    keys = [(file_path, digest, sheet, (column,)) for column in available]
+    note('dataset_cache', 'hit' if all(key in dataset_cache for key in keys) else 'miss')
+    parts = []
+    for key, column in zip(keys, available):
+        def read(column=column):
+            with stage('read_columnar'):
+                return read_columnar(store_path, [column])[column]
+        parts.append(dataset_cache.get_or_load(key, read))
+    # Concatenating columns doesn't copy them
+    return pd.concat(parts, axis=1)
+
+def filter_mask(file_path, digest, sheet, filters):
+    # Each condition's row mask is memoized per dataset, so charts sharing a
+    # condition, alone or combined with others, evaluate it only once. Once
+    # the sheet is converted, conditions run in Arrow against the
+    # memory-mapped column, without building a pandas copy of it.
+    store_path = columnar_path(file_path, digest, sheet) if columnar_enabled() else None
+    mask = None
+    for column, op, value in filters:
+        def evaluate(column=column, op=op, value=value):
+            if store_path and os.path.exists(store_path):
+                dtypes = columnar_empty_frame(store_path).dtypes
+                if column not in dtypes:
+                    raise unknown_column(column)
+                return columnar_mask(store_path, column, op, coerce_value(column, op, value, dtypes[column]))
+            frame = load_dataset(file_path, [column], sheet)
+            if column not in frame.columns:
+                raise unknown_column(column)
+            return predicate_mask(frame[column], column, op, value)
+        key = (file_path, digest, sheet, column, op, value)
+        note('query_cache', 'hit' if key in query_cache else 'miss')
+        with stage('query'):
+            condition = query_cache.get_or_load(key, evaluate)
+        mask = condition if mask is None else mask & condition
+    return mask
+
+def load_chart_data(file_path, spec):
+    # Just the columns and rows `spec` draws
+    df = load_dataset(file_path, columns=spec_columns(spec), sheet=spec.get('sheet'), filters=spec.get('filters'))
+    if spec.get('filters') and df.empty:
+        raise QueryError(NO_MATCHING_ROWS)
+    return df
+
+def record_shape(df):
+    note('rows', len(df))
+    note('columns', len(df.columns))
+    return df
+
+def load_sheets(file_path):
+    # Names and sizes come from the workbook's metadata, so listing every sheet
+    # of a large workbook costs no more than reading its directory
+    digest = file_digest(file_path)
+    with stage('sheets'):
+        return schema_cache.get_or_load((file_path, digest), lambda: list_sheets(file_path))
+
+def resolve_sheet(file_path, sheet=None):
+    # The sheet's own name, or the first sheet's when none was chosen, so the
+    # default and an explicit pick of the same sheet share one cache entry
+    names = [s['name'] for s in load_sheets(file_path)]
+    if sheet is None:
+        return names[0] if names else None
+    if sheet not in names:
+        raise ValueError(f'Sheet "{sheet}" not found in the file.')
+    return sheet
+
+def load_schema(file_path, sheet=None):
+    # What the results page needs, without parsing the whole sheet: the Arrow
+    # file's footer if the sheet is converted, else the header plus a sample
+    digest = file_digest(file_path)
+    def infer():
+        store_path = columnar_path(file_path, digest, sheet)
+        if columnar_enabled() and os.path.exists(store_path):
+            return frame_schema(columnar_empty_frame(store_path))
+        return infer_schema(file_path, sample_rows=app.config['SCHEMA_SAMPLE_ROWS'], sheet_name=sheet)
+    with stage('schema'):
+        return schema_cache.get_or_load((file_path, digest, sheet), infer)
+
+def stats_enabled():
+    return app.config['STATS_INDEX'] and columnar_enabled()
+
+def index_statistics(file_path, digest, sheet=None):
+    # Built from the Arrow file off the request path, one column at a time
+    if stats_enabled():
+        stats_indexer.submit(columnar_path(file_path, digest, sheet), stats_path(file_path, digest, sheet))
+
+def load_stats(file_path, sheet=None):
+    # The sheet's column statistics, or None until the index has been built
+    if not stats_enabled():
+        return None
+    digest = file_digest(file_path)
+    path = stats_path(file_path, digest, sheet)
+    if not os.path.exists(path):
+        # Converted before indexing was on, or the build was lost with its process;
+        # one that failed isn't resubmitted (StatsIndexer.submit skips it)
+        if os.path.exists(columnar_path(file_path, digest, sheet)):
+            index_statistics(file_path, digest, sheet)
+        return None
+    with stage('stats'):
+        return schema_cache.get_or_load((file_path, digest, sheet, 'stats'), lambda: read_stats_index(path))
+
+def render_indexed_chart(file_path, spec, render=figure_html):
+    # Charts the statistics index answers exactly are drawn without loading a
+    # row; None when the index isn't built yet or can't answer this spec
+    index = load_stats(file_path, spec.get('sheet'))
+    if index is None:
+        return None
+    with stage('figure'):
+        built = build_stats_chart(index, spec)
+    note('stats_index', 'miss' if built is None else 'hit')
+    return None if built is None else render(*built)
+
+def ingest_reporter(file_path, sheet=None):
+    report = log_progress(file_path if sheet is None else f'{file_path} [{sheet}]')
+    def progress(rows_read, total_rows):
+        ingest_progress[(file_path, sheet)] = (rows_read, total_rows)
+        report(rows_read, total_rows)
+    return progress
+
+def record_compaction(file_path, sheet, report):
+    compaction_reports[(file_path, sheet)] = report
+    note('memory_saved', report['bytes_before'] - report['bytes_after'])
+    app.logger.info('Compacted %s: %d -> %d bytes (%s)', file_path, report['bytes_before'], report['bytes_after'],
+                    ', '.join(f'{name}: {dtype}' for name, dtype in report['converted'].items()) or 'unchanged')
+
+def parse_workbook(file_path, sheet=None):
+    # Streams rows from a read-only workbook in fixed-size batches rather than
+    # building openpyxl's whole cell model the way pd.read_excel does
+    df = read_excel_streaming(file_path,
+                              batch_rows=app.config['INGEST_BATCH_ROWS'],
+                              row_limit=app.config['INGEST_MAX_ROWS'],
+                              progress=ingest_reporter(file_path, sheet),
+                              sheet_name=sheet)
+    if not app.config['COMPACT_DATASETS']:
+        return df
+    # Cached frames and Arrow files both keep the compact dtypes
+    with stage('compact'):
+        df, report = compact_frame(df, app.config['CATEGORY_MAX_RATIO'])
+    record_compaction(file_path, sheet, report)
+    return df
+
+def convert_workbook(file_path, sheet, dest_path):
+    # Batches go straight into the Arrow file, so the whole sheet is never
+    # in memory at once the way it is for parse_workbook
+    chunks = iter_excel_batches(file_path,
+                                batch_rows=app.config['INGEST_BATCH_ROWS'],
+                                row_limit=app.config['INGEST_MAX_ROWS'],
+                                progress=ingest_reporter(file_path, sheet),
+                                sheet_name=sheet)
+    if not app.config['COMPACT_DATASETS']:
+        return write_columnar_batches(chunks, dest_path)
+    compact, report = column_compactor(app.config['CATEGORY_MAX_RATIO'])
+    write_columnar_batches(chunks, dest_path, compact)
+    record_compaction(file_path, sheet, report)
+    return dest_path
+
+def claim_conversion(store_path):
+    # Whether this process should parse and convert a sheet: always, unless
+    # another worker on the host has claimed it
+    return shared_cache is None or shared_cache.claim(store_path)
+
+def release_conversion(file_path, digest, sheet, future=None):
+    # Once the conversion is over, successful or not, the claim has done its job
+    if shared_cache is None or not columnar_enabled():
+        return
+    store_path = columnar_path(file_path, digest, sheet)
+    if future is None:
+        shared_cache.release(store_path)
+    else:
+        future.add_done_callback(lambda _: shared_cache.release(store_path))
+
+def prefetch_dataset(file_path, sheet=None):
+    # Parse straight into the Arrow store in the background, so the first
+    # chart request usually finds the data ready without the upload waiting
+    if not app.config['PREFETCH_ON_UPLOAD'] or not columnar_enabled():
+        return
+    digest = file_digest(file_path)
+    if os.path.exists(columnar_path(file_path, digest, sheet)):
+        index_statistics(file_path, digest, sheet)
+    else:
+        start_conversion(file_path, sheet)
+
+def start_conversion(file_path, sheet=None):
+    # The sheet's conversion, joined if already under way in this process;
+    # None once converted, or if another worker process is converting it
+    if not columnar_enabled():
+        return None
+    digest = file_digest(file_path)
+    store_path = columnar_path(file_path, digest, sheet)
+    if os.path.exists(store_path) or not claim_conversion(store_path):
+        return None
+    future = columnar_converter.submit(store_path, write=partial(convert_workbook, file_path, sheet),
+                                       on_done=lambda _: index_statistics(file_path, digest, sheet))
+    release_conversion(file_path, digest, sheet, future)
+    return future
+
+def schedule_columnar_conversion(file_path, digest, sheet, df):
+    if not columnar_enabled():
+        return
+    store_path = columnar_path(file_path, digest, sheet)
+    if os.path.exists(store_path):
+        return
+    # Once the Arrow file is in place the parsed frame is dead weight in the cache
+    def converted(_):
+        dataset_cache.pop((file_path, digest, sheet, None))
+        index_statistics(file_path, digest, sheet)
+    future = columnar_converter.submit(store_path, lambda: df, on_done=converted)
+    release_conversion(file_path, digest, sheet, future)
+
+def chart_page(chart_html, filename, etag=None, zoom_url=None):
+    with stage('render'):
+        response = make_response(render_template('chart_display.html', chart_html=chart_html, filename=filename,
+                                                 zoom_url=zoom_url))
+    if etag:
+        # Let the browser revalidate with If-None-Match instead of re-posting for a fresh render
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def store_upload(file_path):
+    # Charged to this session's quota; may evict the session's older uploads
+    owner = session.setdefault('storage_owner', uuid.uuid4().hex)
+    storage.add(file_path, owner)
+    if app.config['STORAGE_SWEEP_INTERVAL']:
+        storage_sweeper.start()
+
+def activate_upload(file_path, filename):
+    # Everything that follows a stored upload, whichever way it arrived.
+    # Only the first sheet is read up front; the others wait until selected.
+    sheet = resolve_sheet(file_path)
+    schema = load_schema(file_path, sheet)
+    prefetch_dataset(file_path, sheet)
+
+    # Ensure static/charts directory exists 
+    charts_static_dir = app.config['CHARTS_FOLDER']
+    if not os.path.exists(charts_static_dir):
+        os.makedirs(charts_static_dir)
+    if not os.path.exists(app.config['STATIC_FOLDER']):
+        os.makedirs(app.config['STATIC_FOLDER'])
+
+    session['current_filename'] = filename # Store filename for easy access by /results route
+    session['current_sheet'] = sheet
+    return schema
+
+def chart_json_response(result, etag):
+    # Spliced rather than re-serialized: the figure JSON is cached as text
+    body = ('{"figure":' + result['figure_json'] + ',"messages":' + json.dumps(result['messages']) + '}').encode('utf-8')
+    encoding = choose_encoding(request.accept_encodings, len(body))
+    response = Response(compress_chunks(body, encoding), mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def chart_zoom_url(spec):
+    # Where the chart page fetches a re-decimated slice after a zoom; None for charts that don't need one
+    if spec['chart_type'] not in SERIES_CHART_TYPES:
+        return None
+    filters = spec.get('filters', [])
+    return url_for('chart_zoom', chart_type=spec['chart_type'], series_x_column=spec['x_column'],
+                   series_y_column=spec['y_column'], series_max_points=spec['max_points'],
+                   series_downsample=spec['downsample'], sheet=spec.get('sheet'),
+                   filter_column=[f[0] for f in filters], filter_op=[f[1] for f in filters],
+                   filter_value=[f[2] for f in filters])
+
+def job_payload(job):
+    payload = chart_jobs.status(job)
+    payload['status_url'] = url_for('chart_job_status', job_id=job.id)
+    payload['result_url'] = url_for('chart_job_result', job_id=job.id)
+    payload['events_url'] = url_for('chart_job_events', job_id=job.id)
+    return payload
+
+def enqueue_chart(file_path, spec, cache_key):
+    # Renders in a worker process, so a heavy chart can't tie up this request thread
+    meta = {'filename': session.get('current_filename') or os.path.basename(file_path),
+            'zoom_url': chart_zoom_url(spec)}
+    cached = chart_cache.get(cache_key)
+    if cached is None:
+        try:
+            cached = render_indexed_chart(file_path, spec)
+        except ChartError:
+            cached = None  # Reported by the job, like any other chart error
+        if cached is not None:
+            chart_cache.put(cache_key, cached)
+    if cached is not None:
+        return chart_jobs.add_completed(cache_key, cached, meta=meta)
+    # Right after an upload the sheet is usually still converting: the job
+    # waits for that, queued, rather than parsing the workbook a second time
+    source = chart_source(file_path, spec.get('sheet'))
+    return chart_jobs.submit(cache_key, chart_job, source, spec, meta=meta,
+                             after=start_conversion(file_path, spec.get('sheet')),
+                             on_success=lambda result: chart_cache.put(cache_key, result))
+
+def chart_source(file_path, sheet):
+    # What a worker process needs to load an upload's data on its own
+    store_path = columnar_path(file_path, file_digest(file_path), sheet) if columnar_enabled() else None
+    return {'file_path': file_path, 'store_path': store_path, 'sheet': sheet,
+            'batch_rows': app.config['INGEST_BATCH_ROWS'], 'row_limit': app.config['INGEST_MAX_ROWS']}
+
+def batch_items():
+    # A JSON body {"charts": [...]}, or a `charts` form field holding that list;
+    # each item carries the same fields as a /generate_chart form
+    payload = request.get_json(silent=True)
+    try:
+        items = payload.get('charts') if isinstance(payload, dict) else json.loads(request.form.get('charts') or '[]')
+    except ValueError:
+        items = None
+    if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+        raise ChartError('Chart batch error: Please send a non-empty list of charts.')
+    if len(items) > app.config['CHART_BATCH_MAX_CHARTS']:
+        raise ChartError(f'Chart batch error: At most {app.config["CHART_BATCH_MAX_CHARTS"]} charts can be generated at once.')
+    return items, payload.get('sheet') if isinstance(payload, dict) else request.form.get('sheet')
+
+def render_chart_batch(file_path, sheet, specs):
+    # One load of every column the charts read. Big batches are split across
+    # the chart job processes, each reading its share's columns from the
+    # memory-mapped Arrow file, so the sheet is converted before they start
+    columns = batch_columns(specs)
+    store_path = columnar_path(file_path, file_digest(file_path), sheet) if columnar_enabled() else None
+    df = None
+    if store_path and len(specs) >= app.config['CHART_BATCH_PARALLEL_MIN']:
+        with stage('wait_conversion'):
+            converted = columnar_converter.wait(store_path)
+        if not converted:
+            with stage('load'):
+                df = load_dataset(file_path, columns, sheet)
+            with stage('wait_conversion'):
+                converted = columnar_converter.wait(store_path)
+        if converted:
+            try:
+                return render_in_workers(file_path, sheet, specs)
+            except QueueFull:
+                pass  # Busy workers: render here instead
+    if df is None:
+        with stage('load'):
+            df = load_dataset(file_path, columns, sheet)
+    with stage('figure'):
+        return render_charts(df, specs)
+
+def render_in_workers(file_path, sheet, specs):
+    # Dealt round-robin, one share per worker process
+    count = min(app.config['CHART_JOB_WORKERS'], len(specs))
+    shares = [specs[i::count] for i in range(count)]
+    source = chart_source(file_path, sheet)
+    digest = file_digest(file_path)
+    jobs = []
+    try:
+        for share in shares:
+            jobs.append(chart_jobs.submit(chart_key(digest, {'batch': share}), batch_chart_job, source, share))
+    except QueueFull:
+        # The caller renders every chart here instead, so the shares already queued are wasted work
+        for job in jobs:
+            chart_jobs.withdraw(job)
+        raise
+    results = [None] * len(specs)
+    with stage('figure'):
+        for offset, job in enumerate(jobs):
+            try:
+                share_results = job.future.result()
+            except Exception as e:
+                share_results = [{'error': f'An unexpected error occurred while generating the chart: {e}'}] * len(shares[offset])
+            results[offset::count] = share_results
+    return results
+
 @app.route('/', methods=['GET', 'POST'])
 def upload_file():
     if request.method == 'POST':
@@ -32,161 +580,469 @@ def upload_file():
             return redirect(request.url)
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            upload_dir = app.config['UPLOAD_FOLDER']
-            if not os.path.exists(upload_dir):
-                os.makedirs(upload_dir)
-            file_path = os.path.join(upload_dir, filename)
-            file.save(file_path)
+            # Stored by content hash, so identical workbooks share one copy and one parse
+            try:
+                with stage('store'):
+                    file_path, digest, _ = upload_store.save_stream(file.stream, filename)
+                store_upload(file_path)
+            except (UploadTooLarge, QuotaExceeded) as e:
+                flash(str(e))
+                return redirect(request.url)
+            remember_digest(file_path, digest)
             session['uploaded_file_path'] = file_path 
             
             try:
-                df = pd.read_excel(file_path)
-                all_columns = df.columns.tolist()
-                numerical_columns = df.select_dtypes(include=np.number).columns.tolist()
-                categorical_columns = df.select_dtypes(include='object').columns.tolist() # Or include=['object', 'category'] for broader match
-
-                # Ensure static/charts directory exists 
-                charts_static_dir = app.config['CHARTS_FOLDER']
-                if not os.path.exists(charts_static_dir):
-                    os.makedirs(charts_static_dir)
-                if not os.path.exists(app.config['STATIC_FOLDER']):
-                    os.makedirs(app.config['STATIC_FOLDER'])
-
-                session['current_filename'] = filename # Store filename for easy access by /results route
-                return render_template('results.html', 
-                                       columns=all_columns,
-                                       numerical_columns=numerical_columns,
-                                       categorical_columns=categorical_columns,
-                                       filename=filename)
+                schema = activate_upload(file_path, filename)
+                with stage('render'):
+                    return render_template('results.html', 
+                                           columns=schema['columns'],
+                                           numerical_columns=schema['numerical_columns'],
+                                           categorical_columns=schema['categorical_columns'],
+                                           filename=filename,
+                                           sheets=load_sheets(file_path),
+                                           current_sheet=session['current_sheet'],
+                                           column_stats=load_stats(file_path, session['current_sheet']))
             except pd.errors.EmptyDataError:
                 flash('The uploaded Excel file is empty. Please upload a file with data.')
                 session.pop('uploaded_file_path', None)
                 session.pop('current_filename', None)
+                session.pop('current_sheet', None)
                 return redirect(request.url)
             except pd.errors.ParserError:
                 flash('Could not parse the Excel file. It might be corrupted or not a valid Excel format.')
                 session.pop('uploaded_file_path', None)
                 session.pop('current_filename', None)
+                session.pop('current_sheet', None)
                 return redirect(request.url)
             except FileNotFoundError:
                 flash('Error: Uploaded file not found on server. Please try uploading again.')
                 session.pop('uploaded_file_path', None)
                 session.pop('current_filename', None)
+                session.pop('current_sheet', None)
                 return redirect(request.url)
             except Exception as e:
                 flash(f'An unexpected error occurred while processing the file: {e}')
                 session.pop('uploaded_file_path', None) # Clean up session
                 session.pop('current_filename', None)
+                session.pop('current_sheet', None)
                 return redirect(request.url)
         else:
             flash('Invalid file type. Only .xlsx files are allowed.')
             return redirect(request.url)
     return render_template('upload.html')
 
+@app.route('/uploads', methods=['POST'])
+def start_chunked_upload():
+    # Resumable alternative to the form: start, PUT chunks at increasing offsets, complete
+    filename = secure_filename(request.values.get('filename', ''))
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'Invalid file type. Only .xlsx files are allowed.'}), 400
+    try:
+        upload_id = upload_store.start(filename, total_size=request.values.get('size', type=int))
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    return jsonify({'upload_id': upload_id, 'offset': 0,
+                    'upload_url': url_for('chunked_upload', upload_id=upload_id),
+                    'complete_url': url_for('complete_chunked_upload', upload_id=upload_id)}), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+def chunked_upload(upload_id):
+    try:
+        if request.method == 'GET':
+            # Where to resume after a dropped connection
+            return jsonify(upload_store.info(upload_id))
+        if request.method == 'DELETE':
+            upload_store.abort(upload_id)
+            return '', 204
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            offset = request.headers.get('Upload-Offset', 0, type=int)
+        new_offset = upload_store.append(upload_id, offset, request.stream)
+        return jsonify({'upload_id': upload_id, 'offset': new_offset})
+    except UnknownUpload as e:
+        return jsonify({'error': str(e)}), 404
+    except OffsetMismatch as e:
+        return jsonify({'error': str(e), 'offset': e.expected}), 409
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    try:
+        filename = upload_store.info(upload_id)['filename']
+        file_path, digest, deduplicated = upload_store.complete(upload_id)
+        store_upload(file_path)
+    except UnknownUpload as e:
+        return jsonify({'error': str(e)}), 404
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 409
+    except QuotaExceeded as e:
+        return jsonify({'error': str(e)}), 413
+    remember_digest(file_path, digest)
+    try:
+        session['uploaded_file_path'] = file_path
+        activate_upload(file_path, filename)
+    except pd.errors.EmptyDataError:
+        message = 'The uploaded Excel file is empty. Please upload a file with data.'
+    except pd.errors.ParserError:
+        message = 'Could not parse the Excel file. It might be corrupted or not a valid Excel format.'
+    except Exception as e:
+        message = f'An unexpected error occurred while processing the file: {e}'
+    else:
+        return jsonify({'sha256': digest, 'filename': filename, 'deduplicated': deduplicated,
+                        'results_url': url_for('show_results')})
+    session.pop('uploaded_file_path', None)
+    session.pop('current_filename', None)
+    session.pop('current_sheet', None)
+    return jsonify({'error': message}), 422
+
 @app.route('/results', methods=['GET'])
 def show_results():
     file_path = session.get('uploaded_file_path')
     filename = session.get('current_filename')
 
-    if not file_path or not filename or not os.path.exists(file_path):
+    if not file_path or not filename or not storage.touch(file_path):
         flash('No active file found to display results for. Please upload a file first.')
         return redirect(url_for('upload_file'))
 
     try:
-        df = pd.read_excel(file_path)
-        all_columns = df.columns.tolist()
-        numerical_columns = df.select_dtypes(include=np.number).columns.tolist()
-        categorical_columns = df.select_dtypes(include='object').columns.tolist()
-
-        return render_template('results.html', 
-                               columns=all_columns,
-                               numerical_columns=numerical_columns,
-                               categorical_columns=categorical_columns,
-                               filename=filename)
+        # ?sheet= switches the sheet the page (and later charts) work on
+        requested = request.args.get('sheet') or session.get('current_sheet')
+        try:
+            sheet = resolve_sheet(file_path, requested)
+        except ValueError as e:
+            flash(str(e), 'error')
+            sheet = resolve_sheet(file_path)
+        if sheet != session.get('current_sheet'):
+            session['current_sheet'] = sheet
+            prefetch_dataset(file_path, sheet)
+        schema = load_schema(file_path, sheet)
+        with stage('render'):
+            return render_template('results.html', 
+                                   columns=schema['columns'],
+                                   numerical_columns=schema['numerical_columns'],
+                                   categorical_columns=schema['categorical_columns'],
+                                   filename=filename,
+                                   sheets=load_sheets(file_path),
+                                   current_sheet=sheet,
+                                   column_stats=load_stats(file_path, sheet))
     except Exception as e:
         flash(f'Error processing file to show results: {e}')
         # Clear potentially problematic session variables
         session.pop('uploaded_file_path', None)
         session.pop('current_filename', None)
+        session.pop('current_sheet', None)
         return redirect(url_for('upload_file'))
 
-@app.route('/generate_chart', methods=['POST'])
+@app.route('/dataset_status', methods=['GET'])
+def dataset_status():
+    # Polled by clients to see whether the background parse of the upload is done
+    file_path = session.get('uploaded_file_path')
+    if not file_path or not storage.touch(file_path):
+        return jsonify({'error': 'No active file. Please upload a file first.'}), 404
+    try:
+        sheet = resolve_sheet(file_path, request.args.get('sheet') or session.get('current_sheet'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    ready = (file_path, file_digest(file_path), sheet, None) in dataset_cache
+    if not ready and columnar_enabled():
+        ready = os.path.exists(columnar_path(file_path, file_digest(file_path), sheet))
+    rows_read, total_rows = ingest_progress.get((file_path, sheet), (0, None))
+    status = {'ready': ready, 'rows_read': rows_read, 'total_rows': total_rows}
+    report = compaction_reports.get((file_path, sheet))
+    if report is not None:
+        status['memory_bytes'] = report['bytes_after']
+        status['memory_saved_bytes'] = report['bytes_before'] - report['bytes_after']
+    return jsonify(status)
+
+@app.route('/generate_chart', methods=['GET', 'POST'])
 def generate_chart():
+    # The results page asks with GET, so the chart page's URL names the chart
+    # and browsers can revalidate it with If-None-Match (they never do that
+    # for a POST, which scripted clients can still use). mode=async, POST only,
+    # queues the chart on the worker pool and answers with a job id right away
+    form = request.form if request.method == 'POST' else request.args
+    run_async = request.method == 'POST' and form.get('mode') == 'async'
     file_path = session.get('uploaded_file_path')
-    if not file_path or not os.path.exists(file_path):
+    if not file_path or not storage.touch(file_path):
+        if run_async:
+            return jsonify({'error': 'Uploaded file not found or session expired. Please upload again.'}), 404
         flash('Uploaded file not found or session expired. Please upload again.')
         return redirect(url_for('upload_file'))
 
+    filename = session.get('current_filename') or os.path.basename(file_path)
+    spec = chart_spec(form, app.config['HISTOGRAM_BINS'], app.config['CHART_MAX_POINTS'])
     try:
-        df = pd.read_excel(file_path)
-    except Exception as e:
-        flash(f'Error reading the uploaded file "{session.get("current_filename", "unknown file")}". It might have been moved or deleted. Please try uploading again. Details: {e}', 'error')
-        session.pop('uploaded_file_path', None)
-        session.pop('current_filename', None)
-        return redirect(url_for('upload_file'))
+        validate_spec(spec)
+        # Part of the spec, so each sheet's charts are cached and queued separately
+        spec['sheet'] = resolve_sheet(file_path, form.get('sheet') or session.get('current_sheet'))
+    except (ChartError, ValueError) as e:
+        if run_async:
+            return jsonify({'error': str(e)}), 400
+        flash(str(e), 'error')
+        return redirect(url_for('show_results'))
+
+    # Same file content and same normalized chart spec means the same chart, so
+    # a repeat request is answered without loading data or rebuilding the figure
+    cache_key = chart_key(file_digest(file_path), spec)
+    if run_async:
+        try:
+            job = enqueue_chart(file_path, spec, cache_key)
+        except QueueFull:
+            return jsonify({'error': 'Too many charts are being generated right now. Please try again shortly.'}), 503
+        return jsonify(job_payload(job)), 202
+
+    if cache_key in request.if_none_match:
+        response = make_response('', 304)
+        response.set_etag(cache_key)
+        return response
+    with stage('chart_cache'):
+        cached = chart_cache.get(cache_key)
+    note('chart_cache', 'miss' if cached is None else 'hit')
+    if cached is not None:
+        for message, category in cached['messages']:
+            flash(message, category)
+        return chart_page(cached['chart_html'], filename, cache_key, chart_zoom_url(spec))
 
-    chart_type = request.form.get('chart_type')
-    fig = None
-    
     try:
-        if chart_type == 'histogram':
-            hist_column = request.form.get('hist_column')
-            if not hist_column:
-                flash('Histogram generation error: Please select a column for the histogram.', 'error')
-                return redirect(url_for('show_results'))
-            if hist_column not in df.columns:
-                 flash(f'Histogram generation error: Column "{hist_column}" not found in the file. Please select a valid column.', 'error')
-                 return redirect(url_for('show_results'))
-            if not pd.api.types.is_numeric_dtype(df[hist_column]):
-                flash(f'Histogram generation error: Column "{hist_column}" is not numerical. A histogram requires a numerical column. Please select a different column.', 'error')
-                return redirect(url_for('show_results'))
-            fig = px.histogram(df, x=hist_column, title=f'Histogram of {hist_column}')
-        
-        elif chart_type == 'bar':
-            x_column = request.form.get('bar_x_column')
-            y_column = request.form.get('bar_y_column')
-            if not x_column or not y_column:
-                flash('Bar chart generation error: Please select columns for both X and Y axes.', 'error')
-                return redirect(url_for('show_results'))
-            if x_column not in df.columns:
-                flash(f'Bar chart generation error: X-axis column "{x_column}" not found in the file. Please select a valid column.', 'error')
-                return redirect(url_for('show_results'))
-            if y_column not in df.columns:
-                flash(f'Bar chart generation error: Y-axis column "{y_column}" not found in the file. Please select a valid column.', 'error')
-                return redirect(url_for('show_results'))
-            
-            # Column type checks for bar chart
-            # X-axis: typically categorical/object, but can be numeric. Let's ensure it's not causing issues.
-            # Y-axis: should be numeric for a meaningful bar chart aggregation.
-            if not pd.api.types.is_numeric_dtype(df[y_column]):
-                 flash(f'Bar chart generation error: Y-axis column "{y_column}" is not numerical. A bar chart typically requires a numerical column for the Y-axis values. Please select a different column.', 'error')
-                 return redirect(url_for('show_results'))
-            # Add a check if X column is numeric and Y is also numeric, this might lead to a px.bar behavior user doesn't expect (summing up y for each x)
-            # but it's not strictly an error. If X is categorical, it's usually fine.
-            if pd.api.types.is_numeric_dtype(df[x_column]) and not pd.api.types.is_categorical_dtype(df[x_column]) and not pd.api.types.is_object_dtype(df[x_column]):
-                flash(f'Bar chart information: X-axis column "{x_column}" is numerical. Plotly will aggregate Y-values for each distinct X. If this is not intended, consider using a categorical column for the X-axis.', 'info')
-
-
-            fig = px.bar(df, x=x_column, y=y_column, title=f'Bar Chart: {y_column} by {x_column}')
-        
-        else:
-            flash(f'Invalid chart type selected: "{chart_type}". Please select a valid chart type.', 'error')
+        # Drawn from the statistics index when it can answer exactly, else from the rows
+        result = render_indexed_chart(file_path, spec)
+    except ChartError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('show_results'))
+    if result is None:
+        try:
+            with stage('load'):
+                df = load_chart_data(file_path, spec)
+        except QueryError as e:
+            flash(str(e), 'error')
             return redirect(url_for('show_results'))
+        except Exception as e:
+            flash(f'Error reading the uploaded file "{session.get("current_filename", "unknown file")}". It might have been moved or deleted. Please try uploading again. Details: {e}', 'error')
+            session.pop('uploaded_file_path', None)
+            session.pop('current_filename', None)
+            session.pop('current_sheet', None)
+            return redirect(url_for('upload_file'))
 
-        if fig:
-            chart_html = fig.to_html(full_html=False, include_plotlyjs='cdn')
-            filename = os.path.basename(file_path) 
-            return render_template('chart_display.html', chart_html=chart_html, filename=filename)
-        else:
-            # This case should be hit if fig is None without a specific prior flash message (e.g. unknown chart_type not caught above)
-            flash('Could not generate chart due to an unspecified error after selection. Please try again.', 'error')
+        try:
+            result = render_chart(df, spec)
+        except ChartError as e:
+            flash(str(e), 'error')
             return redirect(url_for('show_results'))
-            
-    except Exception as e:
-        # General catch-all for Plotly errors or other unexpected issues during chart creation
-        flash(f'An unexpected error occurred while generating the chart: {e}. Please check your selections or try a different chart type.', 'error')
+        except Exception as e:
+            # General catch-all for Plotly errors or other unexpected issues during chart creation
+            flash(f'An unexpected error occurred while generating the chart: {e}. Please check your selections or try a different chart type.', 'error')
+            return redirect(url_for('show_results'))
+
+    for message, category in result['messages']:
+        flash(message, category)
+    chart_cache.put(cache_key, result)
+    return chart_page(result['chart_html'], filename, cache_key, chart_zoom_url(spec))
+
+@app.route('/generate_charts', methods=['POST'])
+def generate_charts():
+    # Several charts on one page, e.g. a histogram of every numerical column,
+    # for the cost of one load of their columns plus one aggregation each
+    file_path = session.get('uploaded_file_path')
+    if not file_path or not storage.touch(file_path):
+        flash('Uploaded file not found or session expired. Please upload again.')
+        return redirect(url_for('upload_file'))
+    filename = session.get('current_filename') or os.path.basename(file_path)
+    try:
+        items, sheet = batch_items()
+        sheet = resolve_sheet(file_path, sheet or session.get('current_sheet'))
+    except (ChartError, ValueError) as e:
+        flash(str(e), 'error')
         return redirect(url_for('show_results'))
 
+    # Fragments are cached apart from single-chart pages, which carry plotly.js themselves
+    digest = file_digest(file_path)
+    charts = []
+    pending = {}  # cache key -> spec still to render
+    for item in items:
+        spec = chart_spec(MultiDict(item), app.config['HISTOGRAM_BINS'], app.config['CHART_MAX_POINTS'])
+        try:
+            validate_spec(spec)
+        except ChartError as e:
+            charts.append({'error': str(e)})
+            continue
+        spec['sheet'] = sheet
+        key = chart_key(digest, dict(spec, output='fragment'))
+        charts.append({'key': key})
+        if key not in pending:
+            pending[key] = spec
+
+    results = {}
+    with stage('chart_cache'):
+        for key in pending:
+            cached = chart_cache.get(key)
+            if cached is not None:
+                results[key] = cached
+    cached_keys = set(results)
+    note('chart_cache_hits', len(results))
+    note('chart_cache_misses', len(pending) - len(results))
+    for key, spec in pending.items():
+        if key not in results:
+            try:
+                indexed = render_indexed_chart(file_path, spec, render=partial(figure_html, include_plotlyjs=False))
+            except ChartError as e:
+                indexed = {'error': str(e)}
+            if indexed is not None:
+                results[key] = indexed
+    remaining = [key for key in pending if key not in results]
+    if remaining:
+        try:
+            rendered = render_chart_batch(file_path, sheet, [pending[key] for key in remaining])
+        except Exception as e:
+            flash(f'Error reading the uploaded file "{filename}". It might have been moved or deleted. Please try uploading again. Details: {e}', 'error')
+            return redirect(url_for('show_results'))
+        results.update(zip(remaining, rendered))
+    for key, result in results.items():
+        if key not in cached_keys and 'error' not in result:
+            chart_cache.put(key, result)
+
+    for chart in charts:
+        if 'key' in chart:
+            chart.update(results[chart.pop('key')])
+    with stage('render'):
+        return render_template('chart_batch.html', charts=charts, filename=filename, plotly_js_url=plotly_js_url())
+
+@app.route('/chart_json', methods=['GET', 'POST'])
+def chart_json():
+    # The same charts as /generate_chart, as a Plotly figure for clients that
+    # draw it themselves (Plotly.react) instead of embedding an HTML fragment
+    file_path = session.get('uploaded_file_path')
+    if not file_path or not storage.touch(file_path):
+        return jsonify({'error': 'Uploaded file not found or session expired. Please upload again.'}), 404
+    spec = chart_spec(request.values, app.config['HISTOGRAM_BINS'], app.config['CHART_MAX_POINTS'])
+    try:
+        validate_spec(spec)
+        spec['sheet'] = resolve_sheet(file_path, request.values.get('sheet') or session.get('current_sheet'))
+    except (ChartError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Cached apart from the HTML rendering of the same spec
+    cache_key = chart_key(file_digest(file_path), dict(spec, output='json'))
+    if cache_key in request.if_none_match:
+        response = make_response('', 304)
+        response.set_etag(cache_key)
+        return response
+    with stage('chart_cache'):
+        result = chart_cache.get(cache_key)
+    note('chart_cache', 'miss' if result is None else 'hit')
+    if result is None:
+        try:
+            result = render_indexed_chart(file_path, spec, render=figure_json)
+            if result is None:
+                with stage('load'):
+                    df = load_chart_data(file_path, spec)
+                result = render_chart_json(df, spec)
+        except (ChartError, QueryError) as e:
+            return jsonify({'error': str(e)}), 422
+        except Exception as e:
+            return jsonify({'error': f'An unexpected error occurred while generating the chart: {e}'}), 500
+        chart_cache.put(cache_key, result)
+    return chart_json_response(result, cache_key)
+
+@app.route('/chart_zoom', methods=['GET'])
+def chart_zoom():
+    # The points of a scatter/line chart between x_start and x_end, decimated
+    # again to the chart's point cap, so zooming in reveals detail while each
+    # response stays the size of the original chart
+    file_path = session.get('uploaded_file_path')
+    if not file_path or not storage.touch(file_path):
+        return jsonify({'error': 'Uploaded file not found or session expired. Please upload again.'}), 404
+    spec = chart_spec(request.args, app.config['HISTOGRAM_BINS'], app.config['CHART_MAX_POINTS'])
+    try:
+        if spec['chart_type'] not in SERIES_CHART_TYPES:
+            raise ChartError('Zooming is only available for scatter and line charts.')
+        validate_spec(spec)
+        spec['sheet'] = resolve_sheet(file_path, request.args.get('sheet') or session.get('current_sheet'))
+        with stage('load'):
+            df = load_chart_data(file_path, spec)
+        with stage('figure'):
+            points = series_points(df, spec)
+    except (ChartError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(points)
+
+
+@app.route('/metrics', methods=['GET'])
+def show_metrics():
+    # Prometheus text exposition: request/stage timings plus cache and job-queue gauges
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/chart_jobs/<job_id>', methods=['GET'])
+def chart_job_status(job_id):
+    job = chart_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown chart job.'}), 404
+    return jsonify(job_payload(job))
+
+@app.route('/chart_jobs/<job_id>/result', methods=['GET'])
+def chart_job_result(job_id):
+    job = chart_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown chart job.'}), 404
+    payload = job_payload(job)
+    if payload['state'] in ('queued', 'running'):
+        return jsonify(payload), 202
+    if payload['state'] != 'done':
+        return jsonify(payload), 409 if payload['state'] == 'cancelled' else 422
+    result = job.future.result()
+    for message, category in result['messages']:
+        flash(message, category)
+    return chart_page(result['chart_html'], job.meta['filename'], job.key, job.meta.get('zoom_url'))
+
+@app.route('/chart_jobs/<job_id>/cancel', methods=['POST'])
+def cancel_chart_job(job_id):
+    job = chart_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown chart job.'}), 404
+    return jsonify(job_payload(job))
+
+@app.route('/chart_jobs/<job_id>/events', methods=['GET'])
+def chart_job_events(job_id):
+    # Server-sent events: one status message per poll interval until the job finishes
+    job = chart_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown chart job.'}), 404
+    urls = {key: value for key, value in job_payload(job).items() if key.endswith('_url')}
+
+    def stream():
+        while True:
+            payload = dict(chart_jobs.status(job), **urls)
+            yield f'data: {json.dumps(payload)}\n\n'
+            if payload['state'] in FINISHED_STATES:
+                return
+            wait_for_futures([job.future], timeout=1)
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+def prewarm():
+    """Import the data and charting libraries and render a throwaway chart.
+
+    They are otherwise imported on the first upload or chart, which then
+    pays for them. ``XLAB_PREWARM=1`` runs this when the app is imported.
+    Only with gunicorn's ``--preload``, where that happens once before the
+    workers fork, do the workers share the loaded pages copy-on-write;
+    without it each worker prewarms itself after forking, which only moves
+    the import cost from its first request to its start-up.
+    """
+    for name in ('numpy', 'pandas', 'plotly.express', 'openpyxl', 'pyarrow'):
+        try:
+            importlib.import_module(name)
+        except ImportError:  # pyarrow is optional
+            pass
+    df = pd.DataFrame({'x': [1, 2, 3]})
+    spec = {'chart_type': 'histogram', 'column': 'x', 'bins': 3}
+    render_chart(df, spec)
+    render_chart_json(df, spec)
+
+if app.config['PREWARM']:
+    prewarm()
+
 
 if __name__ == "__main__":
     app.run(debug=True)
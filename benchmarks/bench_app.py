@@ -0,0 +1,239 @@
+"""Ingest and chart benchmarks for the Flask app.
+
+Generates synthetic workbooks (numeric, categorical and date columns), then
+drives upload, /results and /generate_chart through the Flask test client
+and records wall time, peak RSS and response size for each stage.
+
+Each workbook size runs in its own subprocess so peak RSS belongs to that
+size alone. Start-up is measured in a fresh interpreter too, and reported
+as ``rows`` 0: importing the app, its first request, and ``prewarm()``.
+Results are written as JSON; pass an earlier file to ``--compare`` to flag
+stages that got slower.
+
+    python benchmarks/bench_app.py                          # 1k .. 1M rows
+    python benchmarks/bench_app.py --rows 1000 10000 --output before.json
+    python benchmarks/bench_app.py --compare before.json
+    python benchmarks/bench_app.py --rows 1000 --skip-startup
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_ROWS = [1000, 10000, 100000, 1000000]
+DATA_DIR = os.path.join(REPO_ROOT, 'benchmarks', '.data')
+RESULTS_DIR = os.path.join(REPO_ROOT, 'benchmarks', 'results')
+CATEGORIES = [f'Category {i}' for i in range(20)]
+REGIONS = ['North', 'South', 'East', 'West', 'Central']
+
+
+def generate_workbook(path, rows, seed=0):
+    """Write a synthetic workbook with ``rows`` data rows using openpyxl's write-only mode."""
+    import numpy as np
+    from openpyxl import Workbook
+
+    rng = np.random.default_rng(seed)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Data')
+    sheet.append(['id', 'value', 'score', 'category', 'region', 'created'])
+    values = rng.normal(100, 15, rows)
+    scores = rng.integers(0, 100, rows)
+    categories = rng.integers(0, len(CATEGORIES), rows)
+    regions = rng.integers(0, len(REGIONS), rows)
+    start = datetime.datetime(2020, 1, 1)
+    for i in range(rows):
+        sheet.append([i, float(values[i]), int(scores[i]), CATEGORIES[categories[i]],
+                      REGIONS[regions[i]], start + datetime.timedelta(minutes=i)])
+    workbook.save(path)
+    return path
+
+
+def workbook_for(rows):
+    # Generating a 1M-row workbook takes minutes, so keep them between runs
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, f'rows-{rows}.xlsx')
+    if not os.path.exists(path):
+        generate_workbook(path, rows)
+    return path
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_stages(workbook_path, rows, upload_dir):
+    """Time each request of one upload-and-chart session; returns a list of results."""
+    sys.path.insert(0, REPO_ROOT)
+    import app as app_module
+    from chunked_upload import UploadStore
+
+    with open(workbook_path, 'rb') as f:
+        content = f.read()
+    # A fresh store per run, so content dedupe doesn't hand us last run's conversion
+    previous_store = app_module.upload_store
+    app_module.upload_store = UploadStore(upload_dir)
+    try:
+        return _run_stages(app_module.app.test_client(), content, rows)
+    finally:
+        app_module.upload_store = previous_store
+
+
+def _run_stages(client, content, rows):
+    results = []
+
+    def measure(stage, send):
+        started = time.perf_counter()
+        response = send()
+        results.append({
+            'rows': rows,
+            'stage': stage,
+            'wall_s': round(time.perf_counter() - started, 6),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'response_bytes': len(response.data),
+            'status': response.status_code,
+        })
+
+    histogram = {'chart_type': 'histogram', 'hist_column': 'value'}
+    bar = {'chart_type': 'bar', 'bar_x_column': 'category', 'bar_y_column': 'score'}
+    line = {'chart_type': 'line', 'series_x_column': 'created', 'series_y_column': 'value'}
+    measure('upload', lambda: client.post('/', data={'file': (BytesIO(content), 'bench.xlsx')},
+                                          content_type='multipart/form-data'))
+    measure('results', lambda: client.get('/results'))
+    measure('histogram', lambda: client.post('/generate_chart', data=histogram))
+    measure('histogram_repeat', lambda: client.post('/generate_chart', data=histogram))
+    measure('bar', lambda: client.post('/generate_chart', data=bar))
+    measure('bar_repeat', lambda: client.post('/generate_chart', data=bar))
+    measure('line', lambda: client.post('/generate_chart', data=line))
+    return results
+
+
+def run_startup():
+    """Time importing the app, serving its first request and pre-warming it; run in a fresh interpreter."""
+    sys.path.insert(0, REPO_ROOT)
+    results = []
+
+    def record(stage, started, **extra):
+        from lazy_imports import loaded_heavy_modules
+
+        results.append(dict({
+            'rows': 0,
+            'stage': stage,
+            'wall_s': round(time.perf_counter() - started, 6),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'heavy_modules': loaded_heavy_modules(),
+        }, **extra))
+
+    started = time.perf_counter()
+    import app as app_module
+    record('import', started)
+    started = time.perf_counter()
+    response = app_module.app.test_client().get('/')
+    record('first_request', started, response_bytes=len(response.data), status=response.status_code)
+    started = time.perf_counter()
+    app_module.prewarm()
+    record('prewarm', started)
+    return results
+
+
+def run_startup_subprocess():
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--startup-worker'],
+                            check=True, capture_output=True, text=True, cwd=REPO_ROOT)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def run_size(rows):
+    """Run one workbook size in a subprocess and return its results."""
+    workbook_path = workbook_for(rows)
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', workbook_path, str(rows)],
+                            check=True, capture_output=True, text=True, cwd=REPO_ROOT)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], check=True, capture_output=True,
+                              text=True, cwd=REPO_ROOT).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, threshold):
+    """Stages whose wall time grew by more than ``threshold`` (a fraction) since ``baseline``."""
+    before = {(r['rows'], r['stage']): r for r in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        old = before.get((result['rows'], result['stage']))
+        if old and old['wall_s'] > 0 and result['wall_s'] > old['wall_s'] * (1 + threshold):
+            regressions.append({'rows': result['rows'], 'stage': result['stage'],
+                                'before_s': old['wall_s'], 'after_s': result['wall_s'],
+                                'change': round(result['wall_s'] / old['wall_s'] - 1, 3)})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help='workbook sizes to benchmark')
+    parser.add_argument('--output', help='results file (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', help='earlier results file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown that counts as a regression')
+    parser.add_argument('--skip-startup', action='store_true', help="don't measure import and first-request time")
+    parser.add_argument('--startup-worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--worker', nargs=2, metavar=('WORKBOOK', 'ROWS'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.startup_worker:
+        print(json.dumps(run_startup()))
+        return 0
+    if args.worker:
+        with tempfile.TemporaryDirectory() as upload_dir:
+            print(json.dumps(run_stages(args.worker[0], int(args.worker[1]), upload_dir)))
+        return 0
+
+    commit = git_commit()
+    report = {
+        'meta': {
+            'commit': commit,
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': [],
+    }
+    if not args.skip_startup:
+        for result in run_startup_subprocess():
+            report['results'].append(result)
+            print(f"{'start-up':>14}  {result['stage']:<17} {result['wall_s']:>9.3f}s  "
+                  f"{result['peak_rss_mb']:>8.1f} MB  loaded: {', '.join(result['heavy_modules']) or '-'}")
+    for rows in args.rows:
+        for result in run_size(rows):
+            report['results'].append(result)
+            print(f"{result['rows']:>9} rows  {result['stage']:<17} {result['wall_s']:>9.3f}s  "
+                  f"{result['peak_rss_mb']:>8.1f} MB  {result['response_bytes']:>10} bytes")
+
+    output = args.output or os.path.join(RESULTS_DIR, f'{commit or "results"}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {output}')
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        for r in regressions:
+            print(f"REGRESSION {r['rows']} rows {r['stage']}: {r['before_s']:.3f}s -> {r['after_s']:.3f}s")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
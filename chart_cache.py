@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def chart_key(digest, spec):
+    """Stable key for a chart of the dataset with content hash ``digest``."""
+    payload = json.dumps([digest, spec], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ChartCache:
+    """LRU + TTL cache of rendered chart fragments, optionally mirrored to disk.
+
+    Values are JSON-serialisable dicts. Memory use is bounded by the total
+    length of their ``chart_html`` or ``figure_json``; disk entries expire by file age, so a
+    restarted process can still serve charts rendered before it started.
+    With ``shared`` (a ``SharedCache``), charts rendered by any worker process
+    on the host are served to the others.
+    """
+
+    def __init__(self, max_bytes, ttl_seconds, disk_dir=None, shared=None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self.shared = shared
+        self._entries = OrderedDict()  # key -> (value, nbytes, stored_at)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[2] <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self._discard(key)
+
+        value, stored_at = self._read_shared(key, now)
+        if value is None:
+            value, stored_at = self._read_disk(key, now)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._remember(key, value, stored_at)
+        return value
+
+    def put(self, key, value):
+        now = time.time()
+        self._remember(key, value, now)
+        if self.shared is not None:
+            self.shared.put_chart(key, value, self.ttl_seconds)
+        self._write_disk(key, value)
+        return value
+
+    def sweep(self, now=None):
+        """Drop expired entries, in memory and on disk; returns how many files were removed."""
+        now = time.time() if now is None else now
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if now - entry[2] > self.ttl_seconds]:
+                self._discard(key)
+        if not self.disk_dir:
+            return 0
+        removed = 0
+        try:
+            entries = list(os.scandir(self.disk_dir))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            try:
+                if entry.name.endswith('.json') and now - entry.stat().st_mtime > self.ttl_seconds:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass  # Removed by a concurrent read of the expired entry
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _remember(self, key, value, stored_at):
+        nbytes = len(value.get('chart_html', '')) + len(value.get('figure_json', ''))
+        with self._lock:
+            self._discard(key)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes, stored_at)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_bytes, _) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+    def _read_shared(self, key, now):
+        if self.shared is None:
+            return None, None
+        # Stored with the time it was rendered, so its age carries over to this process
+        value, stored_at = self.shared.get_chart(key)
+        if value is None or now - stored_at > self.ttl_seconds:
+            return None, None
+        return value, stored_at
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f'{key}.json')
+
+    def _read_disk(self, key, now):
+        if not self.disk_dir:
+            return None, None
+        path = self._disk_path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if now - stored_at > self.ttl_seconds:
+                os.remove(path)
+                return None, None
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f), stored_at
+        except (OSError, ValueError):
+            return None, None
+
+    def _write_disk(self, key, value):
+        if not self.disk_dir:
+            return
+        os.makedirs(self.disk_dir, exist_ok=True)
+        path = self._disk_path(key)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,403 @@
+from downsample import DOWNSAMPLE_METHODS, downsample_indices
+from instrumentation import stage
+from lazy_imports import lazy_import
+from query import QueryError, filter_spec, validate_filters
+
+# Imported on first use: plotly.express alone costs more than the rest of the app's start-up
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+px = lazy_import('plotly.express')
+
+DEFAULT_HISTOGRAM_BINS = 50
+MAX_HISTOGRAM_BINS = 1000
+BAR_AGGREGATIONS = ('sum', 'mean', 'median', 'min', 'max', 'count')
+SERIES_CHART_TYPES = ('scatter', 'line')
+DEFAULT_MAX_POINTS = 5000
+MIN_SERIES_POINTS = 10
+MAX_SERIES_POINTS = 100000
+SERIES_LABELS = {'scatter': 'Scatter plot', 'line': 'Line chart'}
+DOWNSAMPLE_LABELS = {'lttb': 'LTTB', 'minmax': 'min/max'}
+
+
+class ChartError(ValueError):
+    """A chart request that can't be drawn; the message is shown to the user as is."""
+
+
+def chart_spec(form, default_bins=DEFAULT_HISTOGRAM_BINS, default_points=DEFAULT_MAX_POINTS):
+    """Normalized description of the chart a form asks for.
+
+    Two requests that would draw the same chart produce equal specs, so they
+    can share cache entries and in-flight jobs however the form was filled in.
+    """
+    spec = _chart_options(form, default_bins, default_points)
+    filters = filter_spec(form)
+    if filters:
+        spec['filters'] = filters
+    return spec
+
+
+def _chart_options(form, default_bins, default_points):
+    chart_type = form.get('chart_type')
+    if chart_type == 'histogram':
+        bins = form.get('hist_bins', type=int)
+        return {'chart_type': chart_type, 'column': form.get('hist_column') or None,
+                'bins': default_bins if bins is None else bins}
+    if chart_type == 'bar':
+        return {'chart_type': chart_type, 'x_column': form.get('bar_x_column') or None,
+                'y_column': form.get('bar_y_column') or None, 'agg': form.get('bar_agg') or 'sum',
+                'color_column': form.get('bar_color_column') or None, 'top_n': form.get('bar_top_n', type=int)}
+    if chart_type in SERIES_CHART_TYPES:
+        max_points = form.get('series_max_points', type=int)
+        x_start, x_end = form.get('x_start') or None, form.get('x_end') or None
+        return {'chart_type': chart_type, 'x_column': form.get('series_x_column') or None,
+                'y_column': form.get('series_y_column') or None,
+                'max_points': default_points if max_points is None else max_points,
+                'downsample': form.get('series_downsample') or 'lttb',
+                'x_range': [x_start, x_end] if x_start or x_end else None}
+    return {'chart_type': chart_type}
+
+
+def validate_spec(spec):
+    """Raise ChartError for a spec that's wrong before looking at any data."""
+    chart_type = spec['chart_type']
+    if chart_type == 'histogram':
+        if not spec['column']:
+            raise ChartError('Histogram generation error: Please select a column for the histogram.')
+        if not 1 <= spec['bins'] <= MAX_HISTOGRAM_BINS:
+            raise ChartError(f'Histogram generation error: Number of bins must be between 1 and {MAX_HISTOGRAM_BINS}.')
+    elif chart_type == 'bar':
+        if not spec['x_column'] or not spec['y_column']:
+            raise ChartError('Bar chart generation error: Please select columns for both X and Y axes.')
+        if spec['agg'] not in BAR_AGGREGATIONS:
+            raise ChartError(f'Bar chart generation error: Unsupported aggregation "{spec["agg"]}". Please select one of: {", ".join(BAR_AGGREGATIONS)}.')
+        if spec.get('top_n') is not None and spec['top_n'] < 1:
+            raise ChartError('Bar chart generation error: The number of top categories must be at least 1.')
+    elif chart_type in SERIES_CHART_TYPES:
+        label = SERIES_LABELS[chart_type]
+        if not spec['x_column'] or not spec['y_column']:
+            raise ChartError(f'{label} generation error: Please select columns for both X and Y axes.')
+        if not MIN_SERIES_POINTS <= spec['max_points'] <= MAX_SERIES_POINTS:
+            raise ChartError(f'{label} generation error: Number of points must be between {MIN_SERIES_POINTS} and {MAX_SERIES_POINTS}.')
+        if spec['downsample'] not in DOWNSAMPLE_METHODS:
+            raise ChartError(f'{label} generation error: Unsupported downsampling method "{spec["downsample"]}". Please select one of: {", ".join(DOWNSAMPLE_METHODS)}.')
+    else:
+        raise ChartError(f'Invalid chart type selected: "{chart_type}". Please select a valid chart type.')
+    try:
+        validate_filters(spec.get('filters', []))
+    except QueryError as e:
+        raise ChartError(str(e)) from None
+
+
+def spec_columns(spec):
+    """The columns a chart reads, so only those need loading."""
+    if spec['chart_type'] == 'histogram':
+        names = [spec['column']]
+    elif spec['chart_type'] == 'bar':
+        names = [spec['x_column'], spec['y_column'], spec.get('color_column')]
+    elif spec['chart_type'] in SERIES_CHART_TYPES:
+        names = [spec['x_column'], spec['y_column']]
+    else:
+        names = []
+    return [name for name in names if name]
+
+
+def histogram_edges(values, bins=DEFAULT_HISTOGRAM_BINS):
+    """Bin edges for ``values``; integer data gets one bin per value when that fits."""
+    if len(values) and np.issubdtype(values.dtype, np.integer):
+        low, high = int(values.min()), int(values.max())
+        if high - low + 1 <= bins:
+            return np.arange(low, high + 2) - 0.5
+    return np.histogram_bin_edges(values, bins=bins)
+
+
+def histogram_data(series, bins=DEFAULT_HISTOGRAM_BINS):
+    """Counts per bin as a small frame of ``bin_start``, ``bin_end`` and ``count``."""
+    values = series.dropna().to_numpy()
+    if values.dtype == bool:
+        values = values.astype(np.int64)
+    counts, edges = np.histogram(values, bins=histogram_edges(values, bins))
+    return pd.DataFrame({'bin_start': edges[:-1], 'bin_end': edges[1:], 'count': counts})
+
+
+def bar_value_column(x_column, y_column, agg='sum', color_column=None):
+    """Name of the aggregate's column in ``bar_data``: ``y_column``, unless that is also a group key."""
+    return f'{agg}({y_column})' if y_column in (x_column, color_column) else y_column
+
+
+def bar_data(df, x_column, y_column, agg='sum', color_column=None, top_n=None):
+    """``y_column`` aggregated by ``agg`` per ``x_column`` value (and ``color_column`` value, if given).
+
+    The aggregate is in the :func:`bar_value_column` column. With ``top_n``,
+    only the ``top_n`` X values with the largest aggregate are kept, largest
+    first.
+    """
+    if agg not in BAR_AGGREGATIONS:
+        raise ValueError(f'Unsupported aggregation "{agg}". Use one of: {", ".join(BAR_AGGREGATIONS)}.')
+    keys = [x_column] if color_column in (None, x_column) else [x_column, color_column]
+    value_column = bar_value_column(x_column, y_column, agg, color_column)
+    data = df.groupby(keys, sort=True, observed=True)[y_column].agg(agg).reset_index(name=value_column)
+    if top_n is None:
+        return data
+    if len(keys) == 1:
+        return data.nlargest(top_n, value_column).reset_index(drop=True)
+    # Rank X values by their aggregate over every color, then keep their bars in that order
+    totals = df.groupby(x_column, sort=True, observed=True)[y_column].agg(agg)
+    rank = {value: position for position, value in enumerate(totals.nlargest(top_n).index)}
+    data = data[data[x_column].isin(list(rank))]
+    return data.sort_values(x_column, key=lambda values: values.astype(object).map(rank), kind='stable').reset_index(drop=True)
+
+
+def histogram_stats_data(stats, bins=DEFAULT_HISTOGRAM_BINS):
+    """The same frame as ``histogram_data``, rebinned from a column's statistics; None if that can't be exact.
+
+    Counts per integer value give every bin count exactly. A fine histogram
+    only gives bin counts that split its bins evenly, and only when the
+    coarse edges are bit for bit every k-th fine edge: otherwise a value on
+    a coarse edge (as decimal data often is) can land in the other bin.
+    """
+    if not stats.get('count'):
+        return None
+    low, high = stats['min'], stats['max']
+    if 'integer_counts' in stats:
+        counts = np.asarray(stats['integer_counts'], dtype=np.int64)
+        if high - low + 1 <= bins:
+            edges = np.arange(low, high + 2) - 0.5
+        else:
+            edges = np.histogram_bin_edges(np.array([low, high]), bins=bins)
+        counts, _ = np.histogram(np.arange(low, low + len(counts)), bins=edges, weights=counts)
+    elif 'fine_histogram' in stats and len(stats['fine_histogram']) % bins == 0:
+        try:
+            # Edges depend only on the range and the dtype, so these are the row path's
+            extremes = np.array([low, high], dtype=np.dtype(stats['dtype']))
+        except TypeError:
+            return None
+        fine = np.asarray(stats['fine_histogram'], dtype=np.int64)
+        fine_edges = np.histogram_bin_edges(extremes, bins=len(fine))
+        edges = histogram_edges(extremes, bins)
+        if edges.dtype != fine_edges.dtype or edges.tobytes() != fine_edges[::len(fine) // bins].tobytes():
+            return None
+        counts = fine.reshape(bins, -1).sum(axis=1)
+    else:
+        return None
+    return pd.DataFrame({'bin_start': edges[:-1], 'bin_end': edges[1:], 'count': counts.astype(np.int64)})
+
+
+def histogram_figure(series, column, bins=DEFAULT_HISTOGRAM_BINS):
+    """Histogram of an already-binned column, so the figure holds one bar per bin."""
+    return histogram_data_figure(histogram_data(series, bins), column)
+
+
+def histogram_data_figure(data, column):
+    centers = (data['bin_start'] + data['bin_end']) / 2
+    fig = px.bar(x=centers, y=data['count'], title=f'Histogram of {column}',
+                 labels={'x': column, 'y': 'count'})
+    fig.update_traces(width=(data['bin_end'] - data['bin_start']).to_numpy(),
+                      customdata=data[['bin_start', 'bin_end']].to_numpy(),
+                      hovertemplate='%{customdata[0]:.4g} to %{customdata[1]:.4g}<br>count=%{y}<extra></extra>')
+    fig.update_layout(bargap=0)
+    return fig
+
+
+def bar_figure(df, x_column, y_column, agg='sum', color_column=None, top_n=None):
+    """Bar chart of ``y_column`` aggregated per ``x_column`` category."""
+    return bar_data_figure(bar_data(df, x_column, y_column, agg, color_column, top_n),
+                           x_column, y_column, agg, color_column, top_n)
+
+
+def bar_data_figure(data, x_column, y_column, agg='sum', color_column=None, top_n=None):
+    value_column = bar_value_column(x_column, y_column, agg, color_column)
+    labels = {value_column: y_column if agg == 'sum' else f'{agg} of {y_column}'}
+    title = f'Bar Chart: {y_column} by {x_column}' + (f' (top {top_n})' if top_n is not None else '')
+    color = color_column if color_column != x_column else None
+    return px.bar(data, x=x_column, y=value_column, color=color, labels=labels, title=title)
+
+
+def _range_bound(value, series):
+    if value is None:
+        return None
+    try:
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return pd.Timestamp(value)
+        return float(value)
+    except (TypeError, ValueError):
+        raise ChartError(f'Invalid zoom range value "{value}".') from None
+
+
+def series_arrays(df, spec):
+    """X and Y values a scatter or line chart draws, plus how many points there were.
+
+    Rows missing either value are dropped, the rest are sorted by X and cut
+    to ``spec['x_range']``, then decimated to at most ``spec['max_points']``
+    so the figure's size doesn't grow with the sheet.
+    """
+    label = SERIES_LABELS[spec['chart_type']]
+    x_column, y_column = spec['x_column'], spec['y_column']
+    for axis, column in (('X', x_column), ('Y', y_column)):
+        if column not in df.columns:
+            raise ChartError(f'{label} generation error: {axis}-axis column "{column}" not found in the file. Please select a valid column.')
+    x, y = df[x_column], df[y_column]
+    if not (pd.api.types.is_numeric_dtype(x) or pd.api.types.is_datetime64_any_dtype(x)) or pd.api.types.is_bool_dtype(x):
+        raise ChartError(f'{label} generation error: X-axis column "{x_column}" must be numerical or a date/time column. Please select a different column.')
+    if not pd.api.types.is_numeric_dtype(y):
+        raise ChartError(f'{label} generation error: Y-axis column "{y_column}" is not numerical. Please select a different column.')
+
+    mask = x.notna() & y.notna()
+    if spec.get('x_range'):
+        start, end = (_range_bound(value, x) for value in spec['x_range'])
+        if start is not None:
+            mask &= x >= start
+        if end is not None:
+            mask &= x <= end
+    x_values, y_values = x[mask].to_numpy(), y[mask].to_numpy(dtype=np.float64)
+    if len(x_values) > 1 and not (x_values[1:] >= x_values[:-1]).all():
+        order = np.argsort(x_values, kind='stable')
+        x_values, y_values = x_values[order], y_values[order]
+
+    total = len(x_values)
+    if total > spec['max_points']:
+        position = x_values.astype(np.int64) if np.issubdtype(x_values.dtype, np.datetime64) else x_values
+        keep = downsample_indices(position, y_values, spec['max_points'], spec['downsample'])
+        x_values, y_values = x_values[keep], y_values[keep]
+    return x_values, y_values, total
+
+
+def series_points(df, spec):
+    """JSON-ready points for a scatter or line chart, e.g. a slice re-decimated after a zoom."""
+    x, y, total = series_arrays(df, spec)
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = np.datetime_as_string(x, unit='ms')
+    return {'x': x.tolist(), 'y': y.tolist(), 'points': len(y), 'total_points': total}
+
+
+def series_figure(df, spec):
+    """Scatter or line chart of a downsampled series, plus a note when points were dropped."""
+    x, y, total = series_arrays(df, spec)
+    x_column, y_column = spec['x_column'], spec['y_column']
+    labels = {'x': x_column, 'y': y_column}
+    # WebGL traces keep pan and zoom smooth at the point cap
+    if spec['chart_type'] == 'line':
+        fig = px.line(x=x, y=y, labels=labels, title=f'Line Chart: {y_column} over {x_column}', render_mode='webgl')
+    else:
+        fig = px.scatter(x=x, y=y, labels=labels, title=f'Scatter Plot: {y_column} vs {x_column}', render_mode='webgl')
+    notes = []
+    if len(y) < total:
+        notes.append((f'Chart information: Showing {len(y)} of {total} points, downsampled with {DOWNSAMPLE_LABELS[spec["downsample"]]}. Zoom in to see more detail.', 'info'))
+    return fig, notes
+
+
+def build_chart(df, spec):
+    """Figure for a validated spec, plus any informational messages for the user.
+
+    Raises ChartError when the data doesn't fit the chart (missing or
+    non-numerical columns).
+    """
+    notes = []
+    if spec['chart_type'] in SERIES_CHART_TYPES:
+        return series_figure(df, spec)
+    if spec['chart_type'] == 'histogram':
+        column = spec['column']
+        if column not in df.columns:
+            raise ChartError(f'Histogram generation error: Column "{column}" not found in the file. Please select a valid column.')
+        if not pd.api.types.is_numeric_dtype(df[column]):
+            raise ChartError(f'Histogram generation error: Column "{column}" is not numerical. A histogram requires a numerical column. Please select a different column.')
+        # Binned here with NumPy so the page carries one bar per bin, not every raw value
+        return histogram_figure(df[column], column, bins=spec['bins']), notes
+
+    x_column, y_column = spec['x_column'], spec['y_column']
+    if x_column not in df.columns:
+        raise ChartError(f'Bar chart generation error: X-axis column "{x_column}" not found in the file. Please select a valid column.')
+    if y_column not in df.columns:
+        raise ChartError(f'Bar chart generation error: Y-axis column "{y_column}" not found in the file. Please select a valid column.')
+    color_column = spec.get('color_column')
+    if color_column is not None and color_column not in df.columns:
+        raise ChartError(f'Bar chart generation error: Color column "{color_column}" not found in the file. Please select a valid column.')
+    # Y-axis: should be numeric for a meaningful bar chart aggregation (counting works on any column).
+    if spec['agg'] != 'count' and not pd.api.types.is_numeric_dtype(df[y_column]):
+        raise ChartError(f'Bar chart generation error: Y-axis column "{y_column}" is not numerical. A bar chart typically requires a numerical column for the Y-axis values. Please select a different column.')
+    # A numerical X is not strictly an error, but every distinct value becomes its own bar
+    if pd.api.types.is_numeric_dtype(df[x_column]) and not isinstance(df[x_column].dtype, pd.CategoricalDtype) and not pd.api.types.is_object_dtype(df[x_column]):
+        notes.append((f'Bar chart information: X-axis column "{x_column}" is numerical. Y-values will be aggregated for each distinct X. If this is not intended, consider using a categorical column for the X-axis.', 'info'))
+    # Grouped here so the page carries one bar per category, not one per row
+    return bar_figure(df, x_column, y_column, agg=spec['agg'], color_column=color_column, top_n=spec.get('top_n')), notes
+
+
+def build_stats_chart(index, spec):
+    """Figure for a validated spec drawn from a column statistics index alone.
+
+    Covers unfiltered histograms and ungrouped count bar charts, and raises
+    the same ChartError ``build_chart`` would for a wrong column. Returns
+    None when the index can't give exactly the chart the rows would, and
+    the caller should load them instead.
+    """
+    if spec.get('filters'):
+        return None
+    if spec['chart_type'] == 'histogram':
+        column = spec['column']
+        if column not in index:
+            raise ChartError(f'Histogram generation error: Column "{column}" not found in the file. Please select a valid column.')
+        stats = index[column]
+        if stats['kind'] in ('text', 'datetime'):
+            raise ChartError(f'Histogram generation error: Column "{column}" is not numerical. A histogram requires a numerical column. Please select a different column.')
+        data = histogram_stats_data(stats, spec['bins']) if stats['kind'] == 'number' else None
+        return None if data is None else (histogram_data_figure(data, column), [])
+
+    if spec['chart_type'] != 'bar' or spec['agg'] != 'count' or spec.get('color_column') is not None:
+        return None
+    x_column, y_column = spec['x_column'], spec['y_column']
+    if x_column not in index:
+        raise ChartError(f'Bar chart generation error: X-axis column "{x_column}" not found in the file. Please select a valid column.')
+    if y_column not in index:
+        raise ChartError(f'Bar chart generation error: Y-axis column "{y_column}" not found in the file. Please select a valid column.')
+    # Rows per X value equal non-missing Y values per X value only when no Y is missing
+    if 'values' not in index[x_column] or index[y_column]['nulls']:
+        return None
+    values = index[x_column]['values']
+    value_column = bar_value_column(x_column, y_column, 'count')
+    data = pd.DataFrame({x_column: [value for value, _ in values], value_column: [count for _, count in values]})
+    if spec.get('top_n') is not None:
+        data = data.nlargest(spec['top_n'], value_column).reset_index(drop=True)
+    return bar_data_figure(data, x_column, y_column, 'count', None, spec.get('top_n')), []
+
+
+def plotly_js_url():
+    """The script ``include_plotlyjs='cdn'`` loads, for pages that load plotly.js once themselves."""
+    from plotly.offline import get_plotlyjs_version
+
+    return f'https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js'
+
+
+def figure_html(fig, notes, include_plotlyjs='cdn'):
+    """Chart HTML fragment and messages, as stored in the chart cache.
+
+    Fragments for a page holding several charts leave plotly.js out
+    (``include_plotlyjs=False``) and the page loads it once.
+    """
+    with stage('to_html'):
+        chart_html = fig.to_html(full_html=False, include_plotlyjs=include_plotlyjs)
+    return {'chart_html': chart_html, 'messages': notes}
+
+
+def figure_json(fig, notes):
+    """Figure JSON (``data`` and ``layout``) and messages.
+
+    Plotly writes NumPy arrays as base64 typed arrays (``{"dtype", "bdata"}``)
+    that Plotly.js decodes directly, so numeric traces travel as raw bytes
+    rather than decimal text.
+    """
+    with stage('to_json'):
+        text = fig.to_json(validate=False)
+    return {'figure_json': text, 'messages': notes}
+
+
+def render_chart(df, spec, include_plotlyjs='cdn'):
+    """Chart HTML fragment and messages for a validated spec, as stored in the chart cache."""
+    with stage('figure'):
+        fig, notes = build_chart(df, spec)
+    return figure_html(fig, notes, include_plotlyjs)
+
+
+def render_chart_json(df, spec):
+    """Figure JSON and messages for a validated spec; see ``figure_json``."""
+    with stage('figure'):
+        fig, notes = build_chart(df, spec)
+    return figure_json(fig, notes)
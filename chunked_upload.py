@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+COPY_BLOCK_SIZE = 1024 * 1024
+PARTIAL_DIR = '.partial'
+
+
+class UploadError(Exception):
+    """Base class for chunked upload failures; the message is safe to show users."""
+
+
+class UnknownUpload(UploadError):
+    pass
+
+
+class UploadTooLarge(UploadError):
+    """The file is bigger than the store accepts; raised as soon as the limit is crossed."""
+
+    def __init__(self, max_size):
+        super().__init__(f'The file is larger than the upload limit of {max_size / (1024 * 1024):.0f} MB.')
+        self.max_size = max_size
+
+
+class OffsetMismatch(UploadError):
+    """A chunk arrived for a different offset than the server has stored."""
+
+    def __init__(self, expected):
+        super().__init__(f'Chunk offset does not match; resume from byte {expected}.')
+        self.expected = expected
+
+
+class UploadStore:
+    """Content-addressed storage for uploaded workbooks.
+
+    Each distinct file is kept once, at ``<root>/<sha256>/<first filename>``,
+    so uploading the same workbook again (under any name, by any user) ends up
+    at the same path and reuses that path's parsed and cached dataset.
+    Chunked uploads are written to ``<root>/.partial`` with a small JSON
+    sidecar, so they can be resumed even after a restart; the content hash is
+    updated as chunks arrive and only recomputed when that state was lost.
+    With ``max_size``, a file stops being written the moment it grows past
+    that many bytes.
+    """
+
+    def __init__(self, root, max_size=None):
+        self.root = root
+        self.max_size = max_size
+        self._hashers = {}  # upload id -> (sha256 object, bytes hashed)
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    # -- whole-file uploads -------------------------------------------------
+
+    def save_stream(self, stream, filename):
+        """Store a file-like object; returns ``(path, sha256, deduplicated)``."""
+        part_path = self._part_path(uuid.uuid4().hex)
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
+        sha = hashlib.sha256()
+        try:
+            with open(part_path, 'wb') as f:
+                for block in iter(lambda: stream.read(COPY_BLOCK_SIZE), b''):
+                    sha.update(block)
+                    f.write(block)
+                    self._check_size(f.tell())
+            return self._commit(part_path, sha.hexdigest(), filename)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+    def find(self, digest):
+        """Path of the stored copy of ``digest``, or None."""
+        object_dir = os.path.join(self.root, digest)
+        try:
+            # Derived artifacts (e.g. the Arrow conversion) live alongside the workbook
+            names = sorted(name for name in os.listdir(object_dir) if name.lower().endswith('.xlsx'))
+        except FileNotFoundError:
+            return None
+        return os.path.join(object_dir, names[0]) if names else None
+
+    # -- chunked uploads ----------------------------------------------------
+
+    def start(self, filename, total_size=None):
+        if total_size is not None:
+            self._check_size(total_size)
+        upload_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.root, PARTIAL_DIR), exist_ok=True)
+        open(self._part_path(upload_id), 'wb').close()
+        with open(self._meta_path(upload_id), 'w', encoding='utf-8') as f:
+            json.dump({'filename': filename, 'total_size': total_size}, f)
+        with self._lock:
+            self._hashers[upload_id] = (hashlib.sha256(), 0)
+        return upload_id
+
+    def info(self, upload_id):
+        meta = self._read_meta(upload_id)
+        meta['upload_id'] = upload_id
+        meta['offset'] = os.path.getsize(self._part_path(upload_id))
+        return meta
+
+    def append(self, upload_id, offset, stream):
+        """Write a chunk that starts at ``offset``; returns the new offset."""
+        self._read_meta(upload_id)
+        with self._upload_lock(upload_id):
+            part_path = self._part_path(upload_id)
+            current = os.path.getsize(part_path)
+            if offset != current:
+                raise OffsetMismatch(current)
+            sha = self._hasher(upload_id, part_path, current)
+            with open(part_path, 'ab') as f:
+                try:
+                    for block in iter(lambda: stream.read(COPY_BLOCK_SIZE), b''):
+                        sha.update(block)
+                        f.write(block)
+                        self._check_size(f.tell())
+                except UploadTooLarge:
+                    # Drop the chunk, keeping the upload resumable from where it was
+                    f.truncate(current)
+                    with self._lock:
+                        self._hashers.pop(upload_id, None)
+                    raise
+                new_offset = f.tell()
+            with self._lock:
+                self._hashers[upload_id] = (sha, new_offset)
+            return new_offset
+
+    def complete(self, upload_id):
+        """Finish a chunked upload; returns ``(path, sha256, deduplicated)``."""
+        meta = self._read_meta(upload_id)
+        with self._upload_lock(upload_id):
+            part_path = self._part_path(upload_id)
+            size = os.path.getsize(part_path)
+            if meta['total_size'] is not None and size != meta['total_size']:
+                raise UploadError(f'Upload is incomplete: received {size} of {meta["total_size"]} bytes.')
+            digest = self._hasher(upload_id, part_path, size).hexdigest()
+            result = self._commit(part_path, digest, meta['filename'])
+            self._forget(upload_id)
+        return result
+
+    def abort(self, upload_id):
+        self._read_meta(upload_id)
+        with self._upload_lock(upload_id):
+            for path in (self._part_path(upload_id), self._meta_path(upload_id)):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._forget(upload_id)
+
+    def remove_stale(self, max_age, now=None):
+        """Drop chunked uploads that haven't received a chunk for ``max_age`` seconds; returns their ids."""
+        now = time.time() if now is None else now
+        removed = []
+        try:
+            entries = list(os.scandir(os.path.join(self.root, PARTIAL_DIR)))
+        except FileNotFoundError:
+            return removed
+        for entry in entries:
+            upload_id, ext = os.path.splitext(entry.name)
+            if ext != '.part' or now - entry.stat().st_mtime <= max_age:
+                continue
+            with self._upload_lock(upload_id):
+                for path in (self._part_path(upload_id), self._meta_path(upload_id)):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self._forget(upload_id)
+            removed.append(upload_id)
+        return removed
+
+    # -- internals ----------------------------------------------------------
+
+    def _check_size(self, size):
+        if self.max_size is not None and size > self.max_size:
+            raise UploadTooLarge(self.max_size)
+
+    def _commit(self, part_path, digest, filename):
+        with self._lock:
+            existing = self.find(digest)
+            if existing is not None:
+                os.remove(part_path)
+                return existing, digest, True
+            object_dir = os.path.join(self.root, digest)
+            os.makedirs(object_dir, exist_ok=True)
+            path = os.path.join(object_dir, filename)
+            shutil.move(part_path, path)
+        return path, digest, False
+
+    def _hasher(self, upload_id, part_path, size):
+        with self._lock:
+            sha, hashed = self._hashers.get(upload_id, (None, None))
+        if sha is not None and hashed == size:
+            return sha
+        # State lost (e.g. the process restarted mid-upload): rehash what's on disk
+        sha = hashlib.sha256()
+        with open(part_path, 'rb') as f:
+            for block in iter(lambda: f.read(COPY_BLOCK_SIZE), b''):
+                sha.update(block)
+        return sha
+
+    def _upload_lock(self, upload_id):
+        with self._lock:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    def _forget(self, upload_id):
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+            self._locks.pop(upload_id, None)
+        meta_path = self._meta_path(upload_id)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+    def _read_meta(self, upload_id):
+        # Ids are generated by start(); anything else can't name a sidecar
+        if not upload_id.isalnum():
+            raise UnknownUpload('Unknown upload.')
+        try:
+            with open(self._meta_path(upload_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UnknownUpload('Unknown upload.') from None
+
+    def _part_path(self, upload_id):
+        return os.path.join(self.root, PARTIAL_DIR, f'{upload_id}.part')
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.root, PARTIAL_DIR, f'{upload_id}.json')
@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from columnar import artifact_path, columnar_column_names, read_columnar
+from lazy_imports import lazy_import
+from query import value_kind
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+STATS_SUFFIX = '.stats.json'
+FINE_HISTOGRAM_BINS = 1000  # Any bin count dividing this is rebinned exactly from the index
+MAX_EXACT_INTEGER_RANGE = 1000  # Integer columns spanning at most this many values keep a count per value
+MAX_INDEXED_VALUES = 1000  # Text columns with at most this many distinct values keep every value's count
+TOP_K = 10
+QUANTILES = tuple(i / 100 for i in range(101))
+
+logger = logging.getLogger(__name__)
+
+
+def stats_path(file_path, digest, sheet=None):
+    return artifact_path(file_path, digest, sheet, STATS_SUFFIX)
+
+
+def _plain(value):
+    # NumPy scalars and Timestamps -> JSON-friendly Python values
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return value.item() if hasattr(value, 'item') else value
+
+
+def column_statistics(series):
+    """Summary of one column, small enough to keep for every column of every upload.
+
+    Numerical columns get min/max/mean, a percentile sketch and a fine
+    histogram (a count per integer value when the range is small); text,
+    categorical and boolean columns get their most common values, and every
+    value's count when there are few enough of them.
+    """
+    non_null = series.dropna()
+    kind = value_kind(series.dtype)
+    stats = {'dtype': str(series.dtype), 'kind': kind, 'count': int(len(non_null)),
+             'nulls': int(len(series) - len(non_null))}
+    if kind == 'number':
+        values = non_null.to_numpy()
+        stats['distinct'] = int(non_null.nunique())
+        if len(values):
+            low, high = values.min(), values.max()
+            stats.update(min=_plain(low), max=_plain(high), mean=float(values.mean(dtype=np.float64)),
+                         quantiles=np.quantile(values.astype(np.float64), QUANTILES).tolist())
+            if np.issubdtype(values.dtype, np.integer) and int(high) - int(low) + 1 <= MAX_EXACT_INTEGER_RANGE:
+                stats['integer_counts'] = np.bincount(values.astype(np.int64) - int(low)).tolist()
+            else:
+                counts, _ = np.histogram(values, bins=FINE_HISTOGRAM_BINS)
+                stats['fine_histogram'] = counts.tolist()
+    elif kind == 'datetime':
+        stats['distinct'] = int(non_null.nunique())
+        if len(non_null):
+            stats.update(min=_plain(non_null.min()), max=_plain(non_null.max()))
+    else:
+        counts = non_null.value_counts()
+        counts = counts[counts > 0]  # unobserved categories of a categorical column
+        stats['distinct'] = int(len(counts))
+        stats['top_values'] = [[_plain(value), int(count)] for value, count in counts.head(TOP_K).items()]
+        if len(counts) <= MAX_INDEXED_VALUES:
+            stats['values'] = [[_plain(value), int(count)] for value, count in counts.sort_index().items()]
+    return stats
+
+
+def build_stats_index(store_path):
+    """Statistics for every column of an Arrow file, read one memory-mapped column at a time."""
+    return {column: column_statistics(read_columnar(store_path, [column])[column])
+            for column in columnar_column_names(store_path)}
+
+
+def write_stats_index(index, dest_path):
+    tmp_path = f'{dest_path}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, dest_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return dest_path
+
+
+def read_stats_index(path):
+    """The index at ``path``, or None if it hasn't been built (yet)."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class StatsIndexer:
+    """Background builder of column statistics indexes for converted sheets.
+
+    Runs apart from the columnar converter, so a chart waiting for a
+    conversion never also waits for statistics; builds for the same index
+    are deduplicated, and one that failed is not tried again.
+    """
+
+    def __init__(self, max_workers=1):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='stats')
+        self._pending = {}
+        self._failed = set()
+        self._lock = threading.Lock()
+
+    def submit(self, store_path, dest_path):
+        """Queue an index of ``store_path``'s columns; returns its future, or None if built or failed before."""
+        if os.path.exists(dest_path):
+            return None
+        with self._lock:
+            if dest_path in self._failed:
+                return None
+            future = self._pending.get(dest_path)
+            if future is None:
+                future = self._pending[dest_path] = self._executor.submit(self._build, store_path, dest_path)
+        return future
+
+    def wait(self, dest_path, timeout=None):
+        """Block until a pending build finishes; True if the index exists."""
+        with self._lock:
+            future = self._pending.get(dest_path)
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+        return os.path.exists(dest_path)
+
+    def _build(self, store_path, dest_path):
+        try:
+            if not os.path.exists(dest_path):
+                write_stats_index(build_stats_index(store_path), dest_path)
+            return dest_path
+        except Exception:
+            # Not fatal: charts and the results page fall back to the rows
+            logger.exception('Building column statistics failed for %s', store_path)
+            with self._lock:
+                self._failed.add(dest_path)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(dest_path, None)
@@ -0,0 +1,309 @@
+import hashlib
+import importlib.util
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+COLUMNAR_SUFFIX = '.arrow'
+
+logger = logging.getLogger(__name__)
+
+
+def columnar_available():
+    """True when pyarrow is installed and the Arrow IPC store can be used."""
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def artifact_path(file_path, digest, sheet=None, suffix=COLUMNAR_SUFFIX):
+    # Digest in the name so an overwritten upload never reads a stale artifact;
+    # each sheet gets its own file, tagged by a hash since names can hold any character
+    if sheet is None:
+        return f'{file_path}.{digest[:16]}{suffix}'
+    sheet_tag = hashlib.sha1(sheet.encode('utf-8')).hexdigest()[:8]
+    return f'{file_path}.{digest[:16]}.{sheet_tag}{suffix}'
+
+
+def columnar_path(file_path, digest, sheet=None):
+    return artifact_path(file_path, digest, sheet, COLUMNAR_SUFFIX)
+
+
+def arrow_compatible(frame):
+    """``frame`` with object columns that mix types stored as text, which Arrow can hold.
+
+    Excel columns often mix numbers with text such as "N/A"; Arrow has no
+    type for that. Missing values stay missing. Other columns are untouched.
+    """
+    import pandas as pd
+
+    converted = None
+    for position in range(frame.shape[1]):
+        column = frame.iloc[:, position]
+        if column.dtype == object and pd.api.types.infer_dtype(column, skipna=True) in ('mixed', 'mixed-integer'):
+            if converted is None:
+                converted = frame.copy(deep=False)
+            converted.isetitem(position, column.where(column.isna(), column.astype(str)))
+    return frame if converted is None else converted
+
+
+def write_columnar(frame, dest_path):
+    """Write a DataFrame as an uncompressed Arrow IPC (Feather v2) file.
+
+    Uncompressed so readers can memory-map it; written to a temp file and
+    renamed so a concurrent reader never sees a half-written file. Mixed-type
+    columns are written as text (see :func:`arrow_compatible`).
+    """
+    from pyarrow import feather
+
+    tmp_path = f'{dest_path}.{threading.get_ident()}.tmp'
+    try:
+        feather.write_feather(arrow_compatible(frame), tmp_path, compression='uncompressed')
+        os.replace(tmp_path, dest_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return dest_path
+
+
+def _widened_schema(schema, batch_schema):
+    # Per column: a common type where Arrow has one (integers then decimals
+    # become doubles, an all-blank chunk takes the other chunk's type), text otherwise
+    import pyarrow as pa
+
+    fields = []
+    for field, other in zip(schema, batch_schema):
+        if field.type != other.type:
+            try:
+                field = pa.unify_schemas([pa.schema([field]), pa.schema([other])],
+                                         promote_options='permissive').field(0)
+            except (pa.ArrowTypeError, pa.ArrowInvalid):
+                field = pa.field(field.name, pa.large_string())
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def _widen(writer, path, schema):
+    # IPC files can't be appended to, so the batches already written are cast
+    # into a new file, whose writer carries on from there under the same path
+    import pyarrow as pa
+
+    writer.close()
+    widened_path = f'{path}.widen'
+    widened = pa.ipc.new_file(widened_path, schema)
+    with pa.memory_map(path, 'r') as source:
+        reader = pa.ipc.open_file(source)
+        for index in range(reader.num_record_batches):
+            widened.write_batch(reader.get_batch(index).cast(schema))
+    os.replace(widened_path, path)
+    return widened
+
+
+def _write_raw_batches(chunks, path):
+    # Appends each chunk to ``path`` as it arrives; a chunk whose types don't
+    # fit the file so far widens the whole file. Returns the chunks' column names.
+    import pyarrow as pa
+
+    names = schema = writer = None
+    try:
+        for chunk in chunks:
+            batch = pa.RecordBatch.from_pandas(arrow_compatible(chunk), preserve_index=False)
+            batch = batch.replace_schema_metadata(None)
+            if writer is None:
+                names, schema = list(chunk.columns), batch.schema
+                writer = pa.ipc.new_file(path, schema)
+            elif not batch.schema.equals(schema):
+                widened = _widened_schema(schema, batch.schema)
+                if not widened.equals(schema):
+                    schema = widened
+                    writer = _widen(writer, path, schema)
+                batch = batch.cast(schema)
+            writer.write_batch(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    return names
+
+
+def _write_compacted(raw_path, dest_path, names, compact):
+    # Each column's final dtype comes from ``compact`` over that whole column,
+    # read alone from the memory-mapped file; the batches are then copied over
+    # one at a time with those dtypes (and one shared dictionary per category column)
+    import pandas as pd
+    import pyarrow as pa
+
+    with pa.memory_map(raw_path, 'r') as source:
+        reader = pa.ipc.open_file(source)
+        raw_schema = reader.schema
+        raw_dtypes = raw_schema.empty_table().to_pandas().dtypes
+        dtypes = list(raw_dtypes)
+        if compact is not None:
+            for position in range(len(names)):
+                column = pa.chunked_array([reader.get_batch(index).column(position)
+                                           for index in range(reader.num_record_batches)],
+                                          type=raw_schema.field(position).type)
+                dtypes[position] = compact(column.to_pandas().rename(names[position])).dtype
+        empty = pd.DataFrame({position: pd.Series([], dtype=dtype) for position, dtype in enumerate(dtypes)})
+        empty.columns = names
+        # pandas metadata from the final dtypes, so names and dtypes read back as they were written
+        pandas_schema = pa.Schema.from_pandas(empty, preserve_index=False)
+        fields = [raw_field if dtype == raw_dtype else pandas_field
+                  for raw_field, pandas_field, dtype, raw_dtype
+                  in zip(raw_schema, pandas_schema, dtypes, raw_dtypes)]
+        schema = pa.schema(fields, metadata=pandas_schema.metadata)
+        with pa.ipc.new_file(dest_path, schema) as writer:
+            for index in range(reader.num_record_batches):
+                frame = reader.get_batch(index).to_pandas()
+                for position, dtype in enumerate(dtypes):
+                    if frame.dtypes.iloc[position] != dtype:
+                        frame.isetitem(position, frame.iloc[:, position].astype(dtype))
+                arrays = [pa.Array.from_pandas(frame.iloc[:, position], type=field.type)
+                          for position, field in enumerate(schema)]
+                writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+
+
+def write_columnar_batches(chunks, dest_path, compact=None):
+    """Write DataFrame chunks (e.g. :func:`ingest.iter_excel_batches`) as one Arrow IPC file.
+
+    Unlike concatenating the chunks and calling :func:`write_columnar`, only
+    one chunk, or one column, is in memory at a time: chunks are appended to
+    a scratch file as they arrive, a column whose type changes between
+    chunks widens what is already written, and ``compact(series)`` then
+    picks each column's final dtype from the whole column before the
+    batches are copied into ``dest_path``. Reads back like
+    ``write_columnar`` of the concatenated frame with each column replaced
+    by ``compact(column)``.
+    """
+    raw_path = f'{dest_path}.{threading.get_ident()}.raw'
+    tmp_path = f'{dest_path}.{threading.get_ident()}.tmp'
+    try:
+        names = _write_raw_batches(chunks, raw_path)
+        _write_compacted(raw_path, tmp_path, names, compact)
+        os.replace(tmp_path, dest_path)
+    finally:
+        for path in (raw_path, f'{raw_path}.widen', tmp_path):
+            if os.path.exists(path):
+                os.remove(path)
+    return dest_path
+
+
+def columnar_column_names(path):
+    """Column names from the file footer, without reading any data."""
+    import pyarrow as pa
+
+    with pa.memory_map(path, 'r') as source:
+        return pa.ipc.open_file(source).schema.names
+
+
+def columnar_empty_frame(path):
+    """Zero-row DataFrame with the stored dtypes, read from the footer only."""
+    import pyarrow as pa
+
+    with pa.memory_map(path, 'r') as source:
+        return pa.ipc.open_file(source).schema.empty_table().to_pandas()
+
+
+def read_columnar(path, columns=None):
+    """Memory-mapped read of ``columns`` (or all of them) into a DataFrame.
+
+    Unknown column names are ignored so callers can validate against the
+    returned frame the same way they would against a full parse.
+    """
+    from pyarrow import feather
+
+    if columns is not None:
+        available = set(columnar_column_names(path))
+        columns = [column for column in dict.fromkeys(columns) if column in available]
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    return table.to_pandas()
+
+
+_ARROW_COMPARISONS = {'==': 'equal', '!=': 'not_equal', '>': 'greater', '>=': 'greater_equal',
+                      '<': 'less', '<=': 'less_equal'}
+
+
+def columnar_mask(path, column, op, value):
+    """Rows where ``column op value`` holds, as a boolean NumPy array.
+
+    Evaluated by Arrow compute against the memory-mapped column, so only
+    that column is read and it is never converted to pandas. ``value`` must
+    already match the column's type (a list for ``in``); missing values
+    never match.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from pyarrow import feather
+
+    array = feather.read_table(path, columns=[column], memory_map=True).column(0)
+    if op == 'in':
+        if pa.types.is_dictionary(array.type):
+            array = array.cast(array.type.value_type)
+        if pa.types.is_integer(array.type) or pa.types.is_floating(array.type):
+            # Compare as floats, so 2.5 can't be truncated into matching an integer 2
+            array, value_set = array.cast(pa.float64()), pa.array(value, pa.float64())
+        else:
+            value_set = pa.array(value).cast(array.type)
+        result = pc.is_in(array, value_set=value_set)
+    else:
+        result = getattr(pc, _ARROW_COMPARISONS[op])(array, pa.scalar(value))
+    return result.fill_null(False).to_numpy(zero_copy_only=False)
+
+
+class ColumnarConverter:
+    """Background conversion of uploads into the columnar store.
+
+    Submissions for the same destination are deduplicated, so uploading the
+    same workbook twice only converts it once.
+    """
+
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='columnar')
+        self._pending = {}
+        self._failed = set()
+        self._lock = threading.Lock()
+
+    def submit(self, dest_path, build_frame=None, on_done=None, write=None):
+        """Queue a conversion; returns its future, or None if it already failed once.
+
+        The file is written from the frame ``build_frame()`` returns, or by
+        ``write(dest_path)`` itself (e.g. with :func:`write_columnar_batches`).
+        """
+        with self._lock:
+            if dest_path in self._failed:
+                return None
+            future = self._pending.get(dest_path)
+            if future is not None:
+                return future
+            future = self._executor.submit(self._convert, dest_path, build_frame, on_done, write)
+            self._pending[dest_path] = future
+        return future
+
+    def wait(self, dest_path, timeout=None):
+        """Block until a pending conversion finishes; True if the file exists."""
+        with self._lock:
+            future = self._pending.get(dest_path)
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+        return os.path.exists(dest_path)
+
+    def _convert(self, dest_path, build_frame, on_done, write):
+        try:
+            if not os.path.exists(dest_path):
+                if write is not None:
+                    write(dest_path)
+                else:
+                    write_columnar(build_frame(), dest_path)
+            if on_done is not None:
+                on_done(dest_path)
+            return dest_path
+        except Exception:
+            # Not fatal: reads keep falling back to the parsed workbook
+            logger.exception('Columnar conversion failed for %s', dest_path)
+            with self._lock:
+                self._failed.add(dest_path)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(dest_path, None)
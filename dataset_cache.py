@@ -0,0 +1,170 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_digest_memo = {}
+_digest_lock = threading.Lock()
+_shared_digests = None
+
+
+def share_digests(store):
+    """Also look digests up in, and record them to, ``store`` (``get_digest``/``put_digest``), e.g. a host-wide cache."""
+    global _shared_digests
+    _shared_digests = store
+
+
+def file_digest(file_path):
+    """Return the sha256 hex digest of a file, memoized on path, size and mtime."""
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        digest = _digest_memo.get(memo_key)
+    if digest is not None:
+        return digest
+    if _shared_digests is not None:
+        digest = _shared_digests.get_digest(memo_key)
+        if digest is not None:
+            with _digest_lock:
+                _digest_memo[memo_key] = digest
+            return digest
+
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    with _digest_lock:
+        _digest_memo[memo_key] = digest
+    if _shared_digests is not None:
+        _shared_digests.put_digest(memo_key, digest)
+    return digest
+
+
+def remember_digest(file_path, digest):
+    """Record a digest computed elsewhere (e.g. while the upload streamed in)."""
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        _digest_memo[memo_key] = digest
+    if _shared_digests is not None:
+        _shared_digests.put_digest(memo_key, digest)
+
+
+def frame_nbytes(frame):
+    """Approximate in-memory size of a DataFrame or Series, including object payloads."""
+    usage = frame.memory_usage(index=True, deep=True)
+    return int(usage.sum() if hasattr(usage, 'sum') else usage)
+
+
+class DatasetCache:
+    """Process-wide LRU cache of parsed DataFrames bounded by a memory budget.
+
+    Keys are ``(file_path, content_digest)`` tuples so a re-uploaded file with
+    new content never serves a stale frame. Frames are shared between requests
+    and must be treated as read-only by callers.
+    """
+
+    def __init__(self, max_bytes, sizeof=frame_nbytes):
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._lock = threading.Lock()
+        self._loading = {}  # key -> Lock, so concurrent misses parse only once
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        nbytes = self._sizeof(value)
+        with self._lock:
+            self._discard(key)
+            if nbytes > self.max_bytes:
+                # Larger than the whole budget: serve it, but don't keep it
+                return value
+            self._entries[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                self._evict_oldest()
+        return value
+
+    def get_or_load(self, key, loader):
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            # Another request may have finished loading while we waited
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    return entry[0]
+            try:
+                return self.put(key, loader())
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._discard(key)
+        return entry[0] if entry else None
+
+    def pop_where(self, predicate):
+        """Remove every entry whose key satisfies ``predicate``; returns how many there were."""
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self._discard(key)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+        return entry
+
+    def _evict_oldest(self):
+        _, (_, nbytes) = self._entries.popitem(last=False)
+        self.current_bytes -= nbytes
+        self.evictions += 1
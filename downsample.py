@@ -0,0 +1,75 @@
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+
+DOWNSAMPLE_METHODS = ('lttb', 'minmax')
+
+
+def lttb_indices(x, y, n_out):
+    """Indices of the points Largest-Triangle-Three-Buckets keeps out of ``n_out``.
+
+    ``x`` must be sorted. The first and last points are always kept; every
+    bucket in between contributes the point forming the largest triangle with
+    the previously kept point and the next bucket's average, which preserves
+    the visual shape of a line far better than taking every k-th point.
+    """
+    n = len(x)
+    if n_out >= n or n <= 2:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1])
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # n_out - 2 buckets of (almost) equal size over the points between the ends
+    every = (n - 2) / (n_out - 2)
+    bounds = (np.arange(n_out - 1) * every).astype(np.int64) + 1
+    counts = np.diff(bounds)
+    mean_x = np.add.reduceat(x[:n - 1], bounds[:-1]) / counts
+    mean_y = np.add.reduceat(y[:n - 1], bounds[:-1]) / counts
+    # Each bucket is scored against the next bucket's average; the last against the end point
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = bounds[i], bounds[i + 1]
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - next_x[i]) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (next_y[i] - ay))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(y, n_out):
+    """Indices of each bucket's minimum and maximum, at most ``n_out`` of them.
+
+    Cheaper than LTTB and guarantees no spike is lost, which suits dense,
+    noisy signals. The first and last points are always kept.
+    """
+    n = len(y)
+    if n_out >= n or n <= 2:
+        return np.arange(n)
+    y = np.asarray(y, dtype=np.float64)
+    inner = n - 2
+    size = -(-inner // max(1, (n_out - 2) // 2))
+    buckets = -(-inner // size)  # rounding the size up can leave fewer buckets than asked for
+    # Pad to a rectangle so every bucket is reduced in one vectorized call
+    padded = np.full(buckets * size, np.nan)
+    padded[:inner] = y[1:n - 1]
+    blocks = padded.reshape(buckets, size)
+    offsets = np.arange(buckets) * size + 1
+    keep = np.concatenate(([0], offsets + np.nanargmin(blocks, axis=1),
+                           offsets + np.nanargmax(blocks, axis=1), [n - 1]))
+    return np.unique(keep)
+
+
+def downsample_indices(x, y, max_points, method='lttb'):
+    """Sorted indices of at most ``max_points`` points of a series sorted by ``x``."""
+    if method == 'lttb':
+        return lttb_indices(x, y, max_points)
+    if method == 'minmax':
+        return minmax_indices(y, max_points)
+    raise ValueError(f'Unsupported downsampling method "{method}". Use one of: {", ".join(DOWNSAMPLE_METHODS)}.')
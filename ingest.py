@@ -0,0 +1,434 @@
+import logging
+import posixpath
+import zipfile
+from xml.etree import ElementTree
+
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+DEFAULT_BATCH_ROWS = 10000
+DEFAULT_SCHEMA_SAMPLE_ROWS = 1000
+DEFAULT_MAX_CATEGORY_RATIO = 0.5  # Text columns with at most this many distinct values per row become categorical
+
+logger = logging.getLogger(__name__)
+
+_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+_DOC_REL_ID = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+
+
+def _open_workbook(file_path):
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    try:
+        # read_only streams the sheet XML instead of building the full cell model
+        return load_workbook(file_path, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException, KeyError) as e:
+        raise pd.errors.ParserError(f'Not a readable .xlsx workbook: {e}') from e
+
+
+def _sheet_dimension(archive, path):
+    # The <dimension> element sits before <sheetData>, so stop before any cell is read
+    with archive.open(path) as f:
+        for _, element in ElementTree.iterparse(f, events=('start',)):
+            if element.tag == f'{_MAIN_NS}dimension':
+                from openpyxl.utils.cell import range_boundaries
+
+                ref = element.get('ref', '')
+                try:
+                    min_col, min_row, max_col, max_row = range_boundaries(ref if ':' in ref else f'{ref}:{ref}')
+                except (TypeError, ValueError):
+                    return None, None
+                return max_row - min_row + 1, max_col - min_col + 1
+            if element.tag == f'{_MAIN_NS}sheetData':
+                break
+    return None, None
+
+
+def _worksheet_parts(archive):
+    # (name, path) of each worksheet in workbook order, the shared strings' path, and the workbook element
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    relationships = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    targets = {}
+    shared_strings = None
+    for rel in relationships.iter(f'{_PACKAGE_REL_NS}Relationship'):
+        target = rel.get('Target', '')
+        path = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+        targets[rel.get('Id')] = (path, rel.get('Type', ''))
+        if rel.get('Type', '').endswith('/sharedStrings'):
+            shared_strings = path
+    sheets = []
+    for sheet in workbook.iter(f'{_MAIN_NS}sheet'):
+        path, rel_type = targets.get(sheet.get(_DOC_REL_ID), (None, ''))
+        if path is not None and rel_type.endswith('/worksheet'):  # chartsheets and dialog sheets have no rows to plot
+            sheets.append((sheet.get('name'), path))
+    return sheets, shared_strings, workbook
+
+
+def list_sheets(file_path):
+    """Worksheet names and declared dimensions, in workbook order.
+
+    Read straight from the package XML (workbook.xml and the top of each
+    sheet), without loading shared strings or parsing any cells, so it costs
+    about the same for a 40-sheet workbook as for a one-sheet one. ``rows``
+    counts the header row; both are None when the file doesn't record them.
+    """
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            sheets = []
+            for name, path in _worksheet_parts(archive)[0]:
+                rows, columns = _sheet_dimension(archive, path)
+                sheets.append({'name': name, 'rows': rows, 'columns': columns})
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+        raise pd.errors.ParserError(f'Not a readable .xlsx workbook: {e}') from e
+    return sheets
+
+
+def _column_names(header):
+    # Same naming as pd.read_excel: blank headers become "Unnamed: i", repeats get ".1", ".2"
+    while header and header[-1] is None:
+        header = header[:-1]
+    names = []
+    seen = {}
+    for i, value in enumerate(header):
+        name = f'Unnamed: {i}' if value is None else value
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _date_styles(archive):
+    # Indexes of the cell styles whose number format shows a date (and of those showing a duration)
+    from openpyxl.styles.stylesheet import Stylesheet
+
+    try:
+        stylesheet = Stylesheet.from_tree(ElementTree.fromstring(archive.read('xl/styles.xml')))
+    except KeyError:
+        return set(), set()
+    return stylesheet.date_formats, stylesheet.timedelta_formats
+
+
+class _SharedString(int):
+    """Index into the shared strings table, standing in for the string until it is looked up."""
+
+
+def _cell_value(cell, date_formats, timedelta_formats, epoch):
+    # The value openpyxl's read-only, data-only reader gives a <c> element; shared
+    # strings come back as _SharedString(index) to be looked up once the sample is read
+    from openpyxl.cell.text import Text
+    from openpyxl.utils.datetime import from_excel, from_ISO8601
+
+    data_type = cell.get('t', 'n')
+    if data_type == 'inlineStr':
+        child = cell.find(f'{_MAIN_NS}is')
+        return Text.from_tree(child).content if child is not None else None
+    value = cell.findtext(f'{_MAIN_NS}v') or None
+    if value is None:
+        return None
+    if data_type == 'n':
+        value = float(value) if '.' in value or 'e' in value.lower() else int(value)
+        style = int(cell.get('s', 0))
+        if style in date_formats:
+            try:
+                return from_excel(value, epoch, timedelta=style in timedelta_formats)
+            except (OverflowError, ValueError):
+                return '#VALUE!'
+        return value
+    if data_type == 's':
+        return _SharedString(int(value))
+    if data_type == 'b':
+        return bool(int(value))
+    if data_type == 'd':
+        return from_ISO8601(value)
+    return value  # 'str' (formula results) and 'e' (errors such as #N/A)
+
+
+def _sample_sheet_rows(archive, path, sample_rows, epoch):
+    # Header plus the first `sample_rows` non-blank rows, iterparsed so the
+    # rest of the sheet is never read
+    from openpyxl.utils.cell import column_index_from_string, coordinate_from_string
+
+    date_formats, timedelta_formats = _date_styles(archive)
+    header = []
+    rows = []
+    number = 0
+    with archive.open(path) as f:
+        for _, element in ElementTree.iterparse(f):
+            if element.tag != f'{_MAIN_NS}row':
+                continue
+            values = []
+            for position, cell in enumerate(element.iter(f'{_MAIN_NS}c')):
+                ref = cell.get('r')
+                column = column_index_from_string(coordinate_from_string(ref)[0]) - 1 if ref else position
+                values.extend([None] * (column + 1 - len(values)))
+                values[column] = _cell_value(cell, date_formats, timedelta_formats, epoch)
+            number = int(element.get('r', number + 1))
+            element.clear()
+            if number == 1:
+                header = values
+                continue
+            if not any(value is not None for value in header):
+                break  # No header row: nothing to sample
+            values = values[:len(header)]
+            if any(value is not None for value in values):
+                rows.append(values + [None] * (len(header) - len(values)))
+                if len(rows) >= sample_rows:
+                    break
+    return header, rows
+
+
+def _shared_strings(archive, path, indexes):
+    # Only the strings at `indexes`; the table is in order of first use, so a
+    # sample's strings sit near its start and the read stops there
+    from openpyxl.cell.text import Text
+
+    strings = {}
+    if not indexes or path is None:
+        return strings
+    last = max(indexes)
+    with archive.open(path) as f:
+        position = 0
+        for _, element in ElementTree.iterparse(f):
+            if element.tag != f'{_MAIN_NS}si':
+                continue
+            if position in indexes:
+                strings[position] = Text.from_tree(element).content.replace('x005F_', '')
+            element.clear()
+            if position >= last:
+                break
+            position += 1
+    return strings
+
+
+def read_excel_sample(file_path, sample_rows=DEFAULT_SCHEMA_SAMPLE_ROWS, sheet_name=None):
+    """The first ``sample_rows`` data rows of a sheet, typed the way :func:`read_excel_streaming` types them.
+
+    Reads the sheet XML directly, like :func:`list_sheets`, and stops after
+    the sample; only the shared strings the sample uses are looked up. The
+    cost doesn't grow with the sheet, where opening the workbook with
+    openpyxl reads every shared string first.
+    """
+    from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900
+
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            sheets, shared_strings_path, workbook = _worksheet_parts(archive)
+            if not sheets:
+                raise pd.errors.ParserError('Not a readable .xlsx workbook: it has no worksheets')
+            if sheet_name is None:
+                path = sheets[0][1]
+            else:
+                path = dict(sheets).get(sheet_name)
+                if path is None:
+                    raise ValueError(f'Sheet "{sheet_name}" not found in the file.')
+            properties = workbook.find(f'{_MAIN_NS}workbookPr')
+            date1904 = properties is not None and properties.get('date1904') in ('1', 'true')
+            header, rows = _sample_sheet_rows(archive, path, sample_rows,
+                                              CALENDAR_MAC_1904 if date1904 else CALENDAR_WINDOWS_1900)
+            indexes = {value for row in [header] + rows for value in row if isinstance(value, _SharedString)}
+            strings = _shared_strings(archive, shared_strings_path, indexes)
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+        raise pd.errors.ParserError(f'Not a readable .xlsx workbook: {e}') from e
+
+    def resolve(value):
+        return strings.get(value) if isinstance(value, _SharedString) else value
+
+    header = [resolve(value) for value in header]
+    if all(value is None for value in header):
+        raise pd.errors.EmptyDataError('No columns to parse from file')
+    columns = _column_names(header)
+    rows = [[resolve(value) for value in row[:len(columns)]] for row in rows]
+    rows = [row for row in rows if any(value is not None for value in row)]
+    return _infer_object_columns(_batch_frame(rows, columns))
+
+
+def _infer_object_columns(df):
+    # A chunk where a column was entirely blank comes out as object, which
+    # would otherwise drag that column's concatenated dtype to object as well
+    object_columns = df.columns[df.dtypes == object]
+    if len(object_columns):
+        df[object_columns] = df[object_columns].infer_objects()
+    return df
+
+
+def _batch_frame(rows, columns):
+    return pd.DataFrame.from_records(rows, columns=columns)
+
+
+def iter_excel_batches(file_path, batch_rows=DEFAULT_BATCH_ROWS, row_limit=None, progress=None, sheet_name=None,
+                       columns=None):
+    """Yield one sheet of a workbook (the first unless named) as typed DataFrame chunks.
+
+    Rows are pulled one at a time from a read-only workbook and turned into a
+    DataFrame every ``batch_rows`` rows, so the raw cell values held at once
+    are bounded by the batch size rather than by the file size. Stops after
+    ``row_limit`` data rows if given. With ``columns``, only those columns
+    are kept (in sheet order; unknown names are ignored). ``progress(rows_read,
+    total_rows)`` is called after each batch; ``total_rows`` is the sheet's
+    declared dimension and may be None for files that don't record one.
+    """
+    workbook = _open_workbook(file_path)
+    try:
+        if sheet_name is None:
+            sheet = workbook.worksheets[0]
+        elif sheet_name in workbook.sheetnames:
+            sheet = workbook[sheet_name]
+        else:
+            raise ValueError(f'Sheet "{sheet_name}" not found in the file.')
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None or all(value is None for value in header):
+            raise pd.errors.EmptyDataError('No columns to parse from file')
+        names = _column_names(header)
+        width = len(names)
+        keep = None
+        if columns is not None:
+            wanted = set(columns)
+            keep = [position for position, name in enumerate(names) if name in wanted]
+            names = [names[position] for position in keep]
+        total_rows = sheet.max_row - 1 if sheet.max_row else None
+        if total_rows is not None and row_limit is not None:
+            total_rows = min(total_rows, row_limit)
+
+        batch = []
+        rows_read = 0
+        for row in rows:
+            if row_limit is not None and rows_read + len(batch) >= row_limit:
+                break
+            row = row[:width]
+            if all(value is None for value in row):
+                continue
+            if len(row) < width:
+                row = row + (None,) * (width - len(row))
+            if keep is not None:
+                row = tuple(row[position] for position in keep)
+            batch.append(row)
+            if len(batch) >= batch_rows:
+                rows_read += len(batch)
+                yield _batch_frame(batch, names)
+                batch = []
+                if progress is not None:
+                    progress(rows_read, total_rows)
+
+        if batch or rows_read == 0:
+            rows_read += len(batch)
+            yield _batch_frame(batch, names)
+            if progress is not None:
+                progress(rows_read, total_rows)
+    finally:
+        workbook.close()
+
+
+def read_excel_streaming(file_path, batch_rows=DEFAULT_BATCH_ROWS, row_limit=None, progress=None, sheet_name=None,
+                         columns=None):
+    """Drop-in for ``pd.read_excel(file_path, sheet_name, usecols=columns)`` built on :func:`iter_excel_batches`."""
+    chunks = list(iter_excel_batches(file_path, batch_rows=batch_rows, row_limit=row_limit, progress=progress,
+                                     sheet_name=sheet_name, columns=columns))
+    df = chunks[0] if len(chunks) == 1 else pd.concat(chunks, ignore_index=True)
+    return _infer_object_columns(df)
+
+
+def _is_text(series):
+    if isinstance(series.dtype, pd.StringDtype):
+        return True
+    return series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) == 'string'
+
+
+def _compact_column(series, max_category_ratio):
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype) or (isinstance(dtype, pd.api.extensions.ExtensionDtype)
+                                             and not isinstance(dtype, pd.StringDtype)):
+        return series
+    if pd.api.types.is_integer_dtype(dtype):
+        return pd.to_numeric(series, downcast='integer')
+    if dtype == np.float64:
+        # Only where every value survives the round trip, so no chart shifts by a rounding error
+        narrowed = series.astype(np.float32)
+        if np.array_equal(narrowed.to_numpy(dtype=np.float64), series.to_numpy(), equal_nan=True):
+            return narrowed
+        return series
+    if _is_text(series) and series.nunique() <= max_category_ratio * len(series):
+        return series.astype('category')
+    return series
+
+
+def compact_frame(df, max_category_ratio=DEFAULT_MAX_CATEGORY_RATIO):
+    """Shrink ``df`` to the smallest dtypes that hold exactly the same values.
+
+    Repetitive text columns become ``category`` (stored as dictionary arrays
+    in the Arrow store), integers are downcast to the narrowest integer type
+    that fits and floats to float32 where that is lossless. Returns the new
+    frame and a report with ``bytes_before``, ``bytes_after`` and the
+    ``converted`` columns' new dtypes.
+    """
+    bytes_before = int(df.memory_usage(index=True, deep=True).sum())
+    compacted = df.copy(deep=False)
+    converted = {}
+    for position, name in enumerate(df.columns):
+        column = df.iloc[:, position]
+        narrowed = _compact_column(column, max_category_ratio)
+        if narrowed.dtype != column.dtype:
+            compacted.isetitem(position, narrowed)
+            converted[name] = str(narrowed.dtype)
+    bytes_after = int(compacted.memory_usage(index=True, deep=True).sum())
+    return compacted, {'bytes_before': bytes_before, 'bytes_after': bytes_after, 'converted': converted}
+
+
+def column_compactor(max_category_ratio=DEFAULT_MAX_CATEGORY_RATIO):
+    """:func:`compact_frame` for a frame that is only ever seen one column at a time.
+
+    Returns ``(compact, report)``: ``compact(series)`` returns the column's
+    compact form and adds it to ``report``, which has compact_frame's keys
+    (its byte counts leave out the index).
+    """
+    report = {'bytes_before': 0, 'bytes_after': 0, 'converted': {}}
+
+    def compact(series):
+        narrowed = _compact_column(series, max_category_ratio)
+        report['bytes_before'] += int(series.memory_usage(index=False, deep=True))
+        report['bytes_after'] += int(narrowed.memory_usage(index=False, deep=True))
+        if narrowed.dtype != series.dtype:
+            report['converted'][series.name] = str(narrowed.dtype)
+        return narrowed
+    return compact, report
+
+
+def frame_schema(df):
+    """Column lists the results page needs, derived from a frame's dtypes."""
+    return {
+        'columns': df.columns.tolist(),
+        'numerical_columns': df.select_dtypes(include=np.number).columns.tolist(),
+        'categorical_columns': df.select_dtypes(include=['object', 'string', 'category']).columns.tolist(),
+    }
+
+
+def infer_schema(file_path, sample_rows=DEFAULT_SCHEMA_SAMPLE_ROWS, sheet_name=None):
+    """Schema from the header row and the first ``sample_rows`` data rows.
+
+    Costs the same whatever the size of the sheet (see :func:`read_excel_sample`).
+    Types are only as good as the sample: a column whose first rows are all
+    numbers is reported as numerical, and chart validation against the full
+    data still applies.
+    """
+    sample = read_excel_sample(file_path, sample_rows, sheet_name=sheet_name)
+    schema = frame_schema(sample)
+    schema['sampled_rows'] = len(sample)
+    return schema
+
+
+def log_progress(file_path):
+    """Progress callback that logs how far ingestion of ``file_path`` has got."""
+    def report(rows_read, total_rows):
+        if total_rows:
+            logger.info('Ingesting %s: %d/%d rows (%.0f%%)', file_path, rows_read, total_rows,
+                        100.0 * rows_read / total_rows)
+        else:
+            logger.info('Ingesting %s: %d rows', file_path, rows_read)
+    return report
@@ -0,0 +1,151 @@
+import cProfile
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+@contextmanager
+def stage(name):
+    """Time a block as stage ``name`` of the current request.
+
+    A no-op outside a request (e.g. in background threads or chart worker
+    processes), so library code can be instrumented unconditionally.
+    """
+    if not has_request_context() or 'timings' not in g:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        g.timings[name] = g.timings.get(name, 0.0) + elapsed
+
+
+def note(name, value):
+    """Attach a per-request fact (row count, cache hit or miss, ...) to the timing report."""
+    if has_request_context() and 'notes' in g:
+        g.notes[name] = value
+
+
+def start_request(profile=False):
+    g.timings = {}
+    g.notes = {}
+    g.request_started = time.perf_counter()
+    if profile:
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def finish_request(response, metrics, endpoint, profile_dir=None):
+    """Publish the request's stages as Server-Timing and into ``metrics``."""
+    if 'request_started' not in g:
+        return response
+    total = time.perf_counter() - g.request_started
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+            path = os.path.join(profile_dir, f'{endpoint or "unknown"}-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{threading.get_ident()}.prof')
+            profiler.dump_stats(path)
+            response.headers['X-Profile'] = os.path.basename(path)
+
+    endpoint = endpoint or 'unknown'
+    bytes_out = None if response.is_streamed else response.calculate_content_length()
+    metrics.observe_request(endpoint, response.status_code, total, g.timings, bytes_out, g.notes)
+
+    entries = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in g.timings.items()]
+    entries.append(f'total;dur={total * 1000:.2f}')
+    entries.extend(f'{name};desc="{value}"' for name, value in g.notes.items())
+    if bytes_out is not None:
+        entries.append(f'bytes-out;desc="{bytes_out}"')
+    response.headers['Server-Timing'] = ', '.join(entries)
+    return response
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRegistry:
+    """Request and stage metrics in Prometheus text exposition format.
+
+    Cache and queue statistics are read at scrape time from the callables
+    passed to :meth:`add_collector`, each returning ``{name: value}``.
+    """
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._requests = {}  # (endpoint, status) -> count
+        self._bytes = {}  # endpoint -> bytes out
+        self._notes = {}  # (endpoint, name, value) -> count, for low-cardinality notes
+        self._histograms = {}  # (endpoint, stage) -> [bucket counts..., sum, count]
+        self._collectors = []  # (prefix, callable)
+
+    def add_collector(self, prefix, collect):
+        self._collectors.append((prefix, collect))
+
+    def observe_request(self, endpoint, status, total, timings, bytes_out=None, notes=None):
+        with self._lock:
+            self._requests[(endpoint, status)] = self._requests.get((endpoint, status), 0) + 1
+            if bytes_out is not None:
+                self._bytes[endpoint] = self._bytes.get(endpoint, 0) + bytes_out
+            self._observe(endpoint, 'total', total)
+            for name, seconds in timings.items():
+                self._observe(endpoint, name, seconds)
+            for name, value in (notes or {}).items():
+                if isinstance(value, str):
+                    key = (endpoint, name, value)
+                    self._notes[key] = self._notes.get(key, 0) + 1
+
+    def render(self):
+        lines = [
+            '# HELP xlab_requests_total Requests handled, by endpoint and status.',
+            '# TYPE xlab_requests_total counter',
+        ]
+        with self._lock:
+            for (endpoint, status), count in sorted(self._requests.items()):
+                lines.append(f'xlab_requests_total{_labels(endpoint=endpoint, status=status)} {count}')
+            lines += ['# HELP xlab_response_bytes_total Response body bytes sent, by endpoint.',
+                      '# TYPE xlab_response_bytes_total counter']
+            for endpoint, total in sorted(self._bytes.items()):
+                lines.append(f'xlab_response_bytes_total{_labels(endpoint=endpoint)} {total}')
+            lines += ['# HELP xlab_request_events_total Per-request outcomes such as cache hits, by endpoint.',
+                      '# TYPE xlab_request_events_total counter']
+            for (endpoint, name, value), count in sorted(self._notes.items()):
+                lines.append(f'xlab_request_events_total{_labels(endpoint=endpoint, event=name, value=value)} {count}')
+            lines += ['# HELP xlab_stage_seconds Time spent in each request stage.',
+                      '# TYPE xlab_stage_seconds histogram']
+            for (endpoint, name), values in sorted(self._histograms.items()):
+                for bound, count in zip(self.buckets, values):
+                    lines.append(f'xlab_stage_seconds_bucket{_labels(endpoint=endpoint, stage=name, le=bound)} {count}')
+                count = values[-1]
+                lines.append(f'xlab_stage_seconds_bucket{_labels(endpoint=endpoint, stage=name, le="+Inf")} {count}')
+                lines.append(f'xlab_stage_seconds_sum{_labels(endpoint=endpoint, stage=name)} {values[-2]:.6f}')
+                lines.append(f'xlab_stage_seconds_count{_labels(endpoint=endpoint, stage=name)} {count}')
+        for prefix, collect in self._collectors:
+            for name, value in sorted(collect().items()):
+                metric = f'xlab_{prefix}_{name}'
+                lines += [f'# TYPE {metric} gauge', f'{metric} {value}']
+        return '\n'.join(lines) + '\n'
+
+    def _observe(self, endpoint, name, seconds):
+        values = self._histograms.get((endpoint, name))
+        if values is None:
+            values = self._histograms[(endpoint, name)] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                values[i] += 1
+        values[-2] += seconds
+        values[-1] += 1
@@ -0,0 +1,386 @@
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from charts import ChartError, render_chart, spec_columns
+from columnar import read_columnar
+from ingest import read_excel_streaming
+from query import NO_MATCHING_ROWS, QueryError, apply_filters, filter_columns
+
+FINISHED_STATES = ('done', 'failed', 'timeout', 'cancelled')
+
+
+class QueueFull(RuntimeError):
+    """Raised when a job is submitted while the queue is already at capacity."""
+
+
+class JobTimeout(Exception):
+    """Raised inside a worker when a job runs past its time limit."""
+
+
+class JobCancelled(Exception):
+    """Raised inside a worker when its running job is cancelled."""
+
+
+_started_jobs = None  # Queue of (job token, pid, start time) each worker reports to the parent
+_cancelled_tokens = None  # Shared ring of the tokens of jobs the parent wants stopped
+_current_token = None  # Token of the job this worker is running
+
+
+def _raise_timeout(signum, frame):
+    raise JobTimeout('Job exceeded its time limit')
+
+
+TOKEN_BYTES = 32  # Job tokens are uuid4 hex strings
+
+
+def _is_cancelled(token):
+    raw = _cancelled_tokens.raw
+    token = token.encode()
+    return any(raw[start:start + TOKEN_BYTES] == token for start in range(0, len(raw), TOKEN_BYTES))
+
+
+def _raise_cancelled(signum, frame):
+    # The parent may have aimed at a job that has just finished here: only stop one it named
+    if _current_token is not None and _is_cancelled(_current_token):
+        raise JobCancelled('Job was cancelled')
+
+
+def _init_worker(started_jobs, cancelled_tokens):
+    global _started_jobs, _cancelled_tokens
+    _started_jobs, _cancelled_tokens = started_jobs, cancelled_tokens
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, _raise_cancelled)
+
+
+def run_job(token, timeout, fn, *args):
+    # Executed in the worker process: tells the parent where the job runs, so cancel can reach it
+    global _current_token
+    _current_token = token
+    try:
+        if _started_jobs is not None:
+            _started_jobs.put((token, os.getpid(), time.time()))
+            # Cancelled before the parent learned where it runs
+            if _is_cancelled(token):
+                raise JobCancelled('Job was cancelled')
+        return run_with_timeout(timeout, fn, *args)
+    finally:
+        _current_token = None
+
+
+def run_with_timeout(timeout, fn, *args):
+    # Executed in the worker process. Pool workers run jobs on their main
+    # thread, so SIGALRM can interrupt a long pandas/Plotly call there.
+    use_alarm = (timeout and hasattr(signal, 'SIGALRM')
+                 and threading.current_thread() is threading.main_thread())
+    if use_alarm:
+        previous = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return fn(*args)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+
+def load_source(source, columns):
+    """``columns`` of the upload described by ``source``: from its Arrow store if converted, else parsed."""
+    store_path = source.get('store_path')
+    if store_path and os.path.exists(store_path):
+        return read_columnar(store_path, columns)
+    return read_excel_streaming(source['file_path'], batch_rows=source['batch_rows'], row_limit=source['row_limit'],
+                                sheet_name=source.get('sheet'), columns=columns)
+
+
+def batch_columns(specs):
+    """Every column a set of charts reads, in first-use order."""
+    return list(dict.fromkeys(column for spec in specs
+                              for column in spec_columns(spec) + filter_columns(spec.get('filters'))))
+
+
+def chart_job(source, spec):
+    """Worker entry point: load the columns a chart needs and render it.
+
+    ``source`` carries the upload's path, its Arrow store path if converted,
+    and the ingest settings. Data problems come back as ``{'error': ...}``
+    rather than as exceptions, so they reach the user verbatim.
+    """
+    filters = spec.get('filters')
+    df = load_source(source, spec_columns(spec) + filter_columns(filters))
+    try:
+        df = apply_filters(df, filters)
+        if filters and df.empty:
+            return {'error': NO_MATCHING_ROWS}
+        return render_chart(df, spec)
+    except (ChartError, QueryError) as e:
+        return {'error': str(e)}
+
+
+def render_charts(df, specs):
+    """Render several charts from one frame holding all of their columns.
+
+    Charts with the same filters share one filtered frame, so each distinct
+    set of conditions is evaluated once per batch. Fragments leave plotly.js
+    out for a page that loads it once; a chart's data problem comes back as
+    its ``{'error': ...}`` without failing the others.
+    """
+    subsets = {}
+    results = []
+    for spec in specs:
+        filters = spec.get('filters') or []
+        try:
+            key = tuple(map(tuple, filters))
+            if key not in subsets:
+                subsets[key] = apply_filters(df, filters)
+            if filters and subsets[key].empty:
+                results.append({'error': NO_MATCHING_ROWS})
+            else:
+                results.append(render_chart(subsets[key], spec, include_plotlyjs=False))
+        except (ChartError, QueryError) as e:
+            results.append({'error': str(e)})
+    return results
+
+
+def batch_chart_job(source, specs):
+    """Worker entry point for a share of a chart batch: one load, then every chart from it."""
+    return render_charts(load_source(source, batch_columns(specs)), specs)
+
+
+class Job:
+    def __init__(self, key, future, meta=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.key = key
+        self.future = future
+        self.meta = meta or {}
+        self.submitted_at = time.time()
+        self.started_at = None  # When a worker picked it up, once the worker has reported it
+        self.submitters = 1  # Submissions sharing this job, see JobQueue.withdraw
+        self.cancelled = False
+        self.inner = None  # Pool future of a job that waited for another one first
+
+
+class JobQueue:
+    """Bounded process pool for CPU-heavy work, with job ids for polling.
+
+    Jobs submitted under a key that already has an unfinished job attach to
+    that job instead of running twice. A job can wait for another future
+    (e.g. the conversion of the data it reads) without holding a worker.
+    Cancelling a running job interrupts it in its worker, where the platform
+    has SIGUSR1. The pool is started on first use.
+    """
+
+    def __init__(self, max_workers=2, max_pending=32, timeout=120, keep_finished=256, start_method=None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.keep_finished = keep_finished
+        self.start_method = start_method
+        self._executor = None
+        self._jobs = OrderedDict()  # job id -> Job
+        self._inflight = {}  # key -> Job
+        self._lock = threading.Lock()
+        self._started_jobs = None
+        self._cancelled_tokens = None
+        self._next_cancel_slot = 0
+        self._worker_pids = {}  # job id -> pid of the worker running it
+
+    def submit(self, key, fn, *args, meta=None, on_success=None, after=None):
+        """Run ``fn(*args)`` in a worker; with ``after`` (a future), only once that has finished, however it did."""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            existing = self._inflight.get(key)
+            if existing is not None and not existing.future.done() and not existing.cancelled:
+                existing.submitters += 1
+                return existing
+            unfinished = sum(1 for job in self._jobs.values() if not job.future.done())
+            if unfinished >= self.max_pending:
+                raise QueueFull(f'{unfinished} jobs are already queued or running')
+            waiting = after is not None and not after.done()
+            future = Future() if waiting else self._submit_to_pool(job_id, fn, args)
+            job = self._add(Job(key, future, meta, job_id))
+            self._inflight[key] = job
+        future.add_done_callback(lambda _: self._finished(job, on_success))
+        if waiting:
+            after.add_done_callback(lambda _: self._start_waiting(job, fn, args))
+        return job
+
+    def add_completed(self, key, result, meta=None):
+        """Register an already-known result (e.g. a cache hit) as a finished job."""
+        future = Future()
+        future.set_result(result)
+        with self._lock:
+            return self._add(Job(key, future, meta))
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a job, interrupting it if it is already running.
+
+        Without SIGUSR1 (on Windows) a running job finishes in its worker,
+        but its result is discarded.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if not job.future.done():
+            job.cancelled = True
+            if not job.future.cancel():
+                self._interrupt(job)
+        return job
+
+    def withdraw(self, job):
+        """Give up on a job for one of its submitters; it is cancelled once none of them wants it."""
+        with self._lock:
+            job.submitters -= 1
+            if job.submitters > 0:
+                return job
+        return self.cancel(job.id)
+
+    def status(self, job):
+        with self._lock:
+            self._collect_started()
+        status = {'job_id': job.id, 'state': self._state(job)}
+        if status['state'] == 'failed':
+            status['error'] = self._error(job)
+        elif status['state'] == 'timeout':
+            status['error'] = f'Chart generation took longer than {self.timeout} seconds and was stopped.'
+        elif status['state'] == 'done':
+            status['messages'] = job.future.result().get('messages', [])
+        return status
+
+    def stats(self):
+        with self._lock:
+            self._collect_started()
+            states = [self._state(job) for job in self._jobs.values()]
+        return {state: states.count(state) for state in ('queued', 'running') + FINISHED_STATES}
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _state(self, job):
+        future = job.future
+        if job.cancelled or future.cancelled():
+            return 'cancelled'
+        if not future.done():
+            # Fallback for platforms without SIGALRM, where the worker can't stop itself; timed
+            # from when a worker picked the job up, not from waiting for `after` or a free worker
+            if (self.timeout and not hasattr(signal, 'SIGALRM') and job.started_at is not None
+                    and time.time() - job.started_at > self.timeout * 2):
+                return 'timeout'
+            return 'running' if future.running() else 'queued'
+        error = future.exception()
+        if isinstance(error, JobTimeout):
+            return 'timeout'
+        if error is not None or 'error' in future.result():
+            return 'failed'
+        return 'done'
+
+    def _error(self, job):
+        error = job.future.exception()
+        return str(error) if error is not None else job.future.result()['error']
+
+    def _add(self, job):
+        self._jobs[job.id] = job
+        # Forget the oldest finished jobs beyond the retention limit
+        finished = [job_id for job_id, old in self._jobs.items() if old.future.done()]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
+        return job
+
+    def _submit_to_pool(self, job_id, fn, args):
+        # Called with the lock held
+        try:
+            return self._get_executor().submit(run_job, job_id, self.timeout, fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool
+            self._executor = None
+            return self._get_executor().submit(run_job, job_id, self.timeout, fn, *args)
+
+    def _start_waiting(self, job, fn, args):
+        # What the job waited for has finished: run it, unless it was cancelled meanwhile
+        if not job.future.set_running_or_notify_cancel():
+            return
+        try:
+            with self._lock:
+                inner = self._submit_to_pool(job.id, fn, args)
+        except Exception as e:
+            job.future.set_exception(e)
+            return
+        job.inner = inner
+        def relay(inner):
+            if inner.cancelled():
+                job.future.set_exception(JobCancelled('Job was cancelled'))
+            elif inner.exception() is not None:
+                job.future.set_exception(inner.exception())
+            else:
+                job.future.set_result(inner.result())
+        inner.add_done_callback(relay)
+
+    def _interrupt(self, job):
+        if job.inner is not None and job.inner.cancel():
+            return
+        if not hasattr(signal, 'SIGUSR1'):
+            return
+        with self._lock:
+            if self._cancelled_tokens is None:
+                return
+            # Named before looking for its worker, so a job that starts meanwhile still sees it.
+            # Each cancel takes the next slot of the ring, which has room for every unfinished
+            # job, so one cancel never overwrites another that is still on its way
+            slots = len(self._cancelled_tokens) // TOKEN_BYTES
+            start = self._next_cancel_slot * TOKEN_BYTES
+            self._cancelled_tokens[start:start + TOKEN_BYTES] = job.id.encode()
+            self._next_cancel_slot = (self._next_cancel_slot + 1) % slots
+            self._collect_started()
+            pid = self._worker_pids.get(job.id)
+        if pid is None:
+            return
+        try:
+            os.kill(pid, signal.SIGUSR1)
+        except ProcessLookupError:
+            pass
+
+    def _collect_started(self):
+        # Called with the lock held
+        if self._started_jobs is None:
+            return
+        while not self._started_jobs.empty():
+            job_id, pid, started_at = self._started_jobs.get()
+            self._worker_pids[job_id] = pid
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.started_at = started_at
+
+    def _finished(self, job, on_success):
+        with self._lock:
+            if self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
+        if on_success is not None and self._state(job) == 'done':
+            on_success(job.future.result())
+        with self._lock:
+            self._collect_started()
+            self._worker_pids.pop(job.id, None)
+
+    def _get_executor(self):
+        if self._executor is None:
+            context = multiprocessing.get_context(self.start_method)
+            self._started_jobs = context.SimpleQueue()
+            self._cancelled_tokens = context.Array('c', TOKEN_BYTES * (self.max_pending + self.max_workers), lock=False)
+            self._next_cancel_slot = 0
+            self._worker_pids = {}
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context,
+                                                 initializer=_init_worker,
+                                                 initargs=(self._started_jobs, self._cancelled_tokens))
+        return self._executor
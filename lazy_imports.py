@@ -0,0 +1,33 @@
+import importlib
+import sys
+
+HEAVY_MODULES = ('numpy', 'pandas', 'plotly.express')
+
+
+class LazyModule:
+    """Stand-in for a module that is only imported when one of its attributes is first used.
+
+    Lets a module write ``pd = lazy_import('pandas')`` and keep using
+    ``pd.DataFrame`` as usual, while importing it costs nothing until then.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        # Only reached for names not set on the stand-in itself; importlib's
+        # own locks make concurrent first uses safe
+        return getattr(importlib.import_module(self._name), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._name in sys.modules else 'not loaded'
+        return f'<lazy module {self._name!r} ({state})>'
+
+
+def lazy_import(name):
+    return LazyModule(name)
+
+
+def loaded_heavy_modules():
+    """Which of the heavy data and charting modules have been imported in this process."""
+    return [name for name in HEAVY_MODULES if name in sys.modules]
@@ -0,0 +1,103 @@
+import operator
+
+from lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+FILTER_OPERATORS = ('==', '!=', '>', '>=', '<', '<=', 'in')
+ORDERED_OPERATORS = ('>', '>=', '<', '<=')
+MAX_FILTERS = 10
+NO_MATCHING_ROWS = 'Filter error: No rows match the selected filters.'
+_COMPARISONS = {'==': operator.eq, '!=': operator.ne, '>': operator.gt, '>=': operator.ge,
+                '<': operator.lt, '<=': operator.le}
+
+
+class QueryError(ValueError):
+    """A filter that can't be applied to the data; the message is shown to the user as is."""
+
+
+def unknown_column(column):
+    return QueryError(f'Filter error: Column "{column}" not found in the file. Please select a valid column.')
+
+
+def filter_spec(form):
+    """Normalized filters from repeated ``filter_column``/``filter_op``/``filter_value`` fields.
+
+    Filters are ANDed, so their order doesn't matter: they are sorted to give
+    equal specs (and shared cache entries) for the same conditions. Rows
+    without a column are ignored, so a form can carry empty filter slots.
+    """
+    rows = zip(form.getlist('filter_column'), form.getlist('filter_op'), form.getlist('filter_value'))
+    return sorted([column, op, value.strip()] for column, op, value in rows if column)
+
+
+def validate_filters(filters):
+    """Raise QueryError for filters that are wrong before looking at any data."""
+    if len(filters) > MAX_FILTERS:
+        raise QueryError(f'Filter error: At most {MAX_FILTERS} filters can be applied at once.')
+    for column, op, value in filters:
+        if op not in FILTER_OPERATORS:
+            raise QueryError(f'Filter error: Unsupported operator "{op}". Please select one of: {", ".join(FILTER_OPERATORS)}.')
+        if value == '':
+            raise QueryError(f'Filter error: Please enter a value to compare "{column}" with.')
+
+
+def filter_columns(filters):
+    """The columns a set of filters reads."""
+    return list(dict.fromkeys(column for column, _, _ in filters or []))
+
+
+def value_kind(dtype):
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'bool'
+    if pd.api.types.is_numeric_dtype(dtype) and not isinstance(dtype, pd.CategoricalDtype):
+        return 'number'
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'datetime'
+    return 'text'
+
+
+def _parse_bool(value):
+    lowered = value.lower()
+    if lowered in ('true', 'yes', '1'):
+        return True
+    if lowered in ('false', 'no', '0'):
+        return False
+    raise ValueError(value)
+
+
+def coerce_value(column, op, value, dtype):
+    """The filter's text value converted to match a column of ``dtype``; a list for ``in``."""
+    kind = value_kind(dtype)
+    if op in ORDERED_OPERATORS and kind in ('text', 'bool'):
+        raise QueryError(f'Filter error: "{op}" needs a numerical or date column, and "{column}" is not one.')
+    convert = {'number': float, 'datetime': pd.Timestamp, 'bool': _parse_bool, 'text': str}[kind]
+    raw = [part.strip() for part in value.split(',')] if op == 'in' else [value]
+    try:
+        values = [convert(part) for part in raw]
+    except (TypeError, ValueError):
+        raise QueryError(f'Filter error: "{value}" is not a valid value for column "{column}".') from None
+    return values if op == 'in' else values[0]
+
+
+def predicate_mask(series, column, op, value):
+    """Boolean NumPy mask of the rows of ``series`` where ``column op value`` holds; missing values never match."""
+    value = coerce_value(column, op, value, series.dtype)
+    if op == 'in':
+        mask = series.isin(value)
+    else:
+        mask = _COMPARISONS[op](series, value)
+    return (mask.fillna(False) & series.notna()).to_numpy(dtype=bool)
+
+
+def apply_filters(df, filters):
+    """Rows of ``df`` matching every filter, evaluated column by column with vectorized comparisons."""
+    if not filters:
+        return df
+    mask = np.ones(len(df), dtype=bool)
+    for column, op, value in filters:
+        if column not in df.columns:
+            raise unknown_column(column)
+        mask &= predicate_mask(df[column], column, op, value)
+    return df[mask]
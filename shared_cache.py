@@ -0,0 +1,190 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CLAIM_TTL = 10 * 60  # Seconds before an abandoned claim (e.g. a killed worker's) lapses
+DEFAULT_DIGEST_TTL = 7 * 24 * 60 * 60  # Digests of files that are gone are never looked up again
+WAIT_POLL_INTERVAL = 0.1
+
+
+class MemoryIndex:
+    """In-process stand-in for ``SqliteIndex``, for tests and single-process runs."""
+
+    def __init__(self):
+        self._entries = {}  # key -> (value, expires_at or None)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry):
+                self._entries.pop(key, None)
+                return None
+            return entry[0]
+
+    def put(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl if ttl is not None else None)
+
+    def add(self, key, value, ttl=None):
+        """Store ``value`` only if ``key`` is absent or expired; True if it was stored."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry):
+                return False
+            self._entries[key] = (value, time.time() + ttl if ttl is not None else None)
+            return True
+
+    def delete(self, key, value=None):
+        """Remove ``key``; with ``value``, only while it still holds that value."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (value is None or entry[0] == value):
+                del self._entries[key]
+
+    def purge(self):
+        """Drop every expired entry; returns how many there were."""
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if self._expired(entry)]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+    @staticmethod
+    def _expired(entry):
+        return entry[1] is not None and entry[1] <= time.time()
+
+
+class SqliteIndex:
+    """Small key-value index every worker process on a host opens.
+
+    A SQLite file in WAL mode: readers never block each other or the
+    writer, and ``add`` is atomic across processes, which makes it usable
+    for claims. Put it on a tmpfs such as ``/dev/shm`` to keep it in memory.
+    Expired entries are only hidden until ``purge`` deletes them.
+    """
+
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connection() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)')
+
+    def get(self, key):
+        row = self._connection().execute('SELECT value FROM entries WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+                                         (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, value, ttl=None):
+        with self._connection() as db:
+            db.execute('INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)',
+                       (key, value, self._expires_at(ttl)))
+
+    def add(self, key, value, ttl=None):
+        """Store ``value`` only if ``key`` is absent or expired; True if it was stored."""
+        with self._connection() as db:
+            db.execute('DELETE FROM entries WHERE key = ? AND expires_at IS NOT NULL AND expires_at <= ?', (key, time.time()))
+            cursor = db.execute('INSERT OR IGNORE INTO entries (key, value, expires_at) VALUES (?, ?, ?)',
+                                (key, value, self._expires_at(ttl)))
+            return cursor.rowcount == 1
+
+    def delete(self, key, value=None):
+        """Remove ``key``; with ``value``, only while it still holds that value."""
+        with self._connection() as db:
+            if value is None:
+                db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            else:
+                db.execute('DELETE FROM entries WHERE key = ? AND value = ?', (key, value))
+
+    def purge(self):
+        """Delete every expired entry; returns how many there were."""
+        with self._connection() as db:
+            return db.execute('DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?',
+                              (time.time(),)).rowcount
+
+    def _expires_at(self, ttl):
+        return time.time() + ttl if ttl is not None else None
+
+    def _connection(self):
+        # One connection per thread, and a fresh one in a forked worker:
+        # SQLite connections can't be shared between threads or carried across fork
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.db = sqlite3.connect(self.path, timeout=self.timeout)
+            self._local.db.execute('PRAGMA journal_mode=WAL')
+            self._local.db.execute('PRAGMA synchronous=NORMAL')
+            self._local.pid = os.getpid()
+        return self._local.db
+
+
+class SharedCache:
+    """Host-wide tier over a key-value index, shared by every worker process.
+
+    Rendered charts are stored here as JSON text, and file digests so a
+    worker doesn't re-hash an upload another one already hashed; both
+    expire, and ``purge`` (run by the storage sweeper) deletes what has.
+    Datasets themselves are shared as memory-mapped Arrow files, which
+    every process reads from the same page cache instead of parsing the
+    workbook again (each still converts the columns it uses to pandas):
+    what this tier adds is a claim per Arrow file, so only one worker parses
+    a sheet while the others wait for its file.
+    """
+
+    def __init__(self, index, owner=None, claim_ttl=DEFAULT_CLAIM_TTL, digest_ttl=DEFAULT_DIGEST_TTL):
+        self.index = index
+        self._owner = owner
+        self.claim_ttl = claim_ttl
+        self.digest_ttl = digest_ttl
+
+    @property
+    def owner(self):
+        # Looked up on use: a cache built before gunicorn forks belongs to each worker in turn
+        return self._owner or f'pid:{os.getpid()}'
+
+
+    # -- rendered charts ----------------------------------------------------
+
+    def get_chart(self, key):
+        """A stored chart and the time it was stored, or ``(None, None)``."""
+        entry = self.index.get(f'chart:{key}')
+        if entry is None:
+            return None, None
+        entry = json.loads(entry)
+        return entry['value'], entry['stored_at']
+
+    def put_chart(self, key, value, ttl=None):
+        self.index.put(f'chart:{key}', json.dumps({'value': value, 'stored_at': time.time()}), ttl)
+
+    # -- file digests -------------------------------------------------------
+
+    def get_digest(self, memo_key):
+        return self.index.get(f'digest:{json.dumps(memo_key)}')
+
+    def put_digest(self, memo_key, digest):
+        self.index.put(f'digest:{json.dumps(memo_key)}', digest, self.digest_ttl)
+
+    def purge(self):
+        return self.index.purge()
+
+    # -- claims on work that should run once per host ------------------------
+
+    def claim(self, name):
+        """True if this process may do ``name``'s work: nobody else holds its claim."""
+        key = f'claim:{name}'
+        return self.index.add(key, self.owner, self.claim_ttl) or self.index.get(key) == self.owner
+
+    def release(self, name):
+        self.index.delete(f'claim:{name}', self.owner)
+
+    def wait_for(self, name, path, timeout):
+        """Wait while another process holds ``name``'s claim for ``path`` to appear; True if it exists."""
+        deadline = time.monotonic() + timeout
+        while not os.path.exists(path):
+            holder = self.index.get(f'claim:{name}')
+            if holder is None or holder == self.owner or time.monotonic() >= deadline:
+                break
+            time.sleep(WAIT_POLL_INTERVAL)
+        return os.path.exists(path)
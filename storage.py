@@ -0,0 +1,348 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+
+OWNERS_FILE = '.owners'  # Session ids holding an object, one per line, kept in its directory
+SESSIONS_DIR = '.sessions'  # Under the root: per session, the object directories it holds, one per line
+ACCESS_WRITE_INTERVAL = 60  # Seconds between writes of an object's last use to its directory's mtime
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaExceeded(Exception):
+    """A file that can't fit in its owner's storage quota even after evicting their older uploads."""
+
+
+def directory_bytes(path):
+    total = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'):
+                    total += entry.stat(follow_symlinks=False).st_size
+    except FileNotFoundError:
+        pass
+    return total
+
+
+def _read_lines(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return {line.strip() for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+
+
+def _add_line(path, line):
+    if line not in _read_lines(path):
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(f'{line}\n')
+
+
+def _write_lines(path, lines):
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(f'{line}\n' for line in sorted(lines))
+        os.replace(tmp_path, path)
+    except FileNotFoundError:
+        pass  # Evicted meanwhile
+
+
+def _read_owners(object_dir):
+    return _read_lines(os.path.join(object_dir, OWNERS_FILE))
+
+
+class StorageManager:
+    """Byte accounting, quotas and eviction for the content-addressed upload store.
+
+    Each ``<root>/<sha256>/`` directory is one tracked object: the workbook
+    plus everything derived from it (Arrow conversions, statistics), which
+    are written alongside it and evicted with it. Objects are charged in
+    full to every session that uploaded them. Both the sessions holding an
+    object and its last use are kept on disk (an owners file, and the
+    directory's mtime, rewritten at most every ``ACCESS_WRITE_INTERVAL``
+    seconds), so every worker process on the host sees the others' uploads
+    and requests before it evicts anything. A per-session list of object
+    directories lets an upload re-read just its owner's objects; the full
+    re-read of the store is left to sweeps. Adding an upload evicts its
+    owner's least recently used objects past ``session_max_bytes``; sweeps
+    evict objects idle for ``ttl_seconds`` and then the least recently used
+    past ``max_bytes``. ``on_evict(file_path)`` is called for the workbook
+    of every evicted object, so callers can drop what they cached for it.
+    """
+
+    def __init__(self, root, max_bytes=None, session_max_bytes=None, ttl_seconds=None, on_evict=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.session_max_bytes = session_max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.on_evict = on_evict
+        self._objects = {}  # object dir -> {'file_path', 'bytes', 'last_access', 'marked_at', 'owners'}
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self._scan()
+
+    def add(self, file_path, owner=None):
+        """Track an upload for ``owner`` (a session id string) and enforce their quota."""
+        object_dir = os.path.dirname(file_path)
+        with self._lock:
+            entry = self._track(object_dir, file_path)
+        self._mark_used(object_dir, entry, force=True)
+        if owner is not None:
+            _add_line(os.path.join(object_dir, OWNERS_FILE), owner)
+            os.makedirs(os.path.join(self.root, SESSIONS_DIR), exist_ok=True)
+            _add_line(self._session_path(owner), os.path.basename(object_dir))
+            owners = _read_owners(object_dir) | {owner}
+            with self._lock:
+                entry['owners'] = owners
+        if owner is not None and self.session_max_bytes is not None:
+            # Count what this session stored through other worker processes too
+            self._refresh_owned(owner)
+            if entry['bytes'] > self.session_max_bytes:
+                self._disown(object_dir, owner)
+                raise QuotaExceeded(f'The file is larger than the storage quota of {self.session_max_bytes / (1024 * 1024):.0f} MB.')
+            for other_dir in self._owned_lru(owner):
+                if self.usage(owner) <= self.session_max_bytes:
+                    break
+                if other_dir != object_dir:
+                    self._disown(other_dir, owner)
+        return entry['bytes']
+
+    def touch(self, file_path):
+        """True if ``file_path`` is stored, marking it used."""
+        object_dir = os.path.dirname(file_path)
+        if not os.path.exists(file_path):
+            # Possibly evicted by another process: drop what this one knew of it
+            with self._lock:
+                entry = self._objects.pop(object_dir, None)
+            if entry is not None and entry['file_path'] == file_path and self.on_evict is not None:
+                self.on_evict(file_path)
+            return False
+        with self._lock:
+            entry = self._objects.get(object_dir)
+            if entry is None or entry['file_path'] != file_path:
+                # Stored by another process, or before this one started
+                entry = self._track(object_dir, file_path)
+        self._mark_used(object_dir, entry)
+        return True
+
+    def usage(self, owner=None):
+        with self._lock:
+            return sum(entry['bytes'] for entry in self._objects.values()
+                       if owner is None or owner in entry['owners'])
+
+    def evict(self, object_dir):
+        with self._lock:
+            entry = self._objects.pop(object_dir, None)
+        if entry is None:
+            return False
+        shutil.rmtree(object_dir, ignore_errors=True)
+        self.evictions += 1
+        logger.info('Evicted %s (%d bytes)', entry['file_path'], entry['bytes'])
+        if self.on_evict is not None:
+            self.on_evict(entry['file_path'])
+        return True
+
+    def sweep(self, now=None):
+        """Re-read every object from disk, then evict expired ones and the least recently used over budget."""
+        now = time.time() if now is None else now
+        self._refresh()
+        with self._lock:
+            by_age = sorted(self._objects, key=lambda key: self._objects[key]['last_access'])
+        evicted = []
+        for object_dir in by_age:
+            with self._lock:
+                entry = self._objects.get(object_dir)
+                total = sum(other['bytes'] for other in self._objects.values())
+            if entry is None:
+                continue
+            expired = self.ttl_seconds is not None and now - entry['last_access'] > self.ttl_seconds
+            over_budget = self.max_bytes is not None and total > self.max_bytes
+            if not (expired or over_budget):
+                break
+            if self.evict(object_dir):
+                evicted.append(entry['file_path'])
+        return evicted
+
+    def stats(self):
+        with self._lock:
+            return {
+                'objects': len(self._objects),
+                'bytes': sum(entry['bytes'] for entry in self._objects.values()),
+                'max_bytes': self.max_bytes or 0,
+                'evictions': self.evictions,
+            }
+
+    def _refresh(self):
+        # Pick up other processes' work: new objects, evictions, owners, uses and sizes
+        self._scan()
+        with self._lock:
+            object_dirs = list(self._objects)
+        for object_dir in object_dirs:
+            self._refresh_object(object_dir)
+        self._prune_sessions()
+
+    def _refresh_owned(self, owner):
+        # The same for `owner`'s objects alone, found from their session list; stale lines are dropped
+        session_path = self._session_path(owner)
+        listed = _read_lines(session_path)
+        with self._lock:
+            known = [object_dir for object_dir, entry in self._objects.items() if owner in entry['owners']]
+        held = set()
+        for object_dir in dict.fromkeys(known + [os.path.join(self.root, name) for name in sorted(listed)]):
+            entry = self._refresh_object(object_dir)
+            if entry is not None and owner in entry['owners']:
+                held.add(os.path.basename(object_dir))
+        if held != listed:
+            _write_lines(session_path, held)
+
+    def _refresh_object(self, object_dir):
+        # Re-read one object's owners, last use and size; None once it is gone
+        try:
+            last_use = os.stat(object_dir).st_mtime
+        except FileNotFoundError:
+            with self._lock:
+                entry = self._objects.pop(object_dir, None)
+            if entry is not None and self.on_evict is not None:
+                self.on_evict(entry['file_path'])
+            return None
+        with self._lock:
+            tracked = object_dir in self._objects
+        if not tracked and not self._adopt(object_dir, last_use):
+            return None
+        owners, size = _read_owners(object_dir), directory_bytes(object_dir)
+        with self._lock:
+            entry = self._objects.get(object_dir)
+            if entry is not None:
+                entry.update(bytes=size, owners=owners, last_access=max(entry['last_access'], last_use))
+        return entry
+
+    def _prune_sessions(self):
+        # Drop evicted objects from every session list, and lists left empty
+        sessions_dir = os.path.join(self.root, SESSIONS_DIR)
+        try:
+            names = os.listdir(sessions_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(sessions_dir, name)
+            listed = _read_lines(path)
+            held = {object_name for object_name in listed if os.path.isdir(os.path.join(self.root, object_name))}
+            if not held:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            elif held != listed:
+                _write_lines(path, held)
+
+    def _session_path(self, owner):
+        # Hashed, so any session id makes a safe file name
+        return os.path.join(self.root, SESSIONS_DIR, hashlib.sha256(owner.encode('utf-8')).hexdigest()[:32])
+
+    def _mark_used(self, object_dir, entry, force=False):
+        now = time.time()
+        with self._lock:
+            entry['last_access'] = now
+            if not force and now - entry['marked_at'] < ACCESS_WRITE_INTERVAL:
+                return
+            entry['marked_at'] = now
+        try:
+            os.utime(object_dir, (now, now))
+        except FileNotFoundError:
+            pass
+
+    def _scan(self):
+        # Adopt objects stored before this process started (or by another one);
+        # their last use is taken to be their last modification
+        try:
+            entries = [entry for entry in os.scandir(self.root) if entry.is_dir() and not entry.name.startswith('.')]
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            with self._lock:
+                if entry.path in self._objects:
+                    continue
+            self._adopt(entry.path, entry.stat().st_mtime)
+
+    def _adopt(self, object_dir, last_access):
+        # Track an object directory found on disk; False if it holds no workbook (yet)
+        try:
+            names = sorted(name for name in os.listdir(object_dir) if name.lower().endswith('.xlsx'))
+        except FileNotFoundError:
+            return False
+        if not names:
+            return False
+        with self._lock:
+            self._track(object_dir, os.path.join(object_dir, names[0]), last_access)
+        return True
+
+    def _track(self, object_dir, file_path, last_access=None):
+        entry = self._objects.get(object_dir)
+        if entry is None:
+            entry = self._objects[object_dir] = {'file_path': file_path, 'bytes': directory_bytes(object_dir),
+                                                 'last_access': last_access or time.time(), 'marked_at': 0,
+                                                 'owners': _read_owners(object_dir)}
+        elif last_access is None:
+            entry['last_access'] = time.time()
+        return entry
+
+    def _owned_lru(self, owner):
+        with self._lock:
+            owned = [(entry['last_access'], object_dir) for object_dir, entry in self._objects.items()
+                     if owner in entry['owners']]
+        return [object_dir for _, object_dir in sorted(owned)]
+
+    def _disown(self, object_dir, owner):
+        # Deleted once no session holds it any more; otherwise it just stops counting against `owner`
+        with self._lock:
+            entry = self._objects.get(object_dir)
+        if entry is None:
+            return
+        owners = _read_owners(object_dir) - {owner}
+        _write_lines(os.path.join(object_dir, OWNERS_FILE), owners)
+        session_path = self._session_path(owner)
+        _write_lines(session_path, _read_lines(session_path) - {os.path.basename(object_dir)})
+        with self._lock:
+            entry['owners'] = owners
+        if not owners:
+            self.evict(object_dir)
+
+
+class Sweeper:
+    """Daemon thread calling each of ``tasks`` every ``interval`` seconds.
+
+    A failing task is logged and retried on the next round; the others
+    still run.
+    """
+
+    def __init__(self, interval, tasks):
+        self.interval = interval
+        self.tasks = list(tasks)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='storage-sweeper', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        for task in self.tasks:
+            try:
+                task()
+            except Exception:
+                logger.exception('Storage sweep task %r failed', task)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
@@ -264,3 +264,602 @@ def test_show_results_no_file_in_session(client):
     assert response.status_code == 200 # Redirects to upload page
     assert b"Upload XLSX File" in response.data
     assert b"No active file found to display results for. Please upload a file first." in response.data
+
+def test_generate_chart_reuses_cached_dataset(client, sample_xlsx_path, monkeypatch):
+    """Test that charting after an upload doesn't parse the workbook again."""
+    with open(sample_xlsx_path, 'rb') as f:
+        upload_data = {'file': (BytesIO(f.read()), 'sample.xlsx')}
+        client.post('/', data=upload_data, content_type='multipart/form-data', follow_redirects=True)
+
+    def fail_read_excel(*args, **kwargs):
+        raise AssertionError('workbook was parsed again')
+    monkeypatch.setattr(pd, 'read_excel', fail_read_excel)
+
+    response = client.get('/results')
+    assert response.status_code == 200
+    response = client.post('/generate_chart', data={'chart_type': 'histogram', 'hist_column': 'Age'}, follow_redirects=True)
+    assert response.status_code == 200
+    assert b"Histogram of Age" in response.data
+
+def test_generate_chart_reads_from_columnar_store(client, sample_xlsx_path, monkeypatch):
+    """Test that once the upload is converted, charts read only their columns from the Arrow file, once each."""
+    pytest.importorskip('pyarrow')
+    import app as app_module
+    from columnar import columnar_path
+    from dataset_cache import file_digest
+
+    with open(sample_xlsx_path, 'rb') as f:
+        upload_data = {'file': (BytesIO(f.read()), 'sample.xlsx')}
+        client.post('/', data=upload_data, content_type='multipart/form-data', follow_redirects=True)
+    with client.session_transaction() as sess:
+        file_path = sess['uploaded_file_path']
+        sheet = sess['current_sheet']
+    store_path = columnar_path(file_path, file_digest(file_path), sheet)
+    assert app_module.columnar_converter.wait(store_path, timeout=10)
+
+    read_columns = []
+    real_read_columnar = app_module.read_columnar
+    def spy_read_columnar(path, columns=None):
+        read_columns.append(columns)
+        return real_read_columnar(path, columns)
+    monkeypatch.setattr(app_module, 'read_columnar', spy_read_columnar)
+    app_module.dataset_cache.clear()
+    app_module.chart_cache.clear()
+
+    response = client.post('/generate_chart', data={'chart_type': 'bar', 'bar_x_column': 'Category', 'bar_y_column': 'Score'}, follow_redirects=True)
+    assert response.status_code == 200
+    assert b"Bar Chart: Score by Category" in response.data
+    assert read_columns == [['Category'], ['Score']]
+
+    # Columns are cached one by one, so another chart reads only the column it adds
+    response = client.post('/generate_chart', data={'chart_type': 'bar', 'bar_x_column': 'Name', 'bar_y_column': 'Score'}, follow_redirects=True)
+    assert b"Bar Chart: Score by Name" in response.data
+    assert read_columns == [['Category'], ['Score'], ['Name']]
+
+def test_results_page_renders_from_schema_only(app, client, sample_xlsx_path, monkeypatch):
+    """Test that the upload and results pages don't parse the whole sheet."""
+    import app as app_module
+    def fail_parse(file_path, sheet=None):
+        raise AssertionError('full parse should be deferred until a chart needs it')
+    monkeypatch.setattr(app_module, 'parse_workbook', fail_parse)
+    monkeypatch.setitem(app.config, 'PREFETCH_ON_UPLOAD', False)
+    app_module.schema_cache.clear()
+
+    with open(sample_xlsx_path, 'rb') as f:
+        data = {'file': (BytesIO(f.read()), 'sample.xlsx')}
+        response = client.post('/', data=data, content_type='multipart/form-data', follow_redirects=True)
+    assert b"Data from: sample.xlsx" in response.data
+    assert b'<option value="Score">Score</option>' in response.data
+
+    response = client.get('/results')
+    assert response.status_code == 200
+    assert b'<option value="Category">Category</option>' in response.data
+
+def test_dataset_status(client, sample_xlsx_path):
+    """Test the background ingest status endpoint."""
+    response = client.get('/dataset_status')
+    assert response.status_code == 404
+
+    with open(sample_xlsx_path, 'rb') as f:
+        data = {'file': (BytesIO(f.read()), 'sample.xlsx')}
+        client.post('/', data=data, content_type='multipart/form-data', follow_redirects=True)
+    client.post('/generate_chart', data={'chart_type': 'histogram', 'hist_column': 'Age'})
+    response = client.get('/dataset_status')
+    assert response.status_code == 200
+    assert response.get_json()['ready'] is True
+
+def test_uploads_are_compacted(client):
+    """Test that parsed sheets are stored with compact dtypes and the saving is reported."""
+    pytest.importorskip('pyarrow')
+    import app as app_module
+    from openpyxl import Workbook
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(['Region', 'Units', 'Note'])
+    for i in range(2000):
+        sheet.append([['North', 'South', 'East'][i % 3], i % 50, f'compaction test {i}'])
+    content = BytesIO()
+    workbook.save(content)
+    client.post('/', data={'file': (BytesIO(content.getvalue()), 'compact.xlsx')}, content_type='multipart/form-data')
+
+    response = client.post('/generate_chart', data={'chart_type': 'bar', 'bar_x_column': 'Region', 'bar_y_column': 'Units'})
+    assert b"Bar Chart: Units by Region" in response.data
+    status = client.get('/dataset_status').get_json()
+    assert status['memory_saved_bytes'] > 0
+
+    # Categorical columns are still offered as bar chart X columns once the schema comes from the compact store
+    with client.session_transaction() as sess:
+        file_path, sheet_name = sess['uploaded_file_path'], sess['current_sheet']
+    assert app_module.columnar_converter.wait(app_module.columnar_path(file_path, app_module.file_digest(file_path), sheet_name), timeout=10)
+    app_module.schema_cache.clear()
+    response = client.get('/results')
+    bar_x_options = response.data.split(b'id="bar_x_column"')[1].split(b'</select>')[0]
+    assert b'<option value="Region">Region</option>' in bar_x_options
+    assert b'<option value="Units">Units</option>' not in bar_x_options
+
+def test_generate_chart_aggregation_options(client, sample_xlsx_path):
+    """Test the histogram bin count and bar aggregation form options."""
+    with open(sample_xlsx_path, 'rb') as f:
+        upload_data = {'file': (BytesIO(f.read()), 'sample.xlsx')}
+        client.post('/', data=upload_data, content_type='multipart/form-data', follow_redirects=True)
+
+    response = client.post('/generate_chart', data={'chart_type': 'histogram', 'hist_column': 'Score', 'hist_bins': '4'}, follow_redirects=True)
+    assert b"Histogram of Score" in response.data
+
+    response = client.post('/generate_chart', data={'chart_type': 'histogram', 'hist_column': 'Score', 'hist_bins': '0'}, follow_redirects=True)
+    assert b"Data from: sample.xlsx" in response.data
+    assert b"Number of bins must be between 1 and 1000." in response.data
+
+    response = client.post('/generate_chart', data={'chart_type': 'bar', 'bar_x_column': 'Category', 'bar_y_column': 'Score', 'bar_agg': 'mean'}, follow_redirects=True)
+    assert b"Bar Chart: Score by Category" in response.data
+    assert b"mean of Score" in response.data
+
+    response = client.post('/generate_chart', data={'chart_type': 'bar', 'bar_x_column': 'Category', 'bar_y_column': 'Score', 'bar_agg': 'mode'}, follow_redirects=True)
+    assert b"Data from: sample.xlsx" in response.data
+    assert b"Unsupported aggregation" in response.data
+
+def test_repeat_chart_served_from_cache_with_etag(client, sample_xlsx_path, monkeypatch):
+    """Test that a repeated chart request is served from the chart cache and honours If-None-Match."""
+    import app as app_module
+    with open(sample_xlsx_path, 'rb') as f:
+        upload_data = {'file': (BytesIO(f.read()), 'sample.xlsx')}
+        client.post('/', data=upload_data, content_type='multipart/form-data', follow_redirects=True)
+    app_module.chart_cache.clear()
+
+    chart_data = {'chart_type': 'histogram', 'hist_column': 'Score'}
+    first = client.post('/generate_chart', data=chart_data)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert etag
+
+    def fail_load(*args, **kwargs):
+        raise AssertionError('cached chart should not load the dataset')
+    monkeypatch.setattr(app_module, 'load_dataset', fail_load)
+
+    second = client.post('/generate_chart', data={**chart_data, 'hist_bins': str(app_module.app.config['HISTOGRAM_BINS'])})
+    assert second.status_code == 200
+    assert second.headers['ETag'] == etag
+    assert b"Histogram of Score" in second.data
+
+    not_modified = client.post('/generate_chart', data=chart_data, headers={'If-None-Match': etag})
+    assert not_modified.status_code == 304
+    assert not_modified.data == b''
+
+    # The results page asks with GET, which browsers revalidate with If-None-Match by themselves
+    assert b'action="/generate_chart" method="get"' in client.get('/results').data
+    page = client.get('/generate_chart', query_string=chart_data)
+    assert page.status_code == 200
+    assert page.headers['ETag'] == etag
+    assert page.headers['Cache-Control'] == 'private, no-cache'
+    not_modified = client.get('/generate_chart', query_string=chart_data, headers={'If-None-Match': etag})
+    assert not_modified.status_code == 304
+    # Queuing a job changes state, so it stays POST-only
+    assert client.get('/generate_chart', query_string={**chart_data, 'mode': 'async'}).headers['ETag'] == etag
+
+def test_generate_chart_async_job(client, sample_xlsx_path):
+    """Test queueing a chart with mode=async and collecting it through the job endpoints."""
+    import time
+    import app as app_module
+    with open(sample_xlsx_path, 'rb') as f:
+        upload_data = {'file': (BytesIO(f.read()), 'sample.xlsx')}
+        client.post('/', data=upload_data, content_type='multipart/form-data', follow_redirects=True)
+    app_module.chart_cache.clear()
+
+    response = client.post('/generate_chart', data={'chart_type': 'histogram', 'mode': 'async'})
+    assert response.status_code == 400
+    assert 'Please select a column' in response.get_json()['error']
+
+    response = client.post('/generate_chart', data={'chart_type': 'bar', 'bar_x_column': 'Category', 'bar_y_column': 'Age', 'mode': 'async'})
+    assert response.status_code == 202
+    job = response.get_json()
+    assert job['state'] in ('queued', 'running', 'done')
+
+    deadline = time.time() + 60
+    status = client.get(job['status_url']).get_json()
+    while status['state'] in ('queued', 'running') and time.time() < deadline:
+        time.sleep(0.2)
+        status = client.get(job['status_url']).get_json()
+    assert status['state'] == 'done'
+
+    events = client.get(job['events_url'])
+    assert events.mimetype == 'text/event-stream'
+    assert b'"state": "done"' in events.data
+
+    result = client.get(job['result_url'])
+    assert result.status_code == 200
+    assert b"Bar Chart: Age by Category" in result.data
+
+    assert client.get('/chart_jobs/unknown').status_code == 404
+
+def test_chunked_upload_deduplicates(client, sample_xlsx_path):
+    """Test the resumable upload endpoints and that identical uploads share one stored copy."""
+    with open(sample_xlsx_path, 'rb') as f:
+        content = f.read()
+    client.post('/', data={'file': (BytesIO(content), 'sample.xlsx')}, content_type='multipart/form-data')
+    with client.session_transaction() as sess:
+        form_path = sess['uploaded_file_path']
+
+    response = client.post('/uploads', data={'filename': 'report.txt'})
+    assert response.status_code == 400
+
+    started = client.post('/uploads', data={'filename': 'copy.xlsx', 'size': len(content)}).get_json()
+    half = len(content) // 2
+    response = client.put(started['upload_url'], data=content[:half], headers={'Upload-Offset': '0'})
+    assert response.get_json()['offset'] == half
+    response = client.put(started['upload_url'] + '?offset=0', data=content[half:])
+    assert response.status_code == 409
+    assert response.get_json()['offset'] == half
+    assert client.get(started['upload_url']).get_json()['offset'] == half
+    client.put(started['upload_url'] + f'?offset={half}', data=content[half:])
+
+    response = client.post(started['complete_url'])
+    assert response.status_code == 200
+    completed = response.get_json()
+    assert completed['deduplicated'] is True
+    assert completed['filename'] == 'copy.xlsx'
+    with client.session_transaction() as sess:
+        assert sess['uploaded_file_path'] == form_path
+        assert sess['current_filename'] == 'copy.xlsx'
+
+    response = client.get(completed['results_url'])
+    assert b"Data from: copy.xlsx" in response.data
+
+def test_chart_request_timing_and_metrics(client, sample_xlsx_path):
+    """Test the Server-Timing header on chart requests and the /metrics endpoint."""
+    import app as app_module
+    with open(sample_xlsx_path, 'rb') as f:
+        upload_data = {'file': (BytesIO(f.read()), 'sample.xlsx')}
+        response = client.post('/', data=upload_data, content_type='multipart/form-data')
+    assert 'schema;dur=' in response.headers['Server-Timing']
+    app_module.chart_cache.clear()
+
+    # Summed bars need the rows even once the statistics index is built
+    response = client.post('/generate_chart', data={'chart_type': 'bar', 'bar_x_column': 'Category', 'bar_y_column': 'Score'})
+    timing = response.headers['Server-Timing']
+    for stage_name in ('load', 'figure', 'to_html', 'render', 'total'):
+        assert f'{stage_name};dur=' in timing
+    assert 'chart_cache;desc="miss"' in timing
+    assert 'rows;desc="4"' in timing
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert b'xlab_stage_seconds_count{endpoint="generate_chart",stage="to_html"}' in response.data
+    assert b'xlab_dataset_cache_hits' in response.data
+    assert b'xlab_chart_cache_misses' in response.data
+
+def test_multi_sheet_workbook(client, tmp_path):
+    """Test choosing a sheet on the results page and charting it."""
+    from openpyxl import Workbook
+    workbook = Workbook()
+    workbook.active.title = 'Summary'
+    workbook.active.append(['Note'])
+    workbook.active.append(['see Sales'])
+    sales = workbook.create_sheet('Sales')
+    sales.append(['Region', 'Amount'])
+    for region, amount in [('North', 10), ('South', 20), ('North', 5)]:
+        sales.append([region, amount])
+    content = BytesIO()
+    workbook.save(content)
+
+    data = {'file': (BytesIO(content.getvalue()), 'multi.xlsx')}
+    response = client.post('/', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert b'<option value="Summary" selected>Summary (2 rows &times; 1 columns)</option>' in response.data
+    assert b'<option value="Sales">Sales (4 rows &times; 2 columns)</option>' in response.data
+    assert b'<li>Note</li>' in response.data
+    with client.session_transaction() as sess:
+        assert sess['current_sheet'] == 'Summary'
+
+    response = client.get('/results?sheet=Sales')
+    assert b'<li>Region</li>' in response.data and b'<li>Note</li>' not in response.data
+    assert b'<input type="hidden" name="sheet" value="Sales">' in response.data
+    response = client.post('/generate_chart', data={'chart_type': 'bar', 'bar_x_column': 'Region',
+                                                    'bar_y_column': 'Amount', 'sheet': 'Sales'})
+    assert response.status_code == 200
+    assert b"Bar Chart: Amount by Region" in response.data
+
+    response = client.get('/results?sheet=Missing', follow_redirects=True)
+    assert b'Sheet &#34;Missing&#34; not found in the file.' in response.data
+    assert b'<li>Note</li>' in response.data
+    response = client.post('/generate_chart', data={'chart_type': 'histogram', 'hist_column': 'Amount', 'sheet': 'Missing'},
+                           follow_redirects=True)
+    assert b'Sheet &#34;Missing&#34; not found in the file.' in response.data
+
+def test_line_chart_and_zoom(client):
+    """Test a downsampled line chart and the zoom endpoint's re-decimated slice."""
+    from openpyxl import Workbook
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(['step', 'reading'])
+    for i in range(3000):
+        sheet.append([i, (i % 97) * 1.5])
+    content = BytesIO()
+    workbook.save(content)
+    client.post('/', data={'file': (BytesIO(content.getvalue()), 'series.xlsx')}, content_type='multipart/form-data')
+
+    form = {'chart_type': 'line', 'series_x_column': 'step', 'series_y_column': 'reading',
+            'series_max_points': '200', 'series_downsample': 'minmax'}
+    response = client.post('/generate_chart', data=form)
+    assert response.status_code == 200
+    assert b"Line Chart: reading over step" in response.data
+    assert b" of 3000 points, downsampled with min/max" in response.data
+    assert b"/chart_zoom?" in response.data
+
+    response = client.get('/chart_zoom', query_string={'chart_type': 'line', 'series_x_column': 'step',
+                                                       'series_y_column': 'reading', 'series_max_points': '200',
+                                                       'series_downsample': 'minmax', 'x_start': '1000', 'x_end': '1099.5'})
+    assert response.status_code == 200
+    points = response.get_json()
+    assert points['total_points'] == 100 and points['points'] == 100
+    assert points['x'][0] == 1000 and points['x'][-1] == 1099
+
+    response = client.get('/chart_zoom', query_string={'chart_type': 'histogram', 'hist_column': 'reading'})
+    assert response.status_code == 400
+
+def test_chart_json_api(client, sample_xlsx_path):
+    """Test the JSON chart API: typed-array figure data, compression and revalidation."""
+    import gzip
+    import json
+    with open(sample_xlsx_path, 'rb') as f:
+        upload_data = {'file': (BytesIO(f.read()), 'sample.xlsx')}
+        client.post('/', data=upload_data, content_type='multipart/form-data')
+
+    response = client.get('/chart_json', query_string={'chart_type': 'histogram', 'hist_column': 'Age'},
+                          headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    payload = json.loads(gzip.decompress(response.data))
+    assert payload['figure']['layout']['title']['text'] == 'Histogram of Age'
+    assert set(payload['figure']['data'][0]['y']) == {'dtype', 'bdata'}
+
+    etag = response.headers['ETag']
+    response = client.get('/chart_json', query_string={'chart_type': 'histogram', 'hist_column': 'Age'},
+                          headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    response = client.post('/chart_json', data={'chart_type': 'bar', 'bar_x_column': 'Category', 'bar_y_column': 'Name'})
+    assert response.status_code == 422
+    assert 'is not numerical' in response.get_json()['error']
+    assert client.get('/chart_json', query_string={'chart_type': 'pie'}).status_code == 400
+
+def test_generate_chart_with_filters(client, sample_xlsx_path, monkeypatch):
+    """Test filtered charts, memoized filter conditions and filter errors."""
+    import app as app_module
+    from werkzeug.datastructures import MultiDict
+    with open(sample_xlsx_path, 'rb') as f:
+        upload_data = {'file': (BytesIO(f.read()), 'sample.xlsx')}
+        client.post('/', data=upload_data, content_type='multipart/form-data')
+    app_module.chart_cache.clear()
+    app_module.query_cache.clear()
+
+    def chart(chart_fields, *filters):
+        data = MultiDict(chart_fields)
+        for column, op, value in filters:
+            data.add('filter_column', column)
+            data.add('filter_op', op)
+            data.add('filter_value', value)
+        return client.post('/chart_json', data=data)
+
+    response = chart({'chart_type': 'bar', 'bar_x_column': 'Category', 'bar_y_column': 'Score', 'bar_agg': 'count'},
+                     ('Age', '>', '24'))
+    figure = response.get_json()['figure']
+    assert response.status_code == 200
+    assert figure['data'][0]['x'] == ['A', 'B']
+    assert 'query_cache;desc="miss"' in response.headers['Server-Timing']
+
+    # The Age condition is reused by a different chart with an extra condition
+    response = chart({'chart_type': 'histogram', 'hist_column': 'Score'}, ('Category', '==', 'B'), ('Age', '>', '24'))
+    assert response.status_code == 200
+    assert app_module.query_cache.stats()['hits'] >= 1
+    assert app_module.query_cache.stats()['entries'] == 2
+
+    response = chart({'chart_type': 'histogram', 'hist_column': 'Score'}, ('Age', '>', '99'))
+    assert response.status_code == 422
+    assert response.get_json()['error'] == 'Filter error: No rows match the selected filters.'
+    response = client.post('/generate_chart', data=MultiDict([('chart_type', 'histogram'), ('hist_column', 'Score'),
+                                                              ('filter_column', 'Name'), ('filter_op', '>'), ('filter_value', 'B')]),
+                           follow_redirects=True)
+    assert b'needs a numerical or date column' in response.data
+
+def test_column_statistics_index(client, sample_xlsx_path, monkeypatch):
+    """Test that the statistics index summarizes columns and answers histograms without loading rows."""
+    pytest.importorskip('pyarrow')
+    import app as app_module
+    from column_stats import stats_path
+    from columnar import columnar_path
+    from dataset_cache import file_digest
+
+    with open(sample_xlsx_path, 'rb') as f:
+        upload_data = {'file': (BytesIO(f.read()), 'sample.xlsx')}
+        client.post('/', data=upload_data, content_type='multipart/form-data')
+    with client.session_transaction() as sess:
+        file_path = sess['uploaded_file_path']
+        sheet = sess['current_sheet']
+    digest = file_digest(file_path)
+    assert app_module.columnar_converter.wait(columnar_path(file_path, digest, sheet), timeout=10)
+    assert app_module.stats_indexer.wait(stats_path(file_path, digest, sheet), timeout=10)
+
+    response = client.get('/results')
+    assert b'Column summary' in response.data
+    assert b'<td>Age</td>' in response.data
+
+    def fail_load(*args, **kwargs):
+        raise AssertionError('rows were loaded for a chart the index answers')
+    monkeypatch.setattr(app_module, 'load_dataset', fail_load)
+    app_module.chart_cache.clear()
+    response = client.post('/generate_chart', data={'chart_type': 'histogram', 'hist_column': 'Age'}, follow_redirects=True)
+    assert b'Histogram of Age' in response.data
+    response = client.post('/chart_json', data={'chart_type': 'bar', 'bar_x_column': 'Category', 'bar_y_column': 'Score', 'bar_agg': 'count'})
+    assert response.get_json()['figure']['data'][0]['x'] == ['A', 'B']
+    assert 'stats_index;desc="hit"' in response.headers['Server-Timing']
+    response = client.post('/generate_chart', data={'chart_type': 'histogram', 'hist_column': 'Name'}, follow_redirects=True)
+    assert b'is not numerical' in response.data
+
+def test_bar_chart_with_the_same_column_on_both_axes(app, client, sample_xlsx_path, monkeypatch):
+    """Test that a bar chart aggregating its own X column renders."""
+    import app as app_module
+    monkeypatch.setitem(app.config, 'STATS_INDEX', False)
+    with open(sample_xlsx_path, 'rb') as f:
+        upload_data = {'file': (BytesIO(f.read()), 'sample.xlsx')}
+        client.post('/', data=upload_data, content_type='multipart/form-data')
+    app_module.chart_cache.clear()
+
+    response = client.post('/generate_chart', data={'chart_type': 'bar', 'bar_x_column': 'Age', 'bar_y_column': 'Age'},
+                           follow_redirects=True)
+    assert response.status_code == 200
+    assert b'Bar Chart: Age by Age' in response.data
+    assert b'An unexpected error occurred' not in response.data
+
+@pytest.mark.parametrize('indexed', [True, False])
+def test_count_bar_chart_by_its_own_column(app, client, sample_xlsx_path, monkeypatch, indexed):
+    """Test that counting a text column by itself gives the same chart with or without the statistics index."""
+    pytest.importorskip('pyarrow')
+    import base64
+    import numpy as np
+    import app as app_module
+    from column_stats import stats_path
+    from columnar import columnar_path
+    from dataset_cache import file_digest
+    with open(sample_xlsx_path, 'rb') as f:
+        upload_data = {'file': (BytesIO(f.read()), 'sample.xlsx')}
+        client.post('/', data=upload_data, content_type='multipart/form-data')
+    with client.session_transaction() as sess:
+        file_path = sess['uploaded_file_path']
+        sheet = sess['current_sheet']
+    digest = file_digest(file_path)
+    path = stats_path(file_path, digest, sheet)
+    assert app_module.columnar_converter.wait(columnar_path(file_path, digest, sheet), timeout=10)
+    assert app_module.stats_indexer.wait(path, timeout=10)
+    if not indexed:
+        monkeypatch.setitem(app.config, 'STATS_INDEX', False)
+        os.remove(path)
+    app_module.chart_cache.clear()
+
+    response = client.post('/chart_json', data={'chart_type': 'bar', 'bar_x_column': 'Category', 'bar_y_column': 'Category',
+                                                'bar_agg': 'count'})
+    assert response.status_code == 200
+    assert ('stats_index;desc="hit"' in response.headers['Server-Timing']) == indexed
+    trace = response.get_json()['figure']['data'][0]
+    expected = pd.read_excel(sample_xlsx_path)['Category'].value_counts().sort_index()
+    assert trace['x'] == expected.index.tolist()
+    counts = trace['y']
+    if isinstance(counts, dict):
+        counts = np.frombuffer(base64.b64decode(counts['bdata']), dtype=counts['dtype']).tolist()
+    assert counts == expected.tolist()
+
+@pytest.mark.parametrize('parallel_min', [50, 1])
+def test_generate_charts_batch(app, client, sample_xlsx_path, monkeypatch, parallel_min):
+    """Test rendering several charts on one page, in the request thread and in the job processes."""
+    import json
+    import app as app_module
+    monkeypatch.setitem(app.config, 'CHART_BATCH_PARALLEL_MIN', parallel_min)
+    monkeypatch.setitem(app.config, 'STATS_INDEX', False)
+    with open(sample_xlsx_path, 'rb') as f:
+        upload_data = {'file': (BytesIO(f.read()), 'sample.xlsx')}
+        response = client.post('/', data=upload_data, content_type='multipart/form-data')
+    assert b'Histograms of All Numerical Columns' in response.data
+    app_module.chart_cache.clear()
+
+    charts = [{'chart_type': 'histogram', 'hist_column': 'Age'},
+              {'chart_type': 'histogram', 'hist_column': 'Score', 'filter_column': ['Category'], 'filter_op': ['=='], 'filter_value': ['B']},
+              {'chart_type': 'bar', 'bar_x_column': 'Category', 'bar_y_column': 'Score'},
+              {'chart_type': 'histogram', 'hist_column': 'Name'},
+              {'chart_type': 'pie'}]
+    response = client.post('/generate_charts', data={'charts': json.dumps(charts)})
+    assert response.status_code == 200
+    page = response.data.decode()
+    assert page.count('cdn.plot.ly/plotly-') == 1
+    for title in ('Histogram of Age', 'Histogram of Score', 'Bar Chart: Score by Category'):
+        assert title in page
+    assert 'is not numerical' in page
+    assert 'Invalid chart type selected: &#34;pie&#34;' in page
+
+    # Rendered fragments are cached for the next batch
+    response = client.post('/generate_charts', json={'charts': charts[:3]})
+    timing = response.headers['Server-Timing']
+    assert 'chart_cache_hits;desc="3"' in timing and 'chart_cache_misses;desc="0"' in timing
+
+    response = client.post('/generate_charts', json={'charts': []}, follow_redirects=True)
+    assert b'Please send a non-empty list of charts' in response.data
+
+def test_generate_charts_batch_withdraws_shares_when_the_queue_fills(app, client, sample_xlsx_path, monkeypatch):
+    """Test that a batch rendered in-process because the job queue is full leaves no shares running."""
+    import json
+    pytest.importorskip('pyarrow')
+    import app as app_module
+    from jobs import JobQueue
+    queue = JobQueue(max_workers=2, max_pending=1, timeout=30, start_method='spawn')
+    monkeypatch.setattr(app_module, 'chart_jobs', queue)
+    monkeypatch.setitem(app.config, 'CHART_JOB_WORKERS', 2)
+    monkeypatch.setitem(app.config, 'CHART_BATCH_PARALLEL_MIN', 1)
+    monkeypatch.setitem(app.config, 'STATS_INDEX', False)
+    with open(sample_xlsx_path, 'rb') as f:
+        upload_data = {'file': (BytesIO(f.read()), 'sample.xlsx')}
+        client.post('/', data=upload_data, content_type='multipart/form-data')
+    app_module.chart_cache.clear()
+    try:
+        charts = [{'chart_type': 'histogram', 'hist_column': 'Age'}, {'chart_type': 'histogram', 'hist_column': 'Score'}]
+        response = client.post('/generate_charts', data={'charts': json.dumps(charts)})
+        assert response.status_code == 200
+        assert 'Histogram of Age' in response.data.decode() and 'Histogram of Score' in response.data.decode()
+        stats = queue.stats()
+        assert stats['cancelled'] == 1 and stats['queued'] == stats['running'] == 0
+    finally:
+        queue.shutdown()
+
+def test_oversized_uploads_are_refused(app, client, monkeypatch):
+    """Test that requests over MAX_CONTENT_LENGTH are rejected before the body is stored."""
+    monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 1024 * 1024)
+    data = {'file': (BytesIO(b'x' * 2 * 1024 * 1024), 'big.xlsx')}
+    response = client.post('/', data=data, content_type='multipart/form-data', follow_redirects=True)
+    assert b'larger than the upload limit of 1 MB' in response.data
+    with client.session_transaction() as sess:
+        assert 'uploaded_file_path' not in sess
+
+    response = client.put('/uploads/abc', data=b'x' * 2 * 1024 * 1024)
+    assert response.status_code == 413
+
+def test_shared_cache_between_workers(client, sample_xlsx_path, monkeypatch):
+    """Test that a sheet another worker is converting is waited for, and charts come from the shared tier."""
+    pytest.importorskip('pyarrow')
+    import threading
+    import app as app_module
+    from columnar import write_columnar
+    from dataset_cache import file_digest
+    from ingest import read_excel_streaming
+    from shared_cache import MemoryIndex, SharedCache
+
+    index = MemoryIndex()
+    monkeypatch.setattr(app_module, 'shared_cache', SharedCache(index, owner='this-worker'))
+    monkeypatch.setattr(app_module.chart_cache, 'shared', app_module.shared_cache)
+    other_worker = SharedCache(index, owner='other-worker')
+    def fail_parse(file_path, sheet=None):
+        raise AssertionError('sheet parsed although another worker was converting it')
+    monkeypatch.setattr(app_module, 'parse_workbook', fail_parse)
+
+    with open(sample_xlsx_path, 'rb') as f:
+        upload_data = {'file': (BytesIO(f.read()), 'sample.xlsx')}
+        client.post('/', data=upload_data, content_type='multipart/form-data')
+    with client.session_transaction() as sess:
+        file_path, sheet = sess['uploaded_file_path'], sess['current_sheet']
+    store_path = app_module.columnar_path(file_path, file_digest(file_path), sheet)
+    app_module.columnar_converter.wait(store_path, timeout=10)
+    if os.path.exists(store_path):
+        os.remove(store_path)
+    app_module.dataset_cache.clear()
+    app_module.chart_cache.clear()
+
+    assert other_worker.claim(store_path)
+    def convert_elsewhere():
+        write_columnar(read_excel_streaming(file_path, sheet_name=sheet), store_path)
+        other_worker.release(store_path)
+    threading.Timer(0.3, convert_elsewhere).start()
+    response = client.post('/generate_chart', data={'chart_type': 'bar', 'bar_x_column': 'Category', 'bar_y_column': 'Score'})
+    assert b'Bar Chart: Score by Category' in response.data
+    assert 'wait_shared;dur=' in response.headers['Server-Timing']
+
+    # A fresh worker process has an empty chart cache, but the shared tier has the chart
+    app_module.chart_cache.clear()
+    response = client.post('/generate_chart', data={'chart_type': 'bar', 'bar_x_column': 'Category', 'bar_y_column': 'Score'})
+    assert 'chart_cache;desc="hit"' in response.headers['Server-Timing']
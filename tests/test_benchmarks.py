@@ -0,0 +1,28 @@
+import pandas as pd
+from benchmarks.bench_app import compare, generate_workbook, run_stages, run_startup_subprocess
+
+def test_generated_workbook_has_mixed_columns(tmp_path):
+    path = generate_workbook(str(tmp_path / 'bench.xlsx'), 50)
+    df = pd.read_excel(path)
+    assert len(df) == 50
+    assert pd.api.types.is_numeric_dtype(df['value'])
+    assert pd.api.types.is_datetime64_any_dtype(df['created'])
+    assert not pd.api.types.is_numeric_dtype(df['category'])
+
+def test_run_stages_records_every_stage(tmp_path):
+    path = generate_workbook(str(tmp_path / 'bench.xlsx'), 100)
+    results = run_stages(path, 100, str(tmp_path / 'uploads'))
+    assert [r['stage'] for r in results] == ['upload', 'results', 'histogram', 'histogram_repeat', 'bar', 'bar_repeat', 'line']
+    assert all(r['status'] == 200 and r['response_bytes'] > 0 for r in results)
+
+def test_compare_flags_slowdowns():
+    baseline = {'results': [{'rows': 10, 'stage': 'upload', 'wall_s': 1.0}, {'rows': 10, 'stage': 'bar', 'wall_s': 1.0}]}
+    current = {'results': [{'rows': 10, 'stage': 'upload', 'wall_s': 1.1}, {'rows': 10, 'stage': 'bar', 'wall_s': 2.0}]}
+    assert [r['stage'] for r in compare(baseline, current, threshold=0.2)] == ['bar']
+
+def test_startup_defers_heavy_imports():
+    results = {r['stage']: r for r in run_startup_subprocess()}
+    assert list(results) == ['import', 'first_request', 'prewarm']
+    assert results['first_request']['status'] == 200
+    assert results['first_request']['heavy_modules'] == []
+    assert results['prewarm']['heavy_modules'] == ['numpy', 'pandas', 'plotly.express']
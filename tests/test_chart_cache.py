@@ -0,0 +1,43 @@
+import os
+from werkzeug.datastructures import MultiDict
+from chart_cache import ChartCache, chart_key
+from charts import chart_spec
+
+def entry(size):
+    return {'chart_html': 'x' * size, 'messages': []}
+
+def test_chart_spec_normalizes_defaults():
+    explicit = chart_spec(MultiDict({'chart_type': 'histogram', 'hist_column': 'Age', 'hist_bins': '50', 'bar_x_column': 'Name'}), 50)
+    implicit = chart_spec(MultiDict({'chart_type': 'histogram', 'hist_column': 'Age'}), 50)
+    assert explicit == implicit
+    assert chart_key('digest', explicit) == chart_key('digest', implicit)
+    assert chart_key('other-digest', explicit) != chart_key('digest', explicit)
+
+def test_lru_by_html_bytes():
+    cache = ChartCache(max_bytes=10, ttl_seconds=60)
+    cache.put('a', entry(5))
+    cache.put('b', entry(5))
+    cache.get('a')
+    cache.put('c', entry(5))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.stats()['evictions'] == 1
+
+def test_entries_expire_after_ttl():
+    cache = ChartCache(max_bytes=100, ttl_seconds=-1)
+    cache.put('a', entry(1))
+    assert cache.get('a') is None
+
+def test_disk_entries_survive_a_new_cache(tmp_path):
+    ChartCache(max_bytes=100, ttl_seconds=60, disk_dir=str(tmp_path)).put('a', entry(3))
+    assert os.path.exists(tmp_path / 'a.json')
+    fresh = ChartCache(max_bytes=100, ttl_seconds=60, disk_dir=str(tmp_path))
+    assert fresh.get('a') == entry(3)
+
+def test_sweep_removes_expired_entries(tmp_path):
+    cache = ChartCache(max_bytes=100, ttl_seconds=60, disk_dir=str(tmp_path))
+    cache.put('a', entry(1))
+    assert cache.sweep() == 0
+    assert cache.sweep(now=os.path.getmtime(tmp_path / 'a.json') + 61) == 1
+    assert cache.stats()['entries'] == 0
+    assert not os.listdir(tmp_path)
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+import pytest
+from werkzeug.datastructures import MultiDict
+from charts import (ChartError, bar_data, bar_figure, build_chart, chart_spec, histogram_data, histogram_figure,
+                    series_points, spec_columns, validate_spec)
+
+def test_histogram_data_counts_every_value():
+    series = pd.Series(np.random.default_rng(0).normal(size=10000))
+    data = histogram_data(series, bins=20)
+    assert len(data) == 20
+    assert data['count'].sum() == 10000
+
+def test_histogram_data_ignores_missing_values():
+    data = histogram_data(pd.Series([1.0, np.nan, 2.0, 3.0]), bins=3)
+    assert data['count'].sum() == 3
+
+def test_small_integer_range_gets_one_bin_per_value():
+    data = histogram_data(pd.Series([25, 30, 22, 25]), bins=50)
+    assert data['bin_start'].tolist()[0] == 21.5
+    assert len(data) == 9
+    assert data.loc[data['bin_start'] == 24.5, 'count'].item() == 2
+
+def test_histogram_figure_size_does_not_grow_with_rows():
+    small = histogram_figure(pd.Series(np.arange(1000, dtype=float)), 'x', bins=10).to_json()
+    large = histogram_figure(pd.Series(np.arange(1000000, dtype=float)), 'x', bins=10).to_json()
+    assert len(large) < 2 * len(small)
+
+def test_bar_data_sum_and_mean():
+    df = pd.DataFrame({'Category': ['A', 'B', 'A', 'B'], 'Score': [85, 90, 82, 88]})
+    assert bar_data(df, 'Category', 'Score')['Score'].tolist() == [167, 178]
+    assert bar_data(df, 'Category', 'Score', agg='mean')['Score'].tolist() == [83.5, 89.0]
+    assert bar_data(df, 'Category', 'Category', agg='count')['count(Category)'].tolist() == [2, 2]
+    with pytest.raises(ValueError):
+        bar_data(df, 'Category', 'Score', agg='mode')
+
+def test_bar_figure_has_one_bar_per_category():
+    df = pd.DataFrame({'Category': ['A', 'B'] * 5000, 'Score': range(10000)})
+    fig = bar_figure(df, 'Category', 'Score')
+    assert len(fig.data[0].x) == 2
+    assert fig.layout.title.text == 'Bar Chart: Score by Category'
+
+def test_validate_spec_rejects_incomplete_forms():
+    for form in ({'chart_type': 'histogram'}, {'chart_type': 'bar', 'bar_x_column': 'Category'},
+                 {'chart_type': 'pie'}, {'chart_type': 'histogram', 'hist_column': 'Age', 'hist_bins': '0'}):
+        with pytest.raises(ChartError):
+            validate_spec(chart_spec(MultiDict(form)))
+
+def test_build_chart_checks_columns_against_data():
+    df = pd.DataFrame({'Category': ['A', 'B'], 'Score': [1, 2], 'Age': [30, 40]})
+    spec = chart_spec(MultiDict({'chart_type': 'bar', 'bar_x_column': 'Score', 'bar_y_column': 'Category'}))
+    assert spec_columns(spec) == ['Score', 'Category']
+    with pytest.raises(ChartError, match='is not numerical'):
+        build_chart(df, spec)
+
+    spec = chart_spec(MultiDict({'chart_type': 'bar', 'bar_x_column': 'Age', 'bar_y_column': 'Score'}))
+    fig, notes = build_chart(df, spec)
+    assert fig.layout.title.text == 'Bar Chart: Score by Age'
+    assert notes[0][1] == 'info'
+
+def line_spec(**overrides):
+    spec = {'chart_type': 'line', 'x_column': 'time', 'y_column': 'value', 'max_points': 500,
+            'downsample': 'lttb', 'x_range': None}
+    spec.update(overrides)
+    return spec
+
+def test_series_spec_from_form():
+    spec = chart_spec(MultiDict({'chart_type': 'scatter', 'series_x_column': 'time', 'series_y_column': 'value',
+                                 'x_start': '10'}), default_points=2000)
+    assert spec == {'chart_type': 'scatter', 'x_column': 'time', 'y_column': 'value', 'max_points': 2000,
+                    'downsample': 'lttb', 'x_range': ['10', None]}
+    assert spec_columns(spec) == ['time', 'value']
+    with pytest.raises(ChartError, match='Number of points'):
+        validate_spec(line_spec(max_points=5))
+    with pytest.raises(ChartError, match='Unsupported downsampling'):
+        validate_spec(line_spec(downsample='random'))
+
+def test_line_chart_is_capped_at_max_points():
+    df = pd.DataFrame({'time': pd.date_range('2024-01-01', periods=200000, freq='s'),
+                       'value': np.random.default_rng(0).normal(size=200000)})
+    fig, notes = build_chart(df, line_spec())
+    assert len(fig.data[0].y) == 500
+    assert fig.layout.title.text == 'Line Chart: value over time'
+    assert notes[0][0].startswith('Chart information: Showing 500 of 200000 points')
+
+def test_series_points_sorts_and_slices_the_zoom_range():
+    df = pd.DataFrame({'time': [5.0, 1.0, 3.0, np.nan, 2.0, 4.0], 'value': [50, 10, 30, 99, np.nan, 40]})
+    points = series_points(df, line_spec(x_range=['2', '4.5']))
+    assert points == {'x': [3.0, 4.0], 'y': [30.0, 40.0], 'points': 2, 'total_points': 2}
+    with pytest.raises(ChartError, match='Invalid zoom range'):
+        series_points(df, line_spec(x_range=['soon', None]))
+
+def test_series_chart_rejects_text_axes():
+    df = pd.DataFrame({'time': ['a', 'b'], 'value': [1, 2]})
+    with pytest.raises(ChartError, match='must be numerical or a date/time column'):
+        build_chart(df, line_spec())
+
+def test_bar_data_top_n_and_color_groups():
+    df = pd.DataFrame({'Team': ['A', 'B', 'C', 'A', 'B', 'C', 'C'], 'Year': [1, 1, 1, 2, 2, 2, 2],
+                       'Points': [5, 1, 3, 4, 9, 1, 1]})
+    top = bar_data(df, 'Team', 'Points', top_n=2)
+    assert top['Team'].tolist() == ['B', 'A'] and top['Points'].tolist() == [10, 9]
+    assert bar_data(df, 'Team', 'Points', agg='count')['Points'].tolist() == [2, 2, 3]
+    stacked = bar_data(df, 'Team', 'Points', color_column='Year', top_n=2)
+    assert stacked[['Team', 'Year']].values.tolist() == [['B', 1], ['B', 2], ['A', 1], ['A', 2]]
+
+def test_filters_are_part_of_the_spec():
+    form = MultiDict([('chart_type', 'bar'), ('bar_x_column', 'Category'), ('bar_y_column', 'Score'),
+                      ('bar_color_column', 'Region'), ('filter_column', 'Age'), ('filter_op', '>'), ('filter_value', '25')])
+    spec = chart_spec(form)
+    assert spec['filters'] == [['Age', '>', '25']]
+    assert spec_columns(spec) == ['Category', 'Score', 'Region']
+    assert 'filters' not in chart_spec(MultiDict({'chart_type': 'bar'}))
+    spec['filters'] = [['Age', 'between', '1']]
+    with pytest.raises(ChartError, match='Unsupported operator'):
+        validate_spec(spec)
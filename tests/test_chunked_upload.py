@@ -0,0 +1,75 @@
+import hashlib
+import os
+from io import BytesIO
+import pytest
+from chunked_upload import OffsetMismatch, UnknownUpload, UploadError, UploadStore
+
+@pytest.fixture
+def store(tmp_path):
+    return UploadStore(str(tmp_path))
+
+def test_identical_content_is_stored_once(store):
+    first, digest, deduplicated = store.save_stream(BytesIO(b'workbook bytes'), 'a.xlsx')
+    assert not deduplicated
+    assert digest == hashlib.sha256(b'workbook bytes').hexdigest()
+    again, _, deduplicated = store.save_stream(BytesIO(b'workbook bytes'), 'b.xlsx')
+    assert deduplicated
+    assert again == first
+    other, _, _ = store.save_stream(BytesIO(b'different bytes'), 'a.xlsx')
+    assert other != first
+
+def test_chunked_upload_resumes_and_hashes(store):
+    upload_id = store.start('data.xlsx', total_size=10)
+    assert store.append(upload_id, 0, BytesIO(b'01234')) == 5
+    with pytest.raises(OffsetMismatch) as excinfo:
+        store.append(upload_id, 0, BytesIO(b'01234'))
+    assert excinfo.value.expected == 5
+    assert store.info(upload_id)['offset'] == 5
+    with pytest.raises(UploadError):
+        store.complete(upload_id)
+    store.append(upload_id, 5, BytesIO(b'56789'))
+    path, digest, deduplicated = store.complete(upload_id)
+    assert digest == hashlib.sha256(b'0123456789').hexdigest()
+    assert path.endswith(os.path.join(digest, 'data.xlsx'))
+    with pytest.raises(UnknownUpload):
+        store.info(upload_id)
+
+def test_resume_after_restart_rehashes_from_disk(store, tmp_path):
+    upload_id = store.start('data.xlsx')
+    store.append(upload_id, 0, BytesIO(b'first half '))
+    restarted = UploadStore(str(tmp_path))
+    restarted.append(upload_id, 11, BytesIO(b'second half'))
+    _, digest, _ = restarted.complete(upload_id)
+    assert digest == hashlib.sha256(b'first half second half').hexdigest()
+
+def test_abort_and_unknown_ids(store):
+    upload_id = store.start('data.xlsx')
+    store.abort(upload_id)
+    with pytest.raises(UnknownUpload):
+        store.append(upload_id, 0, BytesIO(b'x'))
+    with pytest.raises(UnknownUpload):
+        store.info('../../etc')
+
+def test_size_limit_stops_uploads_early(tmp_path):
+    from chunked_upload import UploadTooLarge
+    store = UploadStore(str(tmp_path), max_size=8)
+    with pytest.raises(UploadTooLarge):
+        store.save_stream(BytesIO(b'0123456789'), 'big.xlsx')
+    with pytest.raises(UploadTooLarge):
+        store.start('big.xlsx', total_size=10)
+    upload_id = store.start('data.xlsx')
+    store.append(upload_id, 0, BytesIO(b'01234'))
+    with pytest.raises(UploadTooLarge):
+        store.append(upload_id, 5, BytesIO(b'56789'))
+    assert store.info(upload_id)['offset'] == 5
+    store.append(upload_id, 5, BytesIO(b'567'))
+    path, digest, _ = store.complete(upload_id)
+    assert digest == hashlib.sha256(b'01234567').hexdigest()
+
+def test_stale_partial_uploads_are_removed(store):
+    import time
+    stale = store.start('old.xlsx')
+    assert store.remove_stale(60) == []
+    assert store.remove_stale(60, now=time.time() + 120) == [stale]
+    with pytest.raises(UnknownUpload):
+        store.info(stale)
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from charts import ChartError, bar_data, build_stats_chart, histogram_data, histogram_stats_data
+from column_stats import StatsIndexer, build_stats_index, column_statistics, read_stats_index, stats_path
+from columnar import write_columnar
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'Region': pd.Series(rng.choice(['North', 'South', 'East', 'West'], size=5000), dtype='category'),
+        'Units': rng.integers(0, 200, size=5000),
+        'Revenue': rng.normal(1000, 250, size=5000),
+        'Date': pd.date_range('2024-01-01', periods=5000, freq='h'),
+        # Decimals on a grid, many of them exactly on a coarse bin edge
+        'Score': np.round(rng.integers(0, 11, size=5000) / 10, 1),
+    })
+
+def test_numeric_statistics():
+    stats = column_statistics(pd.Series([3.0, 1.0, np.nan, 2.0]))
+    assert stats['count'] == 3 and stats['nulls'] == 1 and stats['distinct'] == 3
+    assert (stats['min'], stats['max'], stats['mean']) == (1.0, 3.0, 2.0)
+    assert stats['quantiles'][50] == 2.0
+    assert sum(stats['fine_histogram']) == 3
+
+def test_text_statistics_keep_top_and_all_values():
+    stats = column_statistics(pd.Series(['b', 'a', 'b', None], dtype='category').cat.add_categories(['unused']))
+    assert stats['kind'] == 'text'
+    assert stats['distinct'] == 2
+    assert stats['top_values'] == [['b', 2], ['a', 1]]
+    assert stats['values'] == [['a', 1], ['b', 2]]
+
+def test_index_round_trip(tmp_path, frame):
+    store = write_columnar(frame, str(tmp_path / 'data.arrow'))
+    index = build_stats_index(store)
+    assert list(index) == ['Region', 'Units', 'Revenue', 'Date', 'Score']
+    assert index['Date']['min'] == '2024-01-01T00:00:00'
+
+    indexer = StatsIndexer()
+    dest = stats_path(str(tmp_path / 'data.xlsx'), 'abcdef0123456789ffff', 'Sheet1')
+    assert dest.endswith('.stats.json')
+    assert read_stats_index(dest) is None
+    indexer.submit(store, dest).result()
+    assert indexer.wait(dest)
+    assert indexer.submit(store, dest) is None
+    assert read_stats_index(dest) == index
+
+def test_failed_builds_are_not_retried(tmp_path, monkeypatch):
+    import column_stats
+    store = write_columnar(pd.DataFrame({'Ratio': [1.0, np.inf, 2.0]}), str(tmp_path / 'data.arrow'))
+    dest = stats_path(str(tmp_path / 'data.xlsx'), 'abcdef0123456789ffff')
+    builds = []
+    def build(path):
+        builds.append(path)
+        return build_stats_index(path)
+    monkeypatch.setattr(column_stats, 'build_stats_index', build)
+    indexer = StatsIndexer()
+    with pytest.raises(ValueError):
+        indexer.submit(store, dest).result()
+    assert indexer.submit(store, dest) is None
+    assert not indexer.wait(dest)
+    assert builds == [store]
+
+@pytest.mark.parametrize('column,bins', [('Units', 50), ('Units', 1000), ('Revenue', 20), ('Revenue', 100),
+                                         ('Score', 10), ('Score', 20), ('Score', 50)])
+def test_histograms_rebinned_from_index_match_the_rows(frame, column, bins):
+    expected = histogram_data(frame[column], bins)
+    data = histogram_stats_data(column_statistics(frame[column]), bins)
+    if data is None:  # Edges that don't line up with the fine histogram's; charted from the rows instead
+        assert column != 'Units'
+        return
+    np.testing.assert_allclose(data['bin_start'], expected['bin_start'])
+    assert data['count'].tolist() == expected['count'].tolist()
+
+def test_uneven_rebinning_falls_back_to_rows(frame):
+    assert histogram_stats_data(column_statistics(frame['Revenue']), 30) is None
+
+def test_stats_chart(tmp_path, frame):
+    index = build_stats_index(write_columnar(frame, str(tmp_path / 'data.arrow')))
+    fig, _ = build_stats_chart(index, {'chart_type': 'bar', 'x_column': 'Region', 'y_column': 'Units', 'agg': 'count', 'top_n': 2})
+    expected = bar_data(frame, 'Region', 'Units', 'count', top_n=2)
+    assert list(fig.data[0].x) == expected['Region'].tolist()
+    assert list(fig.data[0].y) == expected['Units'].tolist()
+
+    with pytest.raises(ChartError, match='is not numerical'):
+        build_stats_chart(index, {'chart_type': 'histogram', 'column': 'Region', 'bins': 10})
+    assert build_stats_chart(index, {'chart_type': 'bar', 'x_column': 'Region', 'y_column': 'Units', 'agg': 'sum'}) is None
+    assert build_stats_chart(index, {'chart_type': 'histogram', 'column': 'Units', 'bins': 10,
+                                     'filters': [['Region', '==', 'North']]}) is None
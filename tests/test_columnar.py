@@ -0,0 +1,81 @@
+import os
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from columnar import (ColumnarConverter, arrow_compatible, columnar_column_names, columnar_path, read_columnar,
+                      write_columnar, write_columnar_batches)
+from ingest import column_compactor, compact_frame
+
+@pytest.fixture
+def frame():
+    return pd.DataFrame({
+        'Name': ['Alice', 'Bob', 'Charlie', 'David'],
+        'Age': [25, 30, 22, 25],
+        'Score': [85, 90, 82, 88],
+        'Category': ['A', 'B', 'A', 'B'],
+    })
+
+def test_round_trip(tmp_path, frame):
+    path = write_columnar(frame, str(tmp_path / 'data.arrow'))
+    assert columnar_column_names(path) == ['Name', 'Age', 'Score', 'Category']
+    pd.testing.assert_frame_equal(read_columnar(path), frame, check_dtype=False)
+
+def test_read_only_requested_columns(tmp_path, frame):
+    path = write_columnar(frame, str(tmp_path / 'data.arrow'))
+    df = read_columnar(path, columns=['Score', 'Missing', 'Score'])
+    assert df.columns.tolist() == ['Score']
+    assert df['Score'].tolist() == [85, 90, 82, 88]
+
+def test_mixed_type_columns_are_stored_as_text(tmp_path, frame):
+    frame['Score'] = pd.Series([85, 'N/A', 82.5, None], dtype=object)
+    path = write_columnar(frame, str(tmp_path / 'data.arrow'))
+    assert read_columnar(path, ['Score'])['Score'].tolist()[:3] == ['85', 'N/A', '82.5']
+    assert read_columnar(path, ['Score'])['Score'].isna().tolist() == [False, False, False, True]
+    assert read_columnar(path, ['Age'])['Age'].tolist() == [25, 30, 22, 25]
+    unmixed = frame.drop(columns='Score')
+    assert arrow_compatible(unmixed) is unmixed
+
+def test_batches_are_written_without_concatenating(tmp_path, frame, monkeypatch):
+    # Later chunks widen integers to decimals and to text, and fill a column that started out blank
+    chunks = [frame.assign(Notes=None),
+              frame.assign(Age=[25.5, 30, 22, 25], Notes=['x', None, 'y', 'x']),
+              frame.assign(Score=[85, 'N/A', 82, 88], Notes='y')]
+    expected, expected_report = compact_frame(arrow_compatible(pd.concat(chunks, ignore_index=True).infer_objects()))
+    expected_path = write_columnar(expected, str(tmp_path / 'expected.arrow'))
+
+    written = []
+    def stream():
+        for chunk in chunks:
+            yield chunk
+            written.append(len(os.listdir(tmp_path)))
+    monkeypatch.setattr(pd, 'concat', None)
+    compact, report = column_compactor()
+    path = write_columnar_batches(stream(), str(tmp_path / 'data.arrow'), compact)
+    monkeypatch.undo()
+
+    assert written == [2, 2, 2]  # the expected file and the one being written to
+    assert sorted(os.listdir(tmp_path)) == ['data.arrow', 'expected.arrow']
+    pd.testing.assert_frame_equal(read_columnar(path), read_columnar(expected_path))
+    assert report['converted'] == expected_report['converted']
+    assert read_columnar(path, ['Score'])['Score'].tolist()[8:] == ['85', 'N/A', '82', '88']
+
+def test_columnar_path_includes_digest():
+    assert columnar_path('uploads/a.xlsx', 'abcdef0123456789ffff') == 'uploads/a.xlsx.abcdef0123456789.arrow'
+    sheets = {columnar_path('uploads/a.xlsx', 'abcdef0123456789ffff', name) for name in ('Q1', 'Q2', 'Q1/Q2')}
+    assert len(sheets) == 3
+    assert all(path.startswith('uploads/a.xlsx.abcdef0123456789.') and '/Q' not in path for path in sheets)
+
+def test_converter_runs_once_per_destination(tmp_path, frame):
+    converter = ColumnarConverter(max_workers=1)
+    dest = str(tmp_path / 'data.arrow')
+    builds = []
+    def build():
+        builds.append(1)
+        return frame
+    converter.submit(dest, build).result()
+    converter.submit(dest, build).result()
+    assert converter.wait(dest)
+    assert os.path.exists(dest)
+    assert len(builds) == 1
@@ -0,0 +1,23 @@
+import gzip
+import pytest
+from werkzeug.http import parse_accept_header
+from compression import MIN_COMPRESS_BYTES, choose_encoding, compress_chunks
+
+def test_choose_encoding():
+    body_size = MIN_COMPRESS_BYTES * 10
+    assert choose_encoding(parse_accept_header('gzip, deflate'), body_size) == 'gzip'
+    assert choose_encoding(parse_accept_header(''), body_size) is None
+    assert choose_encoding(parse_accept_header('gzip;q=0'), body_size) is None
+    assert choose_encoding(parse_accept_header('gzip'), MIN_COMPRESS_BYTES - 1) is None
+
+def test_gzip_chunks_decompress_to_the_original():
+    data = b'{"bdata": "AAAAAAAA"}' * 20000
+    chunks = list(compress_chunks(data, 'gzip', chunk_size=4096))
+    assert len(chunks) > 1
+    assert gzip.decompress(b''.join(chunks)) == data
+    assert b''.join(compress_chunks(data, None, chunk_size=4096)) == data
+
+def test_brotli_chunks_decompress_to_the_original():
+    brotli = pytest.importorskip('brotli')
+    data = b'0123456789' * 10000
+    assert brotli.decompress(b''.join(compress_chunks(data, 'br', chunk_size=4096))) == data
@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+from dataset_cache import DatasetCache, file_digest
+
+def sized(nbytes):
+    """Cache whose entries report a fixed size, to make budgets predictable."""
+    return DatasetCache(nbytes, sizeof=lambda value: 10)
+
+def test_get_put_counts_hits_and_misses():
+    cache = sized(100)
+    assert cache.get('a') is None
+    cache.put('a', 'frame-a')
+    assert cache.get('a') == 'frame-a'
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['bytes'] == 10
+
+def test_lru_eviction_respects_budget():
+    cache = sized(20)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a') # 'b' is now least recently used
+    cache.put('c', 3)
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+    assert cache.stats()['evictions'] == 1
+    assert cache.current_bytes == 20
+
+def test_entry_larger_than_budget_is_not_kept():
+    cache = DatasetCache(1)
+    df = pd.DataFrame({'x': range(100)})
+    assert cache.put('big', df) is df
+    assert len(cache) == 0
+
+def test_get_or_load_calls_loader_once():
+    cache = sized(100)
+    calls = []
+    def loader():
+        calls.append(1)
+        return 'frame'
+    assert cache.get_or_load('k', loader) == 'frame'
+    assert cache.get_or_load('k', loader) == 'frame'
+    assert len(calls) == 1
+
+def test_failed_load_is_not_cached():
+    cache = sized(100)
+    def loader():
+        raise ValueError('bad file')
+    with pytest.raises(ValueError):
+        cache.get_or_load('k', loader)
+    assert 'k' not in cache
+
+def test_file_digest_changes_with_content(tmp_path):
+    path = tmp_path / 'data.xlsx'
+    path.write_bytes(b'first')
+    first = file_digest(str(path))
+    path.write_bytes(b'second content')
+    assert file_digest(str(path)) != first
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from downsample import downsample_indices, lttb_indices, minmax_indices
+
+def test_short_series_is_kept_whole():
+    x = np.arange(5.0)
+    assert lttb_indices(x, x, 10).tolist() == [0, 1, 2, 3, 4]
+    assert minmax_indices(x, 10).tolist() == [0, 1, 2, 3, 4]
+
+def test_lttb_keeps_ends_and_point_count():
+    x = np.arange(10000.0)
+    y = np.random.default_rng(0).normal(size=10000)
+    keep = lttb_indices(x, y, 100)
+    assert len(keep) == 100
+    assert keep[0] == 0 and keep[-1] == 9999
+    assert (np.diff(keep) > 0).all()
+
+def test_lttb_keeps_a_lone_spike():
+    y = np.zeros(10000)
+    y[4321] = 50.0
+    assert 4321 in lttb_indices(np.arange(10000.0), y, 50)
+
+def test_minmax_keeps_every_bucket_extreme():
+    y = np.random.default_rng(1).normal(size=10001)
+    y[777], y[9000] = 100.0, -100.0
+    keep = minmax_indices(y, 200)
+    assert len(keep) <= 200
+    assert 777 in keep and 9000 in keep
+    assert keep[0] == 0 and keep[-1] == 10000
+
+def test_minmax_bucket_sizes_that_do_not_divide_evenly():
+    y = np.arange(3000.0)
+    for n_out in (7, 200, 2999):
+        keep = minmax_indices(y, n_out)
+        assert len(keep) <= n_out
+        assert keep[0] == 0 and keep[-1] == 2999
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        downsample_indices(np.arange(100.0), np.arange(100.0), 10, method='every_nth')
@@ -0,0 +1,170 @@
+import datetime
+import os
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+from ingest import (compact_frame, frame_schema, infer_schema, iter_excel_batches, list_sheets, read_excel_sample,
+                    read_excel_streaming)
+
+@pytest.fixture
+def sample_xlsx_path():
+    return os.path.join(os.path.dirname(__file__), "test_data", "sample.xlsx")
+
+def write_workbook(path, rows):
+    workbook = Workbook()
+    sheet = workbook.active
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+    return str(path)
+
+def write_sheets(path, sheets):
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for name, rows in sheets.items():
+        sheet = workbook.create_sheet(name)
+        for row in rows:
+            sheet.append(row)
+    workbook.save(path)
+    return str(path)
+
+def test_matches_read_excel(sample_xlsx_path):
+    pd.testing.assert_frame_equal(read_excel_streaming(sample_xlsx_path), pd.read_excel(sample_xlsx_path))
+
+def test_batches_and_progress(tmp_path):
+    path = write_workbook(tmp_path / 'rows.xlsx', [('n', 'label')] + [(i, f'row {i}') for i in range(25)])
+    progress = []
+    chunks = list(iter_excel_batches(path, batch_rows=10, progress=lambda done, total: progress.append((done, total))))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    assert progress == [(10, 25), (20, 25), (25, 25)]
+
+def test_row_limit(tmp_path):
+    path = write_workbook(tmp_path / 'rows.xlsx', [('n',)] + [(i,) for i in range(25)])
+    df = read_excel_streaming(path, batch_rows=10, row_limit=12)
+    assert df['n'].tolist() == list(range(12))
+
+def test_read_only_some_columns(tmp_path):
+    path = write_workbook(tmp_path / 'rows.xlsx', [('n', 'label', 'score')] + [(i, f'row {i}', None) for i in range(5)]
+                          + [(None, None, 1.5)])
+    df = read_excel_streaming(path, columns=['score', 'n', 'missing'])
+    assert df.columns.tolist() == ['n', 'score']
+    pd.testing.assert_frame_equal(df, read_excel_streaming(path)[['n', 'score']])
+
+def test_sparse_column_stays_numeric_across_batches(tmp_path):
+    rows = [('id', 'value')] + [(i, None) for i in range(10)] + [(i, i * 1.5) for i in range(10, 15)]
+    path = write_workbook(tmp_path / 'sparse.xlsx', rows)
+    df = read_excel_streaming(path, batch_rows=5)
+    assert pd.api.types.is_numeric_dtype(df['value'])
+    assert df['value'].isna().sum() == 10
+
+def test_header_naming(tmp_path):
+    path = write_workbook(tmp_path / 'header.xlsx', [('a', None, 'a'), (1, 2, 3)])
+    assert read_excel_streaming(path).columns.tolist() == ['a', 'Unnamed: 1', 'a.1']
+
+def test_empty_and_malformed_workbooks(tmp_path):
+    empty = os.path.join(os.path.dirname(__file__), "test_data", "empty.xlsx")
+    malformed = os.path.join(os.path.dirname(__file__), "test_data", "malformed.xlsx")
+    with pytest.raises(pd.errors.EmptyDataError):
+        read_excel_streaming(empty)
+    with pytest.raises(pd.errors.ParserError):
+        read_excel_streaming(malformed)
+
+def test_infer_schema_reads_only_a_sample(tmp_path):
+    rows = [('n', 'label')] + [(i, f'row {i}') for i in range(50)] + [('text', 'late')]
+    path = write_workbook(tmp_path / 'rows.xlsx', rows)
+    schema = infer_schema(path, sample_rows=20)
+    assert schema['sampled_rows'] == 20
+    assert schema['columns'] == ['n', 'label']
+    assert schema['numerical_columns'] == ['n'] # the late text row is outside the sample
+    assert schema['categorical_columns'] == ['label']
+
+def test_sample_matches_streaming_read(tmp_path):
+    rows = [('n', None, 'label', 'when', 'flag', 'mixed')]
+    for i in range(40):
+        rows.append(() if i % 9 == 0 else
+                    (i * 1.5, None, f'row {i % 7}', datetime.datetime(2024, 1, 1) + datetime.timedelta(hours=i),
+                     bool(i % 2), i if i % 3 else 'N/A'))
+    path = write_workbook(tmp_path / 'mixed.xlsx', rows)
+    for sample_rows in (5, 1000):
+        pd.testing.assert_frame_equal(read_excel_sample(path, sample_rows),
+                                      read_excel_streaming(path, row_limit=sample_rows))
+
+def test_schema_time_does_not_grow_with_rows(tmp_path, monkeypatch):
+    def write_unique_labels(path, rows):
+        # Every label is distinct, so the shared strings table grows with the sheet
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet('Data')
+        sheet.append(['id', 'label', 'value'])
+        for i in range(rows):
+            sheet.append([i, f'label {i}', i * 0.5])
+        workbook.save(path)
+        return str(path)
+
+    def schema_seconds(path):
+        timings = []
+        for _ in range(3):
+            started = time.perf_counter()
+            schema = infer_schema(path, sample_rows=100)
+            timings.append(time.perf_counter() - started)
+        assert schema['sampled_rows'] == 100 and schema['categorical_columns'] == ['label']
+        return min(timings)
+
+    small = write_unique_labels(tmp_path / 'small.xlsx', 200)
+    large = write_unique_labels(tmp_path / 'large.xlsx', 20000)
+    import openpyxl
+    def fail_load(*args, **kwargs):
+        raise AssertionError('sampling a schema should not open the workbook model')
+    monkeypatch.setattr(openpyxl, 'load_workbook', fail_load)
+    assert schema_seconds(large) < 3 * schema_seconds(small) + 0.02
+
+def test_list_sheets_reads_only_metadata(tmp_path, monkeypatch):
+    path = write_sheets(tmp_path / 'multi.xlsx', {
+        'Sales': [('region', 'total')] + [('North', i) for i in range(9)],
+        'Costs & Fees': [('a', 'b', 'c'), (1, 2, 3)],
+    })
+    import openpyxl
+    def fail_load(*args, **kwargs):
+        raise AssertionError('listing sheets should not open the workbook model')
+    monkeypatch.setattr(openpyxl, 'load_workbook', fail_load)
+    assert list_sheets(path) == [{'name': 'Sales', 'rows': 10, 'columns': 2},
+                                 {'name': 'Costs & Fees', 'rows': 2, 'columns': 3}]
+
+def test_read_named_sheet(tmp_path):
+    path = write_sheets(tmp_path / 'multi.xlsx', {'First': [('x',), (1,)], 'Second': [('y', 'z'), ('a', 2.5)]})
+    assert read_excel_streaming(path).columns.tolist() == ['x']
+    df = read_excel_streaming(path, sheet_name='Second')
+    assert df.columns.tolist() == ['y', 'z']
+    assert infer_schema(path, sheet_name='Second')['numerical_columns'] == ['z']
+    with pytest.raises(ValueError, match='Sheet "Third" not found'):
+        read_excel_streaming(path, sheet_name='Third')
+
+def test_list_sheets_malformed(tmp_path):
+    malformed = os.path.join(os.path.dirname(__file__), "test_data", "malformed.xlsx")
+    with pytest.raises(pd.errors.ParserError):
+        list_sheets(malformed)
+
+def test_compact_frame_keeps_values_and_reports_savings():
+    n = 10000
+    df = pd.DataFrame({
+        'region': pd.Series(['North', 'South', 'East', 'West'] * (n // 4), dtype='str'),
+        'id': pd.Series([f'row {i}' for i in range(n)], dtype='str'),
+        'count': np.arange(n, dtype=np.int64) % 100,
+        'half': np.arange(n) / 2,
+        'ratio': np.arange(n) / 3,
+        'mixed': pd.Series(['a', 1] * (n // 2), dtype=object),
+    })
+    compacted, report = compact_frame(df)
+    assert report['converted'] == {'region': 'category', 'count': 'int8', 'half': 'float32'}
+    assert report['bytes_after'] < report['bytes_before']
+    assert compacted['region'].memory_usage(deep=True) < df['region'].memory_usage(deep=True) / 10
+    assert compacted['ratio'].dtype == np.float64 # float32 would round these
+    assert compacted['mixed'].dtype == object
+    for column in df.columns:
+        assert compacted[column].tolist() == df[column].tolist()
+    assert df['count'].dtype == np.int64 # the input frame is left alone
+
+    schema = frame_schema(compacted)
+    assert schema['numerical_columns'] == ['count', 'half', 'ratio']
+    assert schema['categorical_columns'] == ['region', 'id', 'mixed']
@@ -0,0 +1,36 @@
+from flask import Flask
+from instrumentation import MetricsRegistry, finish_request, note, stage, start_request
+
+def test_stage_is_a_no_op_outside_requests():
+    with stage('parse'):
+        value = 1
+    note('rows', 10)
+    assert value == 1
+
+def test_server_timing_header_and_metrics(tmp_path):
+    app = Flask(__name__)
+    metrics = MetricsRegistry(buckets=(0.1, 1))
+    metrics.add_collector('dataset_cache', lambda: {'hits': 3})
+
+    with app.test_request_context('/'):
+        start_request(profile=True)
+        with stage('parse'):
+            pass
+        note('chart_cache', 'hit')
+        note('rows', 4)
+        response = finish_request(app.response_class('body'), metrics, 'generate_chart', profile_dir=str(tmp_path))
+
+    header = response.headers['Server-Timing']
+    assert 'parse;dur=' in header
+    assert 'total;dur=' in header
+    assert 'chart_cache;desc="hit"' in header
+    assert 'bytes-out;desc="4"' in header
+    assert (tmp_path / response.headers['X-Profile']).exists()
+
+    text = metrics.render()
+    assert 'xlab_requests_total{endpoint="generate_chart",status="200"} 1' in text
+    assert 'xlab_response_bytes_total{endpoint="generate_chart"} 4' in text
+    assert 'xlab_request_events_total{endpoint="generate_chart",event="chart_cache",value="hit"} 1' in text
+    assert 'xlab_stage_seconds_bucket{endpoint="generate_chart",stage="parse",le="0.1"} 1' in text
+    assert 'xlab_stage_seconds_count{endpoint="generate_chart",stage="total"} 1' in text
+    assert 'xlab_dataset_cache_hits 3' in text
@@ -0,0 +1,162 @@
+import os
+import signal
+import time
+from concurrent.futures import Future
+import pytest
+import jobs as jobs_module
+from jobs import (JobCancelled, JobQueue, JobTimeout, QueueFull, batch_chart_job, batch_columns, chart_job,
+                  run_with_timeout)
+
+@pytest.fixture
+def queue():
+    queue = JobQueue(max_workers=1, max_pending=2, timeout=30, start_method='spawn')
+    yield queue
+    queue.shutdown(wait=False)
+
+def wait_until_finished(queue, job, timeout=60):
+    job.future.exception(timeout=timeout)
+    return queue.status(job)
+
+def test_run_with_timeout_interrupts_long_calls():
+    with pytest.raises(JobTimeout):
+        run_with_timeout(0.2, time.sleep, 5)
+    assert run_with_timeout(1, sum, [1, 2, 3]) == 6
+
+def test_identical_inflight_jobs_are_deduplicated(queue):
+    first = queue.submit('same-chart', time.sleep, 0.5)
+    second = queue.submit('same-chart', time.sleep, 0.5)
+    assert first is second
+    job = queue.submit('other-chart', dict, {'chart_html': '<div></div>'})
+    assert job is not first
+    assert wait_until_finished(queue, job)['state'] == 'done'
+
+def test_queue_is_bounded(queue):
+    queue.submit('a', time.sleep, 1)
+    queue.submit('b', time.sleep, 1)
+    with pytest.raises(QueueFull):
+        queue.submit('c', time.sleep, 1)
+
+def test_results_errors_and_success_callback(queue):
+    results = []
+    job = queue.submit('ok', dict, {'chart_html': '<div></div>', 'messages': []}, on_success=results.append)
+    assert wait_until_finished(queue, job) == {'job_id': job.id, 'state': 'done', 'messages': []}
+    assert results == [{'chart_html': '<div></div>', 'messages': []}]
+
+    failed = queue.submit('bad', dict, {'error': 'Column "Name" is not numerical.'}, on_success=results.append)
+    status = wait_until_finished(queue, failed)
+    assert status['state'] == 'failed'
+    assert status['error'] == 'Column "Name" is not numerical.'
+    assert len(results) == 1
+
+def test_cancel_discards_the_result(queue):
+    job = queue.submit('slow', time.sleep, 1)
+    queue.cancel(job.id)
+    assert queue.status(job)['state'] == 'cancelled'
+    assert queue.cancel('missing') is None
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGUSR1'), reason='running jobs are interrupted with SIGUSR1')
+def test_cancel_stops_a_running_job(queue):
+    job = queue.submit('slow', time.sleep, 20)
+    deadline = time.time() + 30
+    while queue.status(job)['state'] != 'running' and time.time() < deadline:
+        time.sleep(0.05)
+    started = time.time()
+    queue.cancel(job.id)
+    with pytest.raises(JobCancelled):
+        job.future.result(timeout=10)
+    assert time.time() - started < 5
+    assert queue.status(job)['state'] == 'cancelled'
+    # The worker is free for the next job
+    assert wait_until_finished(queue, queue.submit('next', dict, {'chart_html': ''}))['state'] == 'done'
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGUSR1'), reason='running jobs are interrupted with SIGUSR1')
+def test_cancels_close_together_stop_every_job(monkeypatch):
+    queue = JobQueue(max_workers=2, max_pending=2, timeout=30, start_method='spawn')
+    try:
+        jobs = [queue.submit(key, time.sleep, 20) for key in ('first', 'second')]
+        deadline = time.time() + 30
+        while any(job.started_at is None for job in jobs) and time.time() < deadline:
+            queue.stats()
+            time.sleep(0.05)
+        started = time.time()
+        for job in jobs:
+            queue.cancel(job.id)
+        # The second cancel didn't overwrite the first, whichever worker looks first
+        monkeypatch.setattr(jobs_module, '_cancelled_tokens', queue._cancelled_tokens)
+        assert all(jobs_module._is_cancelled(job.id) for job in jobs)
+        for job in jobs:
+            with pytest.raises(JobCancelled):
+                job.future.result(timeout=10)
+        assert time.time() - started < 5
+    finally:
+        queue.shutdown()
+
+def test_withdraw_cancels_once_no_submitter_wants_the_job(queue):
+    first = queue.submit('shared', time.sleep, 1)
+    second = queue.submit('shared', time.sleep, 1)
+    queue.withdraw(first)
+    assert queue.status(second)['state'] != 'cancelled'
+    queue.withdraw(second)
+    assert queue.status(second)['state'] == 'cancelled'
+
+def test_job_waits_for_another_future(queue):
+    conversion = Future()
+    job = queue.submit('after', dict, {'chart_html': '<div></div>'}, after=conversion)
+    time.sleep(0.2)
+    assert queue.status(job)['state'] == 'queued'
+    conversion.set_result('data.arrow')
+    assert wait_until_finished(queue, job)['state'] == 'done'
+
+    waiting = queue.submit('cancelled', dict, {}, after=Future())
+    queue.cancel(waiting.id)
+    assert queue.status(waiting)['state'] == 'cancelled'
+
+def test_time_limit_counts_from_when_a_worker_starts_the_job(monkeypatch):
+    # Where the parent has to time jobs itself, waiting for `after` doesn't count
+    monkeypatch.delattr(signal, 'SIGALRM', raising=False)
+    queue = JobQueue(max_workers=1, timeout=0.2, start_method='spawn')
+    try:
+        conversion = Future()
+        job = queue.submit('after', dict, {'chart_html': '<div></div>'}, after=conversion)
+        time.sleep(0.6)
+        assert queue.status(job)['state'] == 'queued'
+        conversion.set_result('data.arrow')
+        assert wait_until_finished(queue, job)['state'] == 'done'
+        assert job.started_at is not None and job.started_at >= job.submitted_at + 0.6
+    finally:
+        queue.shutdown()
+
+def test_completed_jobs_for_cache_hits(queue):
+    job = queue.add_completed('cached', {'chart_html': '<div></div>', 'messages': []})
+    assert queue.status(job)['state'] == 'done'
+    assert queue.get(job.id) is job
+
+def test_chart_job_applies_filters():
+    sample = os.path.join(os.path.dirname(__file__), 'test_data', 'sample.xlsx')
+    source = {'file_path': sample, 'store_path': None, 'batch_rows': 100, 'row_limit': None}
+    spec = {'chart_type': 'histogram', 'column': 'Score', 'bins': 10, 'filters': [['Category', '==', 'A']]}
+    assert 'Histogram of Score' in chart_job(source, spec)['chart_html']
+    spec['filters'] = [['Category', '==', 'Z']]
+    assert chart_job(source, spec) == {'error': 'Filter error: No rows match the selected filters.'}
+
+def test_batch_chart_job_renders_every_chart_from_one_load(monkeypatch):
+    import jobs
+    sample = os.path.join(os.path.dirname(__file__), 'test_data', 'sample.xlsx')
+    source = {'file_path': sample, 'store_path': None, 'batch_rows': 100, 'row_limit': None}
+    specs = [{'chart_type': 'histogram', 'column': 'Age', 'bins': 10},
+             {'chart_type': 'histogram', 'column': 'Score', 'bins': 10, 'filters': [['Category', '==', 'A']]},
+             {'chart_type': 'bar', 'x_column': 'Category', 'y_column': 'Score', 'agg': 'sum', 'filters': [['Category', '==', 'A']]},
+             {'chart_type': 'histogram', 'column': 'Name', 'bins': 10}]
+    assert batch_columns(specs) == ['Age', 'Score', 'Category', 'Name']
+
+    loads, filterings = [], []
+    real_load, real_filter = jobs.load_source, jobs.apply_filters
+    monkeypatch.setattr(jobs, 'load_source', lambda *args: loads.append(1) or real_load(*args))
+    monkeypatch.setattr(jobs, 'apply_filters', lambda *args: filterings.append(1) or real_filter(*args))
+    results = batch_chart_job(source, specs)
+    assert len(loads) == 1
+    assert len(filterings) == 2  # Unfiltered, and one shared Category == A
+    assert 'Histogram of Age' in results[0]['chart_html']
+    assert 'cdn.plot.ly' not in results[0]['chart_html']
+    assert 'Bar Chart: Score by Category' in results[2]['chart_html']
+    assert 'is not numerical' in results[3]['error']
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+from werkzeug.datastructures import MultiDict
+from query import QueryError, apply_filters, coerce_value, filter_spec, predicate_mask, validate_filters
+
+@pytest.fixture
+def frame():
+    return pd.DataFrame({
+        'Name': ['Alice', 'Bob', 'Charlie', 'David', None],
+        'Age': [25, 30, 22, 35, np.nan],
+        'Category': pd.Series(['A', 'B', 'A', 'B', 'A'], dtype='category'),
+        'Joined': pd.to_datetime(['2020-01-01', '2021-06-01', '2022-03-01', '2023-01-01', None]),
+    })
+
+def test_filter_spec_is_order_independent():
+    first = filter_spec(MultiDict([('filter_column', 'Age'), ('filter_op', '>'), ('filter_value', ' 25 '),
+                                   ('filter_column', 'Category'), ('filter_op', '=='), ('filter_value', 'B'),
+                                   ('filter_column', ''), ('filter_op', '=='), ('filter_value', '')]))
+    second = filter_spec(MultiDict([('filter_column', 'Category'), ('filter_op', '=='), ('filter_value', 'B'),
+                                    ('filter_column', 'Age'), ('filter_op', '>'), ('filter_value', '25')]))
+    assert first == second == [['Age', '>', '25'], ['Category', '==', 'B']]
+
+def test_validate_filters():
+    validate_filters([['Age', '>=', '25']])
+    with pytest.raises(QueryError, match='Unsupported operator'):
+        validate_filters([['Age', '=~', '25']])
+    with pytest.raises(QueryError, match='enter a value'):
+        validate_filters([['Age', '>', '']])
+
+def test_predicates_by_column_type(frame):
+    assert predicate_mask(frame['Age'], 'Age', '>', '25').tolist() == [False, True, False, True, False]
+    assert predicate_mask(frame['Category'], 'Category', 'in', 'B, C').tolist() == [False, True, False, True, False]
+    assert predicate_mask(frame['Name'], 'Name', '!=', 'Bob').tolist() == [True, False, True, True, False]
+    assert predicate_mask(frame['Joined'], 'Joined', '<', '2022-01-01').tolist() == [True, True, False, False, False]
+
+def test_invalid_values_and_operators(frame):
+    with pytest.raises(QueryError, match='not a valid value for column "Age"'):
+        predicate_mask(frame['Age'], 'Age', '>', 'thirty')
+    with pytest.raises(QueryError, match='needs a numerical or date column'):
+        coerce_value('Name', '>', 'B', frame['Name'].dtype)
+
+def test_apply_filters_ands_conditions(frame):
+    result = apply_filters(frame, [['Age', '>=', '25'], ['Category', '==', 'A']])
+    assert result['Name'].tolist() == ['Alice']
+    assert apply_filters(frame, []) is frame
+    with pytest.raises(QueryError, match='Column "Height" not found'):
+        apply_filters(frame, [['Height', '>', '1']])
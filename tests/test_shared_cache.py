@@ -0,0 +1,79 @@
+import json
+import threading
+import time
+import pytest
+from chart_cache import ChartCache
+from shared_cache import MemoryIndex, SharedCache, SqliteIndex
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def index(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryIndex()
+    return SqliteIndex(str(tmp_path / 'shared.sqlite'))
+
+def test_index_get_put_add_delete(index):
+    assert index.get('a') is None
+    index.put('a', '1')
+    assert index.get('a') == '1'
+    assert not index.add('a', '2')
+    index.delete('a', '2')
+    assert index.get('a') == '1'
+    index.delete('a')
+    assert index.add('a', '3')
+    index.put('b', 'gone', ttl=-1)
+    assert index.get('b') is None
+    assert index.add('b', 'fresh')
+
+def test_purge_deletes_expired_entries(index):
+    index.put('chart:old', 'rendered', ttl=-1)
+    index.put('chart:new', 'rendered', ttl=60)
+    index.put('claim:x', 'pid:1')
+    assert index.purge() == 1
+    assert index.purge() == 0
+    assert index.get('chart:new') == 'rendered' and index.get('claim:x') == 'pid:1'
+
+def test_digests_expire(index):
+    cache = SharedCache(index, digest_ttl=-1)
+    cache.put_digest(['a.xlsx', 10, 1], 'abc')
+    assert cache.purge() == 1
+    assert cache.get_digest(['a.xlsx', 10, 1]) is None
+
+def test_sqlite_index_is_shared_between_connections(tmp_path):
+    path = str(tmp_path / 'shared.sqlite')
+    first, second = SqliteIndex(path), SqliteIndex(path)
+    first.put('chart:x', 'rendered')
+    assert second.get('chart:x') == 'rendered'
+    assert first.add('claim:y', 'pid:1')
+    assert not second.add('claim:y', 'pid:2')
+
+def test_charts_rendered_by_one_worker_are_served_to_another(index):
+    first = ChartCache(max_bytes=1000, ttl_seconds=60, shared=SharedCache(index, owner='worker-1'))
+    second = ChartCache(max_bytes=1000, ttl_seconds=60, shared=SharedCache(index, owner='worker-2'))
+    first.put('key', {'chart_html': '<div></div>', 'messages': []})
+    assert second.get('key') == {'chart_html': '<div></div>', 'messages': []}
+    assert second.stats()['hits'] == 1
+
+    # A chart's age carries over, so it expires everywhere when it would have where it was rendered
+    index.put('chart:old', json.dumps({'value': {'chart_html': '<div></div>'}, 'stored_at': time.time() - 120}), ttl=60)
+    assert second.get('old') is None
+
+def test_claims_let_one_worker_convert_while_others_wait(index, tmp_path):
+    first = SharedCache(index, owner='worker-1')
+    second = SharedCache(index, owner='worker-2')
+    target = str(tmp_path / 'data.arrow')
+    assert first.claim(target)
+    assert first.claim(target)  # Re-entrant for the holder
+    assert not second.claim(target)
+
+    def convert():
+        time.sleep(0.2)
+        open(target, 'w').close()
+        first.release(target)
+    threading.Thread(target=convert).start()
+    assert second.wait_for(target, target, timeout=10)
+    assert second.claim(target)
+
+    # Nobody holds the claim: no waiting for a file that isn't coming
+    started = time.monotonic()
+    assert not second.wait_for('other', str(tmp_path / 'other.arrow'), timeout=10)
+    assert time.monotonic() - started < 1
@@ -0,0 +1,114 @@
+import os
+import time
+import pytest
+import storage
+from storage import QuotaExceeded, StorageManager, Sweeper
+
+def stored(root, name, size):
+    object_dir = root / name
+    object_dir.mkdir()
+    path = object_dir / 'data.xlsx'
+    path.write_bytes(b'x' * size)
+    return str(path)
+
+def test_existing_objects_are_adopted(tmp_path):
+    stored(tmp_path, 'a', 10)
+    (tmp_path / 'a' / 'data.xlsx.0123.arrow').write_bytes(b'y' * 5)
+    (tmp_path / '.partial').mkdir()
+    manager = StorageManager(str(tmp_path))
+    assert manager.stats()['objects'] == 1
+    assert manager.usage() == 15
+    assert manager.touch(str(tmp_path / 'a' / 'data.xlsx'))
+    assert not manager.touch(str(tmp_path / 'b' / 'data.xlsx'))
+
+def test_session_quota_evicts_own_oldest_uploads(tmp_path):
+    evicted = []
+    manager = StorageManager(str(tmp_path), session_max_bytes=25, on_evict=evicted.append)
+    first = stored(tmp_path, 'a', 10)
+    manager.add(first, 'alice')
+    shared = stored(tmp_path, 'b', 10)
+    manager.add(shared, 'alice')
+    manager.add(shared, 'bob')
+    manager.add(stored(tmp_path, 'c', 10), 'alice')
+    assert evicted == [first]
+    assert not os.path.exists(first)
+    assert manager.usage('alice') == 20
+
+    manager.add(stored(tmp_path, 'd', 10), 'alice')
+    # No longer counted for alice, but still held by bob
+    assert os.path.exists(shared)
+    assert manager.usage('bob') == 10
+
+    with pytest.raises(QuotaExceeded):
+        manager.add(stored(tmp_path, 'e', 30), 'alice')
+    assert not os.path.exists(tmp_path / 'e')
+
+def test_sweep_evicts_expired_then_least_recently_used(tmp_path):
+    manager = StorageManager(str(tmp_path), max_bytes=25, ttl_seconds=3600)
+    old = stored(tmp_path, 'a', 10)
+    manager.add(old)
+    recent = stored(tmp_path, 'b', 10)
+    manager.add(recent)
+    manager.touch(old)
+    now = time.time()
+    assert manager.sweep(now) == []
+    # A derived artifact pushes the total over budget: the least recently used object goes
+    (tmp_path / 'a' / 'data.xlsx.stats.json').write_bytes(b'z' * 10)
+    assert manager.sweep(now) == [recent]
+    assert manager.sweep(now + 7200) == [old]
+    assert manager.stats() == {'objects': 0, 'bytes': 0, 'max_bytes': 25, 'evictions': 2}
+
+def test_worker_processes_see_each_others_uses_and_uploads(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'ACCESS_WRITE_INTERVAL', 0)
+    evicted = []
+    first = StorageManager(str(tmp_path), ttl_seconds=3600, session_max_bytes=15, on_evict=evicted.append)
+    second = StorageManager(str(tmp_path), ttl_seconds=3600, session_max_bytes=15)
+    path = stored(tmp_path, 'a', 10)
+    second.add(path, 'alice')
+    two_hours_ago = time.time() - 7200
+    os.utime(tmp_path / 'a', (two_hours_ago, two_hours_ago))
+    # In use through the second worker: the first one's sweep keeps it
+    assert second.touch(path)
+    assert first.sweep() == []
+    os.utime(tmp_path / 'a', (two_hours_ago, two_hours_ago))
+    assert StorageManager(str(tmp_path), ttl_seconds=3600).sweep() == [path]
+
+    # The quota counts a session's uploads through every worker
+    older = stored(tmp_path, 'b', 10)
+    first.add(older, 'alice')
+    second.add(stored(tmp_path, 'c', 10), 'alice')
+    assert not os.path.exists(older)
+    assert not first.touch(older)
+    assert older in evicted
+
+def test_uploads_only_reread_their_owners_objects(tmp_path, monkeypatch):
+    manager = StorageManager(str(tmp_path), session_max_bytes=100)
+    for name in ('a', 'b', 'c'):
+        stored(tmp_path, name, 10)
+    other = StorageManager(str(tmp_path), session_max_bytes=100)
+    other.add(stored(tmp_path, 'd', 10), 'alice')
+    read = []
+    monkeypatch.setattr(storage, 'directory_bytes', lambda path: read.append(os.path.basename(path)) or 10)
+    manager.add(stored(tmp_path, 'e', 10), 'alice')
+    # The upload itself and alice's upload through the other worker, not everyone else's
+    assert sorted(set(read)) == ['d', 'e']
+    assert manager.usage('alice') == 20
+
+    # Sweeps still re-read everything, and forget evicted objects in the session lists
+    other.evict(str(tmp_path / 'd'))
+    read.clear()
+    manager.sweep()
+    assert sorted(set(read)) == ['a', 'b', 'c', 'e']
+    sessions = tmp_path / storage.SESSIONS_DIR
+    assert [path.read_text() for path in sessions.iterdir()] == ['e\n']
+
+def test_sweeper_keeps_running_after_a_failing_task():
+    calls = []
+    def failing():
+        raise RuntimeError('disk gone')
+    sweeper = Sweeper(0.01, [failing, lambda: calls.append(1)]).start()
+    deadline = time.time() + 5
+    while len(calls) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    sweeper.stop()
+    assert len(calls) >= 2